@@ -15,6 +15,8 @@ import django
 django.setup()
 
 # Import models now that the Django environment is configured
+from crm.aggregates import recompute
+from crm.rollups import rebuild
 from crm.models import Customer, Order, Product
 
 
@@ -288,7 +290,10 @@ def create_orders(customers, products):
         total_amount = Decimal("0.00")
         for product in selected_products:
             quantity = random.randint(1, 3)
-            order.products.add(product, through_defaults={"quantity": quantity})
+            order.products.add(
+                product,
+                through_defaults={"quantity": quantity, "unit_price": product.price},
+            )
             total_amount += product.price * quantity
             product_usage[product.id] += 1
 
@@ -331,7 +336,10 @@ def create_orders(customers, products):
         total_amount = Decimal("0.00")
         for product in selected_products:
             quantity = random.randint(1, 2)
-            order.products.add(product, through_defaults={"quantity": quantity})
+            order.products.add(
+                product,
+                through_defaults={"quantity": quantity, "unit_price": product.price},
+            )
             total_amount += product.price * quantity
             product_usage[product.id] += 1
 
@@ -360,7 +368,10 @@ def create_orders(customers, products):
         total_amount = Decimal("0.00")
         for product in selected_products:
             quantity = random.randint(1, 2)
-            order.products.add(product, through_defaults={"quantity": quantity})
+            order.products.add(
+                product,
+                through_defaults={"quantity": quantity, "unit_price": product.price},
+            )
             total_amount += product.price * quantity
             product_usage[product.id] += 1
 
@@ -404,6 +415,11 @@ def main():
     # Create orders
     orders = create_orders(customers, products)
 
+    # Orders created here bypass CreateOrder, so compute the customer totals
+    # and the daily sales rollups
+    recompute()
+    rebuild()
+
     print("=" * 50)
     print("Database population completed successfully!")
     print("Summary:")
@@ -18,13 +18,30 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import conditional_page
+
+from crm.views import AsyncCRMGraphQLView, CRMGraphQLView, export
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     #    path("", include("crm.urls"))]
 ]
 
+
+def graphql_view(view):
+    """
+    Wrap a GraphQL view: GET responses get a weak content-hash ETag and a 304
+    answers a matching If-None-Match; responses are gzipped for clients
+    accepting it.
+    """
+    return csrf_exempt(gzip_page(conditional_page(view)))
+
+
 urlpatterns += [
-    path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path("graphql/", graphql_view(CRMGraphQLView.as_view(graphiql=True))),
+    # Under ASGI, resolves the root fields of a query concurrently.
+    path("graphql/async/", graphql_view(AsyncCRMGraphQLView.as_view(graphiql=True))),
+    # Streaming NDJSON/CSV exports: /export/orders/?format=csv&order_date__gte=...
+    path("export/<str:kind>/", export),
 ]
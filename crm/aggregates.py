@@ -0,0 +1,91 @@
+"""crm/aggregates.py
+This file contains the maintenance of the per-customer order aggregates:
+``order_count``, ``lifetime_value``, ``first_order_date`` and
+``last_order_date``.
+
+They are updated with one UPDATE in the transaction that places or deletes an
+order, so reading them never scans the orders table.
+``manage.py crm_repair_aggregates`` recomputes them in bulk.
+"""
+
+from django.db.models import Count, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.db.models.signals import post_delete
+
+from crm.models import ArchivedOrder, Customer, Order
+
+
+def record_order(order):
+    """Add a new order to its customer's aggregates."""
+    Customer.objects.filter(pk=order.customer_id).update(
+        order_count=F("order_count") + 1,
+        lifetime_value=F("lifetime_value") + order.total_amount,
+        first_order_date=Coalesce(
+            Least("first_order_date", Value(order.order_date)),
+            Value(order.order_date),
+        ),
+        last_order_date=Coalesce(
+            Greatest("last_order_date", Value(order.order_date)),
+            Value(order.order_date),
+        ),
+    )
+
+
+def remove_order(sender, instance, **kwargs):
+    """
+    Signal receiver taking a deleted order out of its customer's aggregates.
+    The first and last dates cannot be decremented, so the customer's row is
+    recomputed with one UPDATE reading the (customer, order_date) indexes.
+    """
+    recompute(Customer.objects.filter(pk=instance.customer_id))
+
+
+def per_customer(aggregate):
+    """
+    Return ``aggregate`` of the customer's hot orders and of its archived
+    orders, as two subqueries: each reads the (customer, order_date) index of
+    its table, which the OrderHistory view would hide.
+    """
+    return [
+        Subquery(
+            model.objects.filter(customer_id=OuterRef("pk"))
+            .order_by()
+            .values("customer_id")
+            .annotate(value=aggregate)
+            .values("value")
+        )
+        for model in (Order, ArchivedOrder)
+    ]
+
+
+def recompute(customers=None):
+    """
+    Recompute the aggregates of ``customers`` (all by default) from the
+    orders, archived ones included, with one UPDATE, and return the number of
+    customers.
+    """
+    if customers is None:
+        customers = Customer.objects.all()
+    zero = Value(0, output_field=Customer._meta.get_field("lifetime_value"))
+    hot_count, archived_count = per_customer(Count("pk"))
+    hot_value, archived_value = per_customer(Sum("total_amount"))
+    hot_first, archived_first = per_customer(Min("order_date"))
+    hot_last, archived_last = per_customer(Max("order_date"))
+    updated = customers.update(
+        order_count=Coalesce(hot_count, 0) + Coalesce(archived_count, 0),
+        lifetime_value=Coalesce(hot_value, zero) + Coalesce(archived_value, zero),
+        first_order_date=Coalesce(
+            Least(hot_first, archived_first), hot_first, archived_first
+        ),
+        last_order_date=Coalesce(
+            Greatest(hot_last, archived_last), hot_last, archived_last
+        ),
+    )
+    return updated
+
+
+def connect_signals():
+    """Connect the deletion receiver, called from CrmConfig.ready()."""
+    post_delete.connect(
+        remove_order, sender=Order, dispatch_uid="crm-aggregates-remove-order"
+    )
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
+
+    def ready(self):
+        from crm import aggregates, archive, response_cache
+
+        response_cache.connect_signals()
+        aggregates.connect_signals()
+        archive.connect_signals()
@@ -0,0 +1,226 @@
+"""crm/archive.py
+This file contains the hot/cold archiving of orders.
+
+``archive_orders`` moves the orders placed before a horizon, with their
+lines, from crm_order to crm_order_archive in batches, keeping their ids, and
+adds them to the daily OrderArchiveSummary rows. Reads pick their table with
+``orders_for``: the hot Order table unless the requested range reaches
+archived orders, OrderHistory (both tables) otherwise. Statistics add
+``archive_statistics`` to what they read from the hot table.
+"""
+
+import datetime
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete
+from django.utils import timezone
+
+from crm.models import (
+    ArchivedOrder,
+    ArchivedOrderLine,
+    Order,
+    OrderArchiveSummary,
+    OrderHistory,
+    OrderLine,
+)
+from crm.response_cache import invalidate
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# The views read by OrderHistory and OrderLineHistory: view, columns, hot
+# table, archive table.
+HISTORY_VIEWS = [
+    (
+        "crm_order_history",
+        "id, customer_id, total_amount, order_date",
+        "crm_order",
+        "crm_order_archive",
+    ),
+    (
+        "crm_order_products_history",
+        "id, order_id, product_id, quantity, unit_price",
+        "crm_order_products",
+        "crm_order_products_archive",
+    ),
+]
+
+
+def install_views(using=connection):
+    """
+    Create the history views. SQLite cannot remake a table a view reads, so a
+    migration remaking one of these tables runs ``uninstall_views`` first and
+    this afterwards.
+    """
+    with using.cursor() as cursor:
+        for view, columns, hot, archive in HISTORY_VIEWS:
+            cursor.execute(f"DROP VIEW IF EXISTS {view}")
+            cursor.execute(
+                f"CREATE VIEW {view} AS SELECT {columns} FROM {hot} "
+                f"UNION ALL SELECT {columns} FROM {archive}"
+            )
+
+
+def uninstall_views(using=connection):
+    """Drop the history views."""
+    with using.cursor() as cursor:
+        for view, _, _, _ in HISTORY_VIEWS:
+            cursor.execute(f"DROP VIEW IF EXISTS {view}")
+
+
+def get_horizon(days=None):
+    """Return the date before which orders are archived."""
+    if days is None:
+        days = getattr(settings, "CRM_ARCHIVE_AFTER_DAYS", 365)
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def reaches_archive(start=None, end=None):
+    """Tell whether archived orders were placed from ``start`` to ``end``."""
+    archived = ArchivedOrder.objects.all()
+    if start is not None:
+        archived = archived.filter(order_date__gte=start)
+    if end is not None:
+        archived = archived.filter(order_date__lte=end)
+    return archived.exists()
+
+
+def orders_for(start=None, end=None):
+    """
+    Return the orders to read for a range from ``start`` to ``end`` (both
+    optional and inclusive). Unranged reads list the hot orders without
+    probing the archive; archived orders are listed by a range reaching
+    them, bounded on either side.
+    """
+    if (start is not None or end is not None) and reaches_archive(start, end):
+        return OrderHistory.objects.all()
+    return Order.objects.all()
+
+
+def midnight(value):
+    """Return the UTC midnight starting the day of ``value``."""
+    return value.astimezone(datetime.timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def summarize(orders, sign=1):
+    """Add ``orders`` to their day's summary, or take them out with ``sign=-1``."""
+    days = (
+        orders.annotate(day=TruncDate("order_date", tzinfo=datetime.timezone.utc))
+        .order_by()
+        .values("day")
+        .annotate(order_count=Count("pk"), total_revenue=Sum("total_amount"))
+    )
+    for row in days:
+        OrderArchiveSummary.objects.get_or_create(day=row["day"])
+        OrderArchiveSummary.objects.filter(day=row["day"]).update(
+            order_count=F("order_count") + sign * row["order_count"],
+            total_revenue=F("total_revenue") + sign * row["total_revenue"],
+        )
+
+
+def archive_orders(before, batch_size=None):
+    """
+    Move the orders placed before ``before`` to the archive, oldest first and
+    one transaction per batch, and return how many were moved.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, "CRM_ARCHIVE_BATCH_SIZE", 1000)
+
+    old = Order.objects.filter(order_date__lt=before).order_by("order_date", "pk")
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ids = list(old.values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+
+            orders = Order.objects.filter(pk__in=ids)
+            lines = OrderLine.objects.filter(order_id__in=ids)
+            ArchivedOrder.objects.bulk_create(
+                ArchivedOrder(**row)
+                for row in orders.values(
+                    "id", "customer_id", "total_amount", "order_date"
+                )
+            )
+            ArchivedOrderLine.objects.bulk_create(
+                ArchivedOrderLine(**row)
+                for row in lines.values(
+                    "id", "order_id", "product_id", "quantity", "unit_price"
+                )
+            )
+            summarize(orders)
+
+            lines.delete()
+            # The customers' aggregates cover the archive too, so the
+            # per-order delete signals would have nothing to change.
+            orders._raw_delete(orders.db)
+        moved += len(ids)
+
+    if moved:
+        invalidate(Order)
+    return moved
+
+
+def archive_statistics(start=None, end=None):
+    """
+    Return the number and total amount of the archived orders placed from
+    ``start`` to ``end`` (both optional and inclusive). Days wholly in the
+    range are read from the summaries; only the partial days at its ends are
+    read from the archive, through its order_date index.
+    """
+    summaries = OrderArchiveSummary.objects.all()
+    in_range = Q()
+    edges = []
+    if start is not None:
+        first_day = midnight(start)
+        if first_day < start:
+            first_day += ONE_DAY
+        summaries = summaries.filter(day__gte=first_day.date())
+        in_range &= Q(order_date__gte=start)
+        edges.append(Q(order_date__lt=first_day))
+    if end is not None:
+        last_day = midnight(end)
+        summaries = summaries.filter(day__lt=last_day.date())
+        in_range &= Q(order_date__lte=end)
+        edges.append(Q(order_date__gte=last_day))
+
+    totals = summaries.aggregate(
+        order_count=Sum("order_count"), total_revenue=Sum("total_revenue")
+    )
+    order_count = totals["order_count"] or 0
+    total_revenue = totals["total_revenue"] or Decimal(0)
+
+    if edges:
+        rest = (
+            ArchivedOrder.objects.filter(in_range)
+            .filter(reduce(or_, edges))
+            .aggregate(order_count=Count("pk"), total_revenue=Sum("total_amount"))
+        )
+        order_count += rest["order_count"]
+        total_revenue += rest["total_revenue"] or 0
+
+    return order_count, total_revenue
+
+
+def remove_archived_order(sender, instance, **kwargs):
+    """Signal receiver taking a deleted archived order out of its summary."""
+    OrderArchiveSummary.objects.filter(day=midnight(instance.order_date).date()).update(
+        order_count=F("order_count") - 1,
+        total_revenue=F("total_revenue") - instance.total_amount,
+    )
+
+
+def connect_signals():
+    """Connect the deletion receiver, called from CrmConfig.ready()."""
+    post_delete.connect(
+        remove_archived_order,
+        sender=ArchivedOrder,
+        dispatch_uid="crm-archive-remove-order",
+    )
@@ -0,0 +1,190 @@
+"""crm/cost.py
+This file contains the static cost analysis run on every GraphQL operation
+after validation and before execution.
+
+The cost estimates the rows an operation can return from the ``first`` /
+``last`` arguments of each connection (or the relay max limit when they are
+missing), multiplied through every level of nesting. Plain list fields count
+as many rows as their ``limit`` argument, the maximum configured in
+LIST_MAX_SETTINGS, or the relay max limit.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from graphene import relay
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLObjectType,
+    InlineFragmentNode,
+    OperationType,
+    Undefined,
+    get_named_type,
+    get_nullable_type,
+    is_list_type,
+    value_from_ast,
+)
+
+CONNECTION_WRAPPERS = {"edges", "node"}
+# Settings (with their defaults) bounding list fields without a limit.
+LIST_MAX_SETTINGS = {
+    "salesTimeseries": ("CRM_SALES_TIMESERIES_MAX_POINTS", 10000),
+}
+
+
+class QueryCost:
+    """
+    Estimated cost of one operation.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.joins = 0
+        self.depth = 0
+
+    def as_dict(self):
+        """Return the cost for the response ``extensions``."""
+        return {"rows": self.rows, "joins": self.joins, "depth": self.depth}
+
+
+def is_connection(object_type):
+    """Tell whether a GraphQL object type is a relay connection."""
+    graphene_type = getattr(object_type, "graphene_type", None)
+    return graphene_type is not None and issubclass(graphene_type, relay.Connection)
+
+
+def page_size(field, field_node, variables):
+    """Return the page size requested on a connection field."""
+    sizes = []
+    for argument in field_node.arguments:
+        name = argument.name.value
+        if name in ("first", "last"):
+            value = value_from_ast(argument.value, field.args[name].type, variables)
+            # Variables are not coerced yet: execution reports invalid ones.
+            # A negative size counts as 0, never lowering a sibling's cost.
+            if isinstance(value, int):
+                sizes.append(max(0, value))
+    if sizes:
+        return min(sizes)
+    return graphene_settings.RELAY_CONNECTION_MAX_LIMIT or 1
+
+
+def list_size(field, field_node, variables):
+    """Return the longest list a plain list field can return."""
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT or 1
+    name = field_node.name.value
+    if name in LIST_MAX_SETTINGS:
+        return getattr(settings, *LIST_MAX_SETTINGS[name])
+    if "limit" not in field.args:
+        return max_limit
+
+    limit = field.args["limit"].default_value
+    for argument in field_node.arguments:
+        if argument.name.value == "limit":
+            value = value_from_ast(argument.value, field.args["limit"].type, variables)
+            if value is not Undefined:
+                limit = value
+    if not isinstance(limit, int):
+        return max_limit
+    return max(1, min(limit, max_limit))
+
+
+def analyze(schema, document, operation_ast, variables=None):
+    """Return the QueryCost of ``operation_ast``."""
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    cost = QueryCost()
+
+    def walk(parent_type, selection_set, multiplier, depth):
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, InlineFragmentNode):
+                walk(parent_type, selection.selection_set, multiplier, depth)
+                continue
+            if isinstance(selection, FragmentSpreadNode):
+                fragment = fragments.get(selection.name.value)
+                if fragment is not None:
+                    walk(parent_type, fragment.selection_set, multiplier, depth)
+                continue
+            if not isinstance(selection, FieldNode):
+                continue
+
+            name = selection.name.value
+            fields = getattr(parent_type, "fields", {})
+            if name.startswith("__") or name not in fields:
+                continue
+
+            field = fields[name]
+            field_type = get_named_type(field.type)
+            if not isinstance(field_type, GraphQLObjectType):
+                continue
+
+            if name in CONNECTION_WRAPPERS or field_type.name == "PageInfo":
+                walk(field_type, selection.selection_set, multiplier, depth)
+                continue
+
+            level = depth + 1
+            cost.depth = max(cost.depth, level)
+            if depth > 0:
+                cost.joins += 1
+
+            if is_connection(field_type):
+                rows = multiplier * page_size(field, selection, variables or {})
+            elif is_list_type(get_nullable_type(field.type)):
+                rows = multiplier * list_size(field, selection, variables or {})
+            else:
+                rows = multiplier
+            cost.rows += rows
+            walk(field_type, selection.selection_set, rows, level)
+
+    root_type = {
+        OperationType.QUERY: schema.query_type,
+        OperationType.MUTATION: schema.mutation_type,
+        OperationType.SUBSCRIPTION: schema.subscription_type,
+    }[operation_ast.operation]
+    walk(root_type, operation_ast.selection_set, 1, 0)
+    return cost
+
+
+def check(cost, client_id):
+    """
+    Return an error message when the operation must not run, else None.
+    Operations over CRM_QUERY_MAX_COST rows or CRM_QUERY_MAX_DEPTH levels are
+    rejected; CRM_QUERY_COST_BUDGET throttles the rows a client may request
+    per CRM_QUERY_COST_WINDOW seconds.
+    """
+    max_depth = getattr(settings, "CRM_QUERY_MAX_DEPTH", None)
+    if max_depth is not None and cost.depth > max_depth:
+        return f"Query depth {cost.depth} exceeds the maximum depth of {max_depth}."
+
+    max_cost = getattr(settings, "CRM_QUERY_MAX_COST", None)
+    if max_cost is not None and cost.rows > max_cost:
+        return f"Query cost {cost.rows} exceeds the maximum cost of {max_cost}."
+
+    budget = getattr(settings, "CRM_QUERY_COST_BUDGET", None)
+    if budget is None:
+        return None
+
+    window = getattr(settings, "CRM_QUERY_COST_WINDOW", 60)
+    bucket = int(time.time() // window)
+    key = f"crm:query-cost:{client_id}:{bucket}"
+    backend = caches["default"]
+    backend.add(key, 0, timeout=window)
+    try:
+        spent = backend.incr(key, cost.rows)
+    except ValueError:
+        backend.set(key, cost.rows, timeout=window)
+        spent = cost.rows
+
+    if spent > budget:
+        retry = int(window - time.time() % window) + 1
+        return f"Query cost budget of {budget} exceeded, retry in {retry} seconds."
+    return None
@@ -0,0 +1,144 @@
+"""crm/counting.py
+This file contains the count strategies behind ``totalCount`` on the CRM
+connections.
+
+- exact: a COUNT(*) of the filtered queryset.
+- cached: the exact count, cached under the SQL of the filters and the
+  response cache versions of the models the connection reads, so a write to
+  any of them invalidates it (see crm.response_cache).
+- estimated: the planner statistics, for free: the table row count for an
+  unfiltered connection (sqlite_stat1 after ANALYZE, pg_class.reltuples on
+  PostgreSQL) and the EXPLAIN row estimate of a filtered one on PostgreSQL.
+  SQLite only has statistics after an ANALYZE, which ``analyze`` runs after
+  each import and from the nightly ``crm.tasks.analyze_tables`` task.
+
+A strategy that cannot produce a number falls back to an exact count, and
+``countStrategy`` reports the strategy that did.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from crm.models import Customer, Order, Product
+from crm.response_cache import get_backend, get_versions
+
+EXACT = "exact"
+CACHED = "cached"
+ESTIMATED = "estimated"
+COUNT_KEY = "crm:count:{}"
+# Models whose writes can change a count, by node model: the order filters
+# read customers and products too.
+DEPENDENCIES = {Order: (Customer, Order, Product)}
+
+
+def cache_key(queryset, models):
+    """Return the cache key of the count of ``queryset``."""
+    sql, params = queryset.order_by().values("pk").query.sql_with_params()
+    payload = json.dumps([queryset.db, sql, params, get_versions(models)], default=str)
+    return COUNT_KEY.format(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+
+def table_estimate(connection, table):
+    """Return the row count the planner statistics give ``table``, or None."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table]
+            )
+            row = cursor.fetchone()
+            # -1 until the table is first analyzed.
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == "sqlite":
+            # Every row of sqlite_stat1 starts with the table's row count.
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+def analyze(using="default"):
+    """
+    Refresh the planner statistics of the customers, products and orders
+    tables, which the estimated counts read.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model in (Customer, Order, Product):
+            cursor.execute(f"ANALYZE {quote(model._meta.db_table)}")
+
+
+def estimate(queryset):
+    """Return the planner's estimate of the rows of ``queryset``, or None."""
+    connection = connections[queryset.db]
+    query = queryset.query
+    try:
+        if not query.where and not query.combinator:
+            return table_estimate(connection, queryset.model._meta.db_table)
+        if connection.vendor == "postgresql":
+            sql, params = queryset.order_by().values("pk").query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+    except DatabaseError:
+        # No statistics table yet (SQLite before the first ANALYZE).
+        return None
+    return None
+
+
+def count(queryset, strategy, models):
+    """
+    Return the number of rows of ``queryset`` with ``strategy``, and the
+    strategy that produced it.
+    """
+    if queryset.query.is_empty():
+        return 0, EXACT
+
+    if strategy == ESTIMATED:
+        value = estimate(queryset)
+        if value is not None:
+            return value, ESTIMATED
+        return queryset.count(), EXACT
+
+    if strategy == CACHED:
+        backend = get_backend()
+        key = cache_key(queryset, models)
+        value = backend.get(key)
+        if value is not None:
+            return value, CACHED
+        value = queryset.count()
+        backend.set(
+            key, value, timeout=getattr(settings, "CRM_COUNT_CACHE_TIMEOUT", 300)
+        )
+        return value, EXACT
+
+    return queryset.count(), EXACT
+
+
+class TotalCount:
+    """
+    The totalCount of one connection page.
+    The count runs once, and only when the client selects totalCount or
+    countStrategy; a list from the DataLoaders is counted in memory.
+    """
+
+    def __init__(self, iterable, strategy, model):
+        self.iterable = iterable
+        self.strategy = strategy or getattr(settings, "CRM_COUNT_STRATEGY", EXACT)
+        self.models = DEPENDENCIES.get(model, (model,))
+        self.result = None
+
+    def resolve(self):
+        """Return the (count, strategy used) pair, counting on first use."""
+        if self.result is None:
+            if isinstance(self.iterable, list):
+                self.result = len(self.iterable), EXACT
+            else:
+                self.result = count(self.iterable, self.strategy, self.models)
+        return self.result
@@ -0,0 +1,95 @@
+"""crm/documents.py
+This file contains the caches used by the GraphQL view to avoid parsing and
+validating the same query documents over and over.
+
+Documents are keyed by the SHA-256 hash of the query text, which is also the
+key clients use for automatic persisted queries.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from graphql import parse
+from graphql.validation import validate
+
+
+def query_hash(query):
+    """Return the SHA-256 hex digest of a query text."""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with hit/miss counters.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for ``key`` or None."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def set(self, key, value):
+        """Store ``value``, evicting the least recently used entries."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return the cache counters."""
+        return {
+            "size": len(self),
+            "maxSize": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+document_cache = LRUCache(getattr(settings, "CRM_DOCUMENT_CACHE_SIZE", 256))
+persisted_queries = LRUCache(getattr(settings, "CRM_PERSISTED_QUERIES_SIZE", 1024))
+
+
+def get_document(schema, query, validation_rules=None, max_errors=None):
+    """
+    Return ``(document, errors, hit)`` for a query text, parsing and
+    validating it only the first time it is seen. Syntax errors are raised,
+    not cached.
+    """
+    key = query_hash(query)
+    cached = document_cache.get(key)
+    if cached is not None:
+        return cached + (True,)
+
+    document = parse(query)
+    errors = validate(schema, document, validation_rules, max_errors)
+    document_cache.set(key, (document, errors))
+    return document, errors, False
@@ -0,0 +1,175 @@
+"""crm/export.py
+This file contains the streaming exports of orders, customers and products,
+served by the export view and the crm_export command.
+
+Rows are read with ``.iterator(chunk_size)`` (a server-side cursor where the
+database has them) and written one at a time, so memory stays flat whatever
+the number of rows. Each order carries its product ids, read with one query
+per chunk of orders. Orders are read with ``orders_for``, so a date range
+reaching into the archive exports archived orders too.
+"""
+
+import csv
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+
+from crm.archive import orders_for
+from crm.filters import CustomerFilter, OrderFilter, ProductFilter
+from crm.models import Customer, Product
+from crm.routers import get_replica
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Model (or None for the orders, see orders_for), filter and columns.
+EXPORTS = {
+    "orders": (
+        None,
+        OrderFilter,
+        ["id", "customer_id", "total_amount", "order_date", "product_ids"],
+    ),
+    "customers": (
+        Customer,
+        CustomerFilter,
+        [
+            "id",
+            "name",
+            "email",
+            "phone",
+            "created_at",
+            "order_count",
+            "lifetime_value",
+            "first_order_date",
+            "last_order_date",
+        ],
+    ),
+    "products": (Product, ProductFilter, ["id", "name", "price", "stock"]),
+}
+
+
+def get_chunk_size(chunk_size=None):
+    """Return the rows read per database round trip."""
+    if chunk_size is None:
+        chunk_size = getattr(settings, "CRM_EXPORT_CHUNK_SIZE", 2000)
+    if chunk_size < 1:
+        raise ValueError("The chunk size must be at least 1.")
+    return chunk_size
+
+
+def get_queryset(kind, params):
+    """
+    Return the filtered queryset and the columns of an export. ``params``
+    holds filter arguments by filter name (``order_date__gte``,
+    ``customer_name``, ...), as strings; an unknown name is an error rather
+    than silently ignored. Reads go to the replica if any.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(
+            f"Unknown export {kind!r}, expected one of {', '.join(EXPORTS)}."
+        )
+    model, filter_class, columns = EXPORTS[kind]
+    unknown = sorted(set(params) - set(filter_class.base_filters))
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(unknown)}.")
+    using = get_replica() or DEFAULT_DB_ALIAS
+
+    if model is None:
+        # Parse the dates first: the range decides which table is read.
+        dates = OrderFilter(params).form
+        bounds = dates.cleaned_data if dates.is_valid() else {}
+        queryset = orders_for(
+            bounds.get("order_date__gte"), bounds.get("order_date__lte")
+        ).using(using)
+    else:
+        queryset = model.objects.using(using)
+
+    filterset = filter_class(params, queryset=queryset)
+    if not filterset.is_valid():
+        errors = "; ".join(
+            f"{name}: {' '.join(messages)}"
+            for name, messages in filterset.errors.items()
+        )
+        raise ValueError(f"Invalid filters: {errors}")
+
+    queryset = filterset.qs
+    if not queryset.query.order_by:
+        queryset = queryset.order_by("pk")
+    return queryset, columns
+
+
+def export_rows(kind, params, chunk_size=None):
+    """
+    Return the column names of an export and an iterator over its rows, as
+    dicts. Filters are checked before the iterator is returned.
+    """
+    chunk_size = get_chunk_size(chunk_size)
+    queryset, columns = get_queryset(kind, params)
+    fields = [column for column in columns if column != "product_ids"]
+    rows = queryset.values(*fields).iterator(chunk_size=chunk_size)
+    if "product_ids" in columns:
+        rows = with_product_ids(queryset, rows, chunk_size)
+    return columns, rows
+
+
+def with_product_ids(queryset, rows, chunk_size):
+    """Add the product ids of each order, one query per chunk of orders."""
+    through = queryset.model.products.through
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        product_ids = {row["id"]: [] for row in chunk}
+        for order_id, product_id in (
+            through.objects.using(queryset.db)
+            .filter(order_id__in=product_ids)
+            .order_by("order_id", "product_id")
+            .values_list("order_id", "product_id")
+        ):
+            product_ids[order_id].append(product_id)
+        for row in chunk:
+            row["product_ids"] = product_ids[row["id"]]
+            yield row
+
+
+class Echo:
+    """File-like object returning what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows):
+    """Serialize rows as newline-delimited JSON."""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+def csv_lines(columns, rows):
+    """Serialize rows as CSV, with a header line and space-separated lists."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(
+            [
+                (
+                    " ".join(map(str, row[column]))
+                    if isinstance(row[column], list)
+                    else row[column]
+                )
+                for column in columns
+            ]
+        )
+
+
+def export_lines(kind, params, output_format="ndjson", chunk_size=None):
+    """Return an iterator over the lines of an export in ``output_format``."""
+    if output_format not in FORMATS:
+        raise ValueError(
+            f"Unknown format {output_format!r}, expected one of {', '.join(FORMATS)}."
+        )
+    columns, rows = export_rows(kind, params, chunk_size)
+    if output_format == "csv":
+        return csv_lines(columns, rows)
+    return ndjson_lines(rows)
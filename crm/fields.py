@@ -0,0 +1,148 @@
+"""crm/fields.py
+This file contains the connection class and the connection field used by the
+CRM schema.
+"""
+
+import graphene
+from django.db.models.query import QuerySet
+from graphene import relay
+from graphene_django.filter import DjangoFilterConnectionField
+from promise import Promise
+
+from crm.counting import CACHED, ESTIMATED, EXACT, TotalCount
+from crm.loaders import get_loaders
+from crm.pagination import keyset_connection, offset_connection
+
+
+class CountStrategy(graphene.Enum):
+    """How the totalCount of a connection is computed."""
+
+    EXACT = EXACT
+    CACHED = CACHED
+    ESTIMATED = ESTIMATED
+
+
+class CRMConnection(relay.Connection):
+    """
+    Connection of the CRM types, with the totalCount of the filtered rows and
+    the strategy that produced it. The count only runs when one of them is
+    selected.
+    """
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int(description="Number of rows matching the filters.")
+    count_strategy = graphene.Field(
+        CountStrategy, description="Strategy that produced totalCount."
+    )
+
+    def resolve_total_count(self, info):
+        return self.total_count_source.resolve()[0]
+
+    def resolve_count_strategy(self, info):
+        return self.total_count_source.resolve()[1]
+
+
+class CRMConnectionField(DjangoFilterConnectionField):
+    """
+    Filter connection field that cooperates with the request DataLoaders.
+    Every page it returns queues its nodes' relation keys, and it accepts
+    the plain lists produced by the loaders for nested connections.
+
+    Passing ``keyset: true`` switches a connection to keyset pagination, and
+    ``countStrategy`` picks how its totalCount is computed (crm.counting).
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault(
+            "keyset",
+            graphene.Boolean(
+                description="Paginate with cursors on the orderBy key instead of OFFSET."
+            ),
+        )
+        kwargs.setdefault(
+            "count_strategy",
+            CountStrategy(
+                description="How totalCount is computed (CRM_COUNT_STRATEGY by default)."
+            ),
+        )
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        """
+        Slice the page, using keyset pagination when requested and forward
+        offset pages without COUNT(*) otherwise; totalCount counts on demand.
+        """
+        if isinstance(iterable, QuerySet) and args.get("keyset"):
+            result = keyset_connection(connection, iterable, args, max_limit=max_limit)
+        elif (
+            isinstance(iterable, QuerySet)
+            and args.get("last") is None
+            and args.get("before") is None
+        ):
+            result = offset_connection(connection, iterable, args, max_limit=max_limit)
+        else:
+            result = super().resolve_connection(
+                connection, args, iterable, max_limit=max_limit
+            )
+
+        strategy = args.get("count_strategy")
+        result.total_count_source = TotalCount(
+            iterable,
+            getattr(strategy, "value", strategy),
+            connection._meta.node._meta.model,
+        )
+        return result
+
+    @classmethod
+    def resolve_queryset(
+        cls, connection, iterable, info, args, filtering_args, filterset_class
+    ):
+        """Filter the iterable, keeping loader results in memory when possible."""
+        if isinstance(iterable, list):
+            if not any(args.get(name) is not None for name in filtering_args):
+                return iterable
+
+            # Filtering arguments on a nested connection go back to the database.
+            model = connection._meta.node._meta.model
+            iterable = model.objects.filter(pk__in=[obj.pk for obj in iterable])
+
+        return super().resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+
+    @classmethod
+    def connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args,
+    ):
+        """Resolve the connection and queue its page with the loaders."""
+        result = super().connection_resolver(
+            resolver,
+            connection,
+            default_manager,
+            queryset_resolver,
+            max_limit,
+            enforce_first_or_last,
+            root,
+            info,
+            **args,
+        )
+
+        def queue_page(resolved):
+            get_loaders(info).queue_page([edge.node for edge in resolved.edges])
+            return resolved
+
+        if Promise.is_thenable(result):
+            return Promise.resolve(result).then(queue_page)
+        return queue_page(result)
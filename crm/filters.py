@@ -1,5 +1,43 @@
 import django_filters
+from django.db.models import Exists, OuterRef
 from crm.models import Customer, Product, Order
+from crm.search import search
+
+# Lookups on the related key, selective enough to drive the semi-join from
+# the link table's index.
+KEY_LOOKUPS = {"pk", "id", "pk__in", "id__in"}
+
+
+def semi_join(queryset, relation, **lookups):
+    """
+    Keep the rows of ``queryset`` with at least one row of the to-many
+    ``relation`` matching ``lookups``, without joining it: every row appears
+    once whatever the number of matches and no DISTINCT is needed.
+    Key lookups become ``pk IN (SELECT ...)`` read from the relation's index;
+    other lookups become a correlated EXISTS, which stops at the first match.
+    Many-to-many relations are probed through their link table.
+    """
+    field = queryset.model._meta.get_field(relation)
+    if field.many_to_many:
+        if field.auto_created:
+            # Reverse side of a ManyToManyField.
+            through = field.through
+            source = field.field.m2m_reverse_field_name()
+            target = field.field.m2m_field_name()
+        else:
+            through = field.remote_field.through
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+        related = through._default_manager.filter(
+            **{f"{target}__{lookup}": value for lookup, value in lookups.items()}
+        )
+    else:
+        source = field.field.name
+        related = field.related_model._default_manager.filter(**lookups)
+
+    if set(lookups) <= KEY_LOOKUPS:
+        return queryset.filter(pk__in=related.values(source))
+    return queryset.filter(Exists(related.filter(**{source: OuterRef("pk")})))
 
 
 class CustomerFilter(django_filters.FilterSet):
@@ -17,19 +55,51 @@ class CustomerFilter(django_filters.FilterSet):
     created_at__lte = django_filters.DateTimeFilter(
         field_name="created_at", lookup_expr="lte"
     )
+    lifetime_value__gte = django_filters.NumberFilter(
+        field_name="lifetime_value", lookup_expr="gte"
+    )
+    lifetime_value__lte = django_filters.NumberFilter(
+        field_name="lifetime_value", lookup_expr="lte"
+    )
+    order_count__gte = django_filters.NumberFilter(
+        field_name="order_count", lookup_expr="gte"
+    )
+    order_count__lte = django_filters.NumberFilter(
+        field_name="order_count", lookup_expr="lte"
+    )
+    last_order_date__gte = django_filters.DateTimeFilter(
+        field_name="last_order_date", lookup_expr="gte"
+    )
+    last_order_date__lte = django_filters.DateTimeFilter(
+        field_name="last_order_date", lookup_expr="lte"
+    )
 
     def filter_phone(self, queryset, name, value):
         """
         Custom filter method for phone numbers.
         This method allows filtering by phone number that starts with +1.
+        SQLite's LIKE is case-insensitive and cannot use the phone index, so
+        the prefix is also bounded as a range the index can seek.
         """
-        return queryset.filter(phone__startswith=value)
+        upper = value[:-1] + chr(ord(value[-1]) + 1)
+        return queryset.filter(
+            phone__gte=value, phone__lt=upper, phone__startswith=value
+        )
+
+    search = django_filters.CharFilter(method="filter_search", label="Search")
+
+    def filter_search(self, queryset, name, value):
+        """Full-text search ranked by relevance, see crm.search."""
+        return search(queryset, value)
 
     order_by = django_filters.OrderingFilter(
         fields=(
             ("name", "name"),
             ("email", "email"),
             ("created_at", "created_at"),
+            ("lifetime_value", "lifetime_value"),
+            ("order_count", "order_count"),
+            ("last_order_date", "last_order_date"),
         )
     )
 
@@ -43,6 +113,13 @@ class CustomerFilter(django_filters.FilterSet):
             "phone_pattern",
             "created_at__gte",
             "created_at__lte",
+            "lifetime_value__gte",
+            "lifetime_value__lte",
+            "order_count__gte",
+            "order_count__lte",
+            "last_order_date__gte",
+            "last_order_date__lte",
+            "search",
         ]
 
 
@@ -62,6 +139,12 @@ class ProductFilter(django_filters.FilterSet):
         """Custom filter method for stock less than 10."""
         return queryset.filter(stock__lt=10)
 
+    search = django_filters.CharFilter(method="filter_search", label="Search")
+
+    def filter_search(self, queryset, name, value):
+        """Full-text search ranked by relevance, see crm.search."""
+        return search(queryset, value)
+
     order_by = django_filters.OrderingFilter(
         fields=(
             ("name", "name"),
@@ -81,6 +164,7 @@ class ProductFilter(django_filters.FilterSet):
             "stock__gte",
             "stock__lte",
             "stock_lt_10",
+            "search",
         ]
 
 
@@ -116,14 +200,20 @@ class OrderFilter(django_filters.FilterSet):
         Custom filter method for product names in orders.
         This method allows filtering orders by product names.
         """
-        return queryset.filter(products__name__icontains=value)
+        return semi_join(queryset, "products", name__icontains=value)
 
     def filter_product_id(self, queryset, name, value):
         """
         Custom filter method for product IDs in orders.
         This method allows filtering orders by product IDs.
         """
-        return queryset.filter(products__id=value)
+        return semi_join(queryset, "products", pk=value)
+
+    search = django_filters.CharFilter(method="filter_search", label="Search")
+
+    def filter_search(self, queryset, name, value):
+        """Full-text search ranked by relevance, see crm.search."""
+        return search(queryset, value)
 
     order_by = django_filters.OrderingFilter(
         fields=(
@@ -144,4 +234,5 @@ class OrderFilter(django_filters.FilterSet):
             "total_amount__lte",
             "order_date__gte",
             "order_date__lte",
+            "search",
         ]
@@ -0,0 +1,235 @@
+"""crm/loaders.py
+This file contains the request-scoped DataLoaders used by the CRM schema.
+
+Connection fields queue the keys of every node on a page; the first lookup
+that misses the cache then loads the whole queue with one ``IN (...)`` query.
+"""
+
+import threading
+from collections import defaultdict
+
+from crm.models import Customer, Order, OrderLine, Product
+
+
+class DataLoader:
+    """
+    Synchronous batch loader.
+    Subclasses implement ``batch_load`` which maps a list of keys to a dict.
+    The async view resolves root fields in parallel threads sharing the
+    loaders, so the queue and cache are guarded by a lock.
+    """
+
+    source_model = None
+    default = None
+
+    def __init__(self):
+        self._cache = {}
+        self._queue = {}
+        self._lock = threading.RLock()
+        self.batches = 0
+        self.keys_loaded = 0
+
+    def key_for(self, node):
+        """Return the key this loader needs for a node of ``source_model``."""
+        return node.pk
+
+    def batch_load(self, keys):
+        """Load all ``keys`` with a single query and return a dict."""
+        raise NotImplementedError
+
+    def queue(self, key):
+        """Remember a key so that it is fetched with the next batch."""
+        with self._lock:
+            if key is not None and key not in self._cache:
+                self._queue[key] = None
+
+    def prime(self, key, value):
+        """Store an already loaded value in the cache."""
+        with self._lock:
+            self._cache[key] = value
+            self._queue.pop(key, None)
+
+    def load(self, key):
+        """Return the value for ``key``, dispatching the queue on a miss."""
+        if key is None:
+            return self.default
+        with self._lock:
+            if key not in self._cache:
+                self.queue(key)
+                self.dispatch()
+            return self._cache.get(key, self.default)
+
+    def load_many(self, keys):
+        """Return the values for ``keys`` in order."""
+        for key in keys:
+            self.queue(key)
+        return [self.load(key) for key in keys]
+
+    def dispatch(self):
+        """Load every queued key in one batch."""
+        with self._lock:
+            keys = list(self._queue)
+            self._queue.clear()
+            if not keys:
+                return
+
+            results = self.batch_load(keys)
+            for key in keys:
+                self._cache[key] = results.get(key, self.default)
+
+            self.batches += 1
+            self.keys_loaded += len(keys)
+
+    @property
+    def queries_saved(self):
+        """Number of queries avoided compared to one lookup per key."""
+        return self.keys_loaded - self.batches
+
+
+class CustomerLoader(DataLoader):
+    """Load customers by id, for ``OrderType.customer``."""
+
+    source_model = Order
+
+    def key_for(self, node):
+        return node.customer_id
+
+    def batch_load(self, keys):
+        return Customer.objects.in_bulk(keys)
+
+
+class OrderProductsLoader(DataLoader):
+    """Load the products of each order, for ``OrderType.products``."""
+
+    source_model = Order
+
+    def batch_load(self, keys):
+        results = defaultdict(list)
+        links = (
+            Order.products.through.objects.filter(order_id__in=keys)
+            .select_related("product")
+            .order_by("pk")
+        )
+        for link in links:
+            results[link.order_id].append(link.product)
+        return results
+
+    def load(self, key):
+        return super().load(key) or []
+
+
+class OrderLinesLoader(DataLoader):
+    """Load the lines of each order with their product, for ``OrderType.lines``."""
+
+    source_model = Order
+
+    def batch_load(self, keys):
+        results = defaultdict(list)
+        lines = (
+            OrderLine.objects.filter(order_id__in=keys)
+            .select_related("product")
+            .order_by("pk")
+        )
+        for line in lines:
+            results[line.order_id].append(line)
+        return results
+
+    def load(self, key):
+        return super().load(key) or []
+
+
+class CustomerOrdersLoader(DataLoader):
+    """Load the orders of each customer, for ``CustomerType.order_customer``."""
+
+    source_model = Customer
+
+    def batch_load(self, keys):
+        results = defaultdict(list)
+        for order in Order.objects.filter(customer_id__in=keys).order_by("pk"):
+            results[order.customer_id].append(order)
+        return results
+
+    def load(self, key):
+        return super().load(key) or []
+
+
+class ProductOrdersLoader(DataLoader):
+    """Load the orders containing each product, for ``ProductType.order_products``."""
+
+    source_model = Product
+
+    def batch_load(self, keys):
+        results = defaultdict(list)
+        links = (
+            Order.products.through.objects.filter(product_id__in=keys)
+            .select_related("order")
+            .order_by("pk")
+        )
+        for link in links:
+            results[link.product_id].append(link.order)
+        return results
+
+    def load(self, key):
+        return super().load(key) or []
+
+
+class Loaders:
+    """
+    The set of loaders shared by all resolvers of one request.
+    """
+
+    def __init__(self):
+        self.customer = CustomerLoader()
+        self.order_products = OrderProductsLoader()
+        self.order_lines = OrderLinesLoader()
+        self.customer_orders = CustomerOrdersLoader()
+        self.product_orders = ProductOrdersLoader()
+
+    def __iter__(self):
+        return iter(
+            (
+                self.customer,
+                self.order_products,
+                self.order_lines,
+                self.customer_orders,
+                self.product_orders,
+            )
+        )
+
+    def queue_page(self, nodes):
+        """Queue the relation keys of every node on a connection page."""
+        for loader in self:
+            for node in nodes:
+                if isinstance(node, loader.source_model):
+                    loader.queue(loader.key_for(node))
+
+    def stats(self):
+        """Return batching counters for the response ``extensions``."""
+        return {
+            "batches": sum(loader.batches for loader in self),
+            "keysLoaded": sum(loader.keys_loaded for loader in self),
+            "queriesSaved": sum(loader.queries_saved for loader in self),
+        }
+
+
+def get_loaders(info):
+    """
+    Return the loaders bound to the current request.
+    Without a context object every call gets fresh (unbatched) loaders.
+    """
+    return loaders_for(info.context)
+
+
+def loaders_for(context):
+    """Return the loaders bound to ``context``, creating them if needed."""
+    if context is None:
+        return Loaders()
+
+    if isinstance(context, dict):
+        return context.setdefault("crm_loaders", Loaders())
+
+    loaders = getattr(context, "crm_loaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        context.crm_loaders = loaders
+    return loaders
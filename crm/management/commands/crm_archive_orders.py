@@ -0,0 +1,44 @@
+"""crm/management/commands/crm_archive_orders.py
+This file contains the command moving old orders to the archive tables.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.archive import archive_orders, get_horizon
+
+
+class Command(BaseCommand):
+    """
+    Move the orders older than ``--days`` (CRM_ARCHIVE_AFTER_DAYS by default)
+    with their lines to the archive tables, one transaction per batch, and
+    add them to the daily archive summaries. It can be stopped and rerun at
+    any time; the crm.tasks.archive_old_orders task runs it nightly.
+    """
+
+    help = "Move old orders to the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, help="Archive orders older than this many days."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, help="Orders moved per transaction."
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] is not None and options["days"] < 0:
+            raise CommandError("--days cannot be negative.")
+        if options["batch_size"] is not None and options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        before = get_horizon(options["days"])
+        started = time.perf_counter()
+        moved = archive_orders(before, batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {moved} orders placed before {before:%Y-%m-%d %H:%M} "
+                f"in {time.perf_counter() - started:.1f}s."
+            )
+        )
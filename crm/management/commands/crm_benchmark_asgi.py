@@ -0,0 +1,210 @@
+"""crm/management/commands/crm_benchmark_asgi.py
+This file contains the throughput benchmark of the async GraphQL view against
+the synchronous one.
+"""
+
+import asyncio
+import json
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+QUERY = """
+query Benchmark($first: Int) {
+  allCustomers(first: $first) { edges { node { name email orderCount } } }
+  allProducts(first: $first) { edges { node { name price stock } } }
+  allOrders(first: $first) {
+    edges { node { totalAmount orderDate customer { name } } }
+  }
+  crmStatistics { customerCount orderCount totalRevenue }
+}
+"""
+
+
+class Command(BaseCommand):
+    """
+    Send the same query, with several root fields, from ``--concurrency``
+    clients to the WSGI view (/graphql/) served by ``--threads`` threads, as
+    a threaded WSGI server would, and to the async view (/graphql/async/)
+    from as many coroutines on one event loop, its resolvers running in
+    CRM_ASYNC_THREADS threads. Both go through Django's in-process WSGI and
+    ASGI handlers, so the figures leave out the web server; the response
+    cache is switched off so that every request executes.
+
+    SQLite answers in-process, without the network round trip of a database
+    server, which is where the async view gains; ``--latency`` adds one to
+    every SQL query. It reads the configured database, seeded with seed_db
+    for instance.
+    """
+
+    help = "Compare the async GraphQL view with the WSGI one under concurrency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=64)
+        parser.add_argument(
+            "--threads", type=int, default=8, help="Threads serving the WSGI view."
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Milliseconds of simulated network latency per SQL query.",
+        )
+        parser.add_argument(
+            "--first", type=int, default=20, help="Page size of each root field."
+        )
+        parser.add_argument(
+            "--query-file", help="File holding the query to send instead."
+        )
+
+    def handle(self, *args, **options):
+        if min(options["requests"], options["concurrency"], options["threads"]) < 1:
+            raise CommandError(
+                "--requests, --concurrency and --threads must be at least 1."
+            )
+        if options["latency"] < 0:
+            raise CommandError("--latency cannot be negative.")
+
+        query = QUERY
+        if options["query_file"]:
+            with open(options["query_file"]) as f:
+                query = f.read()
+        body = json.dumps({"query": query, "variables": {"first": options["first"]}})
+
+        delay = self.delay(options["latency"])
+
+        def add_latency(sender, connection, **kwargs):
+            # Reconnections of a thread reuse its connection object.
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        # Connections opened from now on get the latency, so close the others.
+        connections.close_all()
+        connection_created.connect(add_latency)
+        try:
+            with override_settings(CRM_RESPONSE_CACHE_ENABLED=False):
+                expected = self.check_views(body)
+                self.stdout.write(
+                    f"{options['requests']} requests from {options['concurrency']} "
+                    f"clients, {options['threads']} WSGI threads, "
+                    f"{settings.CRM_ASYNC_THREADS} async threads, "
+                    f"{options['latency']:g} ms per query"
+                )
+                self.report("WSGI /graphql/", self.run_wsgi(body, expected, options))
+                self.report(
+                    "ASGI /graphql/async/",
+                    asyncio.run(self.run_asgi(body, expected, options)),
+                )
+        finally:
+            connection_created.disconnect(add_latency)
+            connections.close_all()
+
+    @staticmethod
+    def delay(latency):
+        """Return an execute wrapper waiting ``latency`` ms before each query."""
+
+        def wrapper(execute, sql, params, many, context):
+            if latency:
+                time.sleep(latency / 1000)
+            return execute(sql, params, many, context)
+
+        return wrapper
+
+    def check_views(self, body):
+        """Return the data of the query, checking both views agree on it."""
+        sync_response = Client().post(
+            "/graphql/", body, content_type="application/json"
+        )
+        async_response = asyncio.run(
+            AsyncClient().post("/graphql/async/", body, content_type="application/json")
+        )
+        sync_data = sync_response.json()
+        if sync_data.get("errors"):
+            raise CommandError(f"The query failed: {sync_data['errors']}")
+        if async_response.json().get("data") != sync_data["data"]:
+            raise CommandError("The async view returned different data.")
+        return sync_data["data"]
+
+    def run_wsgi(self, body, expected, options):
+        """
+        Send the requests to the WSGI view, one thread per client; only
+        ``--threads`` of them are served at a time, the others wait as in a
+        server's accept queue.
+        """
+        results = {"latencies": [], "errors": 0}
+        lock = threading.Lock()
+        server_threads = threading.Semaphore(options["threads"])
+        remaining = iter(range(options["requests"]))
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    started = time.perf_counter()
+                    with server_threads:
+                        response = client.post(
+                            "/graphql/", body, content_type="application/json"
+                        )
+                        # What Django does at the end of every request.
+                        close_old_connections()
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        results["latencies"].append(elapsed)
+                        if response.json().get("data") != expected:
+                            results["errors"] += 1
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=worker) for _ in range(options["concurrency"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results["seconds"] = time.perf_counter() - started
+        return results
+
+    async def run_asgi(self, body, expected, options):
+        """Send the requests to the async view, one coroutine per client."""
+        results = {"latencies": [], "errors": 0}
+        remaining = iter(range(options["requests"]))
+        client = AsyncClient()
+
+        async def worker():
+            while next(remaining, None) is not None:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/graphql/async/", body, content_type="application/json"
+                )
+                results["latencies"].append(time.perf_counter() - started)
+                if response.json().get("data") != expected:
+                    results["errors"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options["concurrency"])))
+        results["seconds"] = time.perf_counter() - started
+        return results
+
+    def report(self, label, results):
+        """Print the throughput and latency of one run."""
+        timings = sorted(results["latencies"])
+        p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        self.stdout.write(
+            f"  {len(timings) / results['seconds']:9.1f} requests/s"
+            f"  median {statistics.median(timings) * 1000:7.2f} ms"
+            f"  p95 {p95:7.2f} ms  failed {results['errors']}"
+        )
@@ -0,0 +1,136 @@
+"""crm/management/commands/crm_benchmark_filters.py
+This file contains the benchmark of the many-to-many filters of allOrders.
+"""
+
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from crm.filters import OrderFilter
+from crm.models import Customer, Order, OrderLine, Product
+
+PAGE_SIZE = 20
+
+
+class Command(BaseCommand):
+    """
+    Compare the ways of filtering orders by product on generated data:
+    a plain join, a join with DISTINCT, an EXISTS semi-join, an IN semi-join
+    and the OrderFilter in use. Each is timed on a count plus a first page.
+    The data is generated in a transaction that is rolled back.
+    """
+
+    help = "Benchmark the product filters of allOrders on generated data."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=1000)
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--orders", type=int, default=50000)
+        parser.add_argument(
+            "--max-lines", type=int, default=8, help="Products per order, at most."
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.generate(options)
+            product = Product.objects.order_by("pk")[10]
+            self.compare("productId", {"product_id": product.pk}, options)
+            self.compare("productName", {"product_name": product.name}, options)
+            self.compare("productName", {"product_name": "dget"}, options)
+            transaction.set_rollback(True)
+
+    def generate(self, options):
+        """Create the customers, products, orders and order lines."""
+        rng = random.Random(options["seed"])
+        started = time.perf_counter()
+
+        Customer.objects.bulk_create(
+            [
+                Customer(name=f"Bench {i}", email=f"bench{i}@example.com")
+                for i in range(options["customers"])
+            ],
+            batch_size=1000,
+        )
+        customers = list(Customer.objects.values_list("pk", flat=True))
+        Product.objects.bulk_create(
+            [
+                Product(name=f"Widget {i}", price=Decimal("9.99"), stock=100)
+                for i in range(options["products"])
+            ],
+            batch_size=1000,
+        )
+        products = list(Product.objects.values_list("pk", flat=True))
+        Order.objects.bulk_create(
+            [
+                Order(customer_id=rng.choice(customers), total_amount=0)
+                for _ in range(options["orders"])
+            ],
+            batch_size=1000,
+        )
+
+        lines = []
+        for order_id in Order.objects.values_list("pk", flat=True).iterator():
+            count = rng.randint(1, options["max_lines"])
+            for product_id in rng.sample(products, min(count, len(products))):
+                lines.append(
+                    OrderLine(
+                        order_id=order_id,
+                        product_id=product_id,
+                        quantity=1,
+                        unit_price=Decimal("9.99"),
+                    )
+                )
+        OrderLine.objects.bulk_create(lines, batch_size=5000)
+
+        self.stdout.write(
+            f"Generated {Order.objects.count()} orders and {len(lines)} lines "
+            f"in {time.perf_counter() - started:.1f}s."
+        )
+
+    def strategies(self, data):
+        """Return the querysets compared for filter ``data``."""
+        if "product_id" in data:
+            lookup = {"product_id": data["product_id"]}
+            join = {"products__id": data["product_id"]}
+        else:
+            lookup = {"product__name__icontains": data["product_name"]}
+            join = {"products__name__icontains": data["product_name"]}
+
+        orders = Order.objects.all()
+        lines = OrderLine.objects.filter(**lookup)
+        return {
+            "join": orders.filter(**join),
+            "join + DISTINCT": orders.filter(**join).distinct(),
+            "EXISTS": orders.filter(Exists(lines.filter(order_id=OuterRef("pk")))),
+            "IN": orders.filter(pk__in=lines.values("order_id")),
+            "OrderFilter": OrderFilter(data, queryset=orders).qs,
+        }
+
+    def compare(self, argument, data, options):
+        """Time every strategy for one filter and print the results."""
+        value = next(iter(data.values()))
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{argument}: {value!r}"))
+        for name, queryset in self.strategies(data).items():
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                total = queryset.count()
+                page = list(
+                    queryset.order_by("-order_date", "-pk")[:PAGE_SIZE].values_list(
+                        "pk", flat=True
+                    )
+                )
+                timings.append((time.perf_counter() - started) * 1000)
+
+            duplicates = len(page) - len(set(page))
+            self.stdout.write(
+                f"  {name:16} {statistics.median(timings):9.1f} ms"
+                f"  count={total:<8} duplicates on page={duplicates}"
+            )
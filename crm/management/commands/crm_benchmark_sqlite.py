@@ -0,0 +1,233 @@
+"""crm/management/commands/crm_benchmark_sqlite.py
+This file contains the mixed read/write benchmark of the SQLite profiles.
+"""
+
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.models import F
+
+from crm.models import Customer, Order, OrderLine, Product
+
+PAGE_SIZE = 20
+LINES_PER_ORDER = 3
+
+
+class Command(BaseCommand):
+    """
+    Run the same mixed workload against a fresh SQLite file per profile of
+    CRM_SQLITE_PROFILES, and once more with BEGIN IMMEDIATE transactions.
+    Worker threads stand in for request threads: each operation is an orders
+    page read or an order placement, followed by the end-of-request
+    connection cleanup, so CONN_MAX_AGE matters as it does in production.
+    """
+
+    help = "Compare the SQLite profiles on a concurrent read/write workload."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument(
+            "--write-ratio",
+            type=float,
+            default=0.2,
+            help="Share of operations placing an order.",
+        )
+        parser.add_argument("--customers", type=int, default=1000)
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--orders", type=int, default=20000)
+        parser.add_argument(
+            "--profile",
+            action="append",
+            dest="profiles",
+            help="Profile to run (repeatable), default all of them.",
+        )
+
+    def handle(self, *args, **options):
+        profiles = settings.CRM_SQLITE_PROFILES
+        names = options["profiles"] or list(profiles)
+        unknown = set(names) - set(profiles)
+        if unknown:
+            raise CommandError(f"Unknown profiles: {', '.join(sorted(unknown))}")
+
+        runs = [(name, profiles[name], None) for name in names]
+        runs.append((f"{names[-1]} + IMMEDIATE", profiles[names[-1]], "IMMEDIATE"))
+
+        directory = Path(tempfile.mkdtemp(prefix="crm-bench-"))
+        try:
+            for index, (label, profile, transaction_mode) in enumerate(runs):
+                alias = f"crm_bench_{index}"
+                options_ = dict(profile.get("OPTIONS", {}))
+                if transaction_mode:
+                    options_["transaction_mode"] = transaction_mode
+                # Start from the filled-in default entry, then apply the profile.
+                connections.settings[alias] = {
+                    **connections.settings[DEFAULT_DB_ALIAS],
+                    "CONN_MAX_AGE": 0,
+                    "CONN_HEALTH_CHECKS": False,
+                    **profile,
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": directory / f"{alias}.sqlite3",
+                    "OPTIONS": options_,
+                }
+                try:
+                    self.populate(alias, options)
+                    self.report(label, self.run(alias, options))
+                finally:
+                    connections[alias].close()
+                    del connections.settings[alias]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def populate(self, alias, options):
+        """Create the tables and the starting data in database ``alias``."""
+        with connections[alias].schema_editor() as editor:
+            for model in (Customer, Product, Order, OrderLine):
+                editor.create_model(model)
+
+        rng = random.Random(0)
+        Customer.objects.using(alias).bulk_create(
+            [
+                Customer(name=f"Bench {i}", email=f"bench{i}@example.com")
+                for i in range(options["customers"])
+            ],
+            batch_size=1000,
+        )
+        Product.objects.using(alias).bulk_create(
+            [
+                Product(name=f"Widget {i}", price=Decimal("9.99"), stock=10**9)
+                for i in range(options["products"])
+            ],
+            batch_size=1000,
+        )
+        Order.objects.using(alias).bulk_create(
+            [
+                Order(
+                    customer_id=rng.randint(1, options["customers"]),
+                    total_amount=Decimal("29.97"),
+                )
+                for _ in range(options["orders"])
+            ],
+            batch_size=1000,
+        )
+        OrderLine.objects.using(alias).bulk_create(
+            [
+                OrderLine(
+                    order_id=order_id,
+                    product_id=product_id,
+                    unit_price=Decimal("9.99"),
+                )
+                for order_id in range(1, options["orders"] + 1)
+                for product_id in rng.sample(
+                    range(1, options["products"] + 1), LINES_PER_ORDER
+                )
+            ],
+            batch_size=5000,
+        )
+
+    def read(self, alias, rng):
+        """Read a page of orders with their customers and lines."""
+        page = list(
+            Order.objects.using(alias)
+            .select_related("customer")
+            .order_by("-order_date")[rng.randint(0, 50) * PAGE_SIZE :][:PAGE_SIZE]
+        )
+        list(
+            OrderLine.objects.using(alias)
+            .filter(order_id__in=[order.pk for order in page])
+            .select_related("product")
+        )
+
+    def write(self, alias, rng, options):
+        """Place an order the way crm.orders.place_order does."""
+        product_ids = rng.sample(range(1, options["products"] + 1), LINES_PER_ORDER)
+        with transaction.atomic(using=alias):
+            prices = dict(
+                Product.objects.using(alias)
+                .filter(pk__in=product_ids)
+                .values_list("pk", "price")
+            )
+            Product.objects.using(alias).filter(pk__in=product_ids).update(
+                stock=F("stock") - 1
+            )
+            order = Order.objects.using(alias).create(
+                customer_id=rng.randint(1, options["customers"]),
+                total_amount=sum(prices.values()),
+            )
+            OrderLine.objects.using(alias).bulk_create(
+                [
+                    OrderLine(order=order, product_id=pk, unit_price=price)
+                    for pk, price in prices.items()
+                ]
+            )
+            Customer.objects.using(alias).filter(pk=order.customer_id).update(
+                order_count=F("order_count") + 1
+            )
+
+    def run(self, alias, options):
+        """Run the workload and return the per-operation results."""
+        results = {"read": [], "write": [], "errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options["seconds"]
+
+        def worker(seed):
+            rng = random.Random(seed)
+            connection = connections[alias]
+            try:
+                while time.perf_counter() < deadline:
+                    kind = "write" if rng.random() < options["write_ratio"] else "read"
+                    started = time.perf_counter()
+                    try:
+                        if kind == "write":
+                            self.write(alias, rng, options)
+                        else:
+                            self.read(alias, rng)
+                    except OperationalError:
+                        with lock:
+                            results["errors"] += 1
+                        continue
+                    finally:
+                        # What Django does at the end of every request.
+                        connection.close_if_unusable_or_obsolete()
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        results[kind].append(elapsed)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(seed,))
+            for seed in range(options["threads"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        results["seconds"] = options["seconds"]
+        return results
+
+    def report(self, label, results):
+        """Print the throughput and latency of one run."""
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        for kind in ("read", "write"):
+            timings = sorted(results[kind])
+            if not timings:
+                self.stdout.write(f"  {kind:5}  no completed operations")
+                continue
+            p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+            self.stdout.write(
+                f"  {kind:5} {len(timings) / results['seconds']:9.1f} ops/s"
+                f"  median {statistics.median(timings) * 1000:7.2f} ms"
+                f"  p95 {p95:7.2f} ms"
+            )
+        self.stdout.write(f"  locked errors: {results['errors']}")
@@ -0,0 +1,155 @@
+"""crm/management/commands/crm_import.py
+This file contains the command importing customers, products or orders from
+a CSV or NDJSON file.
+"""
+
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from crm.counting import analyze
+from crm.importing import (
+    FORMATS,
+    IMPORTS,
+    finish_orders,
+    get_batch_size,
+    get_format,
+    read_rows,
+    track_orders,
+)
+from crm.models import ImportCheckpoint
+
+# Row errors printed; the others are only counted.
+MAX_REPORTED_ERRORS = 50
+# Seconds between two progress lines.
+PROGRESS_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    """
+    Import the rows of a CSV file (with a header line) or an NDJSON file,
+    CRM_IMPORT_BATCH_SIZE rows per transaction, with flat memory.
+
+    Columns: name, email and phone for customers; name, price and stock for
+    products; customer_email, products and order_date (ISO, UTC if naive,
+    the import time if blank) for orders, where products is a list of
+    ``{"name": ..., "quantity": ...}`` objects in NDJSON and
+    ``name:quantity|name:quantity`` in CSV.
+
+    Each batch saves a checkpoint in its transaction: an interrupted import
+    run again with the same arguments resumes after the last committed
+    batch, and a finished one is not imported twice (see ``--restart``).
+    """
+
+    help = "Import customers, products or orders from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(IMPORTS))
+        parser.add_argument("path", help="CSV or NDJSON file to import.")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Format of the file, from its extension by default.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, help="Rows imported per transaction."
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Name of the checkpoint, the kind and file path by default.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and import the file from its first row.",
+        )
+
+    def handle(self, *args, **options):
+        kind = options["kind"]
+        try:
+            input_format = get_format(options["path"], options["format"])
+            batch_size = get_batch_size(options["batch_size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not os.path.isfile(options["path"]):
+            raise CommandError(f"No such file: {options['path']}.")
+
+        key = options["checkpoint"] or f"{kind}:{os.path.abspath(options['path'])}"
+        if options["restart"]:
+            ImportCheckpoint.objects.filter(key=key).delete()
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(key=key)
+        if checkpoint.finished:
+            self.stderr.write(
+                f"{options['path']} was already imported ({checkpoint.rows} rows); "
+                "use --restart to import it again."
+            )
+            return
+        if checkpoint.rows:
+            self.stderr.write(f"Resuming after row {checkpoint.rows}.")
+
+        started = time.perf_counter()
+        reported = started
+        created = 0
+        failed = 0
+        with open(options["path"], newline="", encoding="utf-8") as file:
+            rows = islice(read_rows(file, input_format), checkpoint.rows, None)
+            number = checkpoint.rows
+            while True:
+                batch = [
+                    (number + i + 1, row)
+                    for i, row in enumerate(islice(rows, batch_size))
+                ]
+                if not batch:
+                    break
+                number += len(batch)
+                with transaction.atomic():
+                    objects, errors = IMPORTS[kind](batch)
+                    if kind == "orders":
+                        track_orders(checkpoint, objects)
+                    checkpoint.rows = number
+                    checkpoint.save()
+
+                created += len(objects)
+                for row_number, message in errors:
+                    if failed < MAX_REPORTED_ERRORS:
+                        self.stderr.write(
+                            self.style.WARNING(f"Row {row_number}: {message}")
+                        )
+                    failed += 1
+                if time.perf_counter() - reported >= PROGRESS_INTERVAL:
+                    reported = time.perf_counter()
+                    self.stderr.write(
+                        f"{number} rows read, {created} {kind} imported "
+                        f"({self.rate(created, started)} rows/s)."
+                    )
+
+        if kind == "orders":
+            self.stderr.write("Recomputing the customer aggregates and rollups.")
+            finish_orders(checkpoint)
+        # The estimated totalCount reads the planner statistics.
+        analyze()
+        checkpoint.finished = True
+        checkpoint.save()
+
+        if failed > MAX_REPORTED_ERRORS:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"{failed - MAX_REPORTED_ERRORS} more invalid rows not shown."
+                )
+            )
+        self.stderr.write(
+            self.style.SUCCESS(
+                f"Imported {created} {kind}, skipped {failed} invalid rows, in "
+                f"{time.perf_counter() - started:.1f}s "
+                f"({self.rate(created, started)} rows/s)."
+            )
+        )
+
+    @staticmethod
+    def rate(count, started):
+        """Return the rows per second since ``started``, formatted."""
+        elapsed = time.perf_counter() - started
+        return f"{count / elapsed if elapsed else 0:.0f}"
@@ -0,0 +1,33 @@
+"""crm/management/commands/crm_rebuild_search.py
+This file contains the command recreating the full-text search indexes.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from crm import search
+
+
+class Command(BaseCommand):
+    """
+    Recreate the FTS5 tables and triggers behind the ``search`` argument and
+    rebuild them from the customer and product tables. Run it after a
+    migration remakes one of those tables, since SQLite drops its triggers.
+    """
+
+    help = "Recreate and rebuild the CRM full-text search indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default="default", help="Database to rebuild."
+        )
+
+    def handle(self, *args, **options):
+        using = connections[options["database"]]
+        if not search.is_available(using):
+            self.stdout.write(
+                self.style.WARNING("Full-text search needs SQLite FTS5, skipped.")
+            )
+            return
+        search.install(using)
+        self.stdout.write(self.style.SUCCESS("Search indexes rebuilt."))
@@ -0,0 +1,56 @@
+"""crm/management/commands/crm_repair_aggregates.py
+This file contains the command recomputing the per-customer order aggregates.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm.aggregates import recompute
+from crm.models import Customer
+
+
+class Command(BaseCommand):
+    """
+    Recompute order_count, lifetime_value and the first and last order dates
+    of every customer from the orders, archived ones included, one UPDATE per
+    batch of customer ids. Use it after loading orders outside CreateOrder (fixtures, imports,
+    the admin) or to repair drifted values.
+    """
+
+    help = "Recompute the per-customer order aggregates."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Customers updated per statement.",
+        )
+        parser.add_argument(
+            "--customer",
+            type=int,
+            action="append",
+            dest="customers",
+            help="Only repair this customer ID (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.all()
+        if options["customers"]:
+            customers = customers.filter(pk__in=options["customers"])
+
+        batch_size = options["batch_size"]
+        ids = customers.order_by("pk").values_list("pk", flat=True)
+        total = 0
+        last = 0
+        while True:
+            batch = list(ids.filter(pk__gt=last)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                total += recompute(
+                    customers.filter(pk__gte=batch[0], pk__lte=batch[-1])
+                )
+            last = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Repaired {total} customers."))
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="customer",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="order_customer",
+                to="crm.customer",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(fields=["name", "id"], name="crm_customer_name_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["created_at", "id"], name="crm_customer_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(fields=["phone"], name="crm_customer_phone_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["customer", "order_date"], name="crm_order_customer_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["order_date", "id"], name="crm_order_date_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["total_amount", "id"], name="crm_order_total_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["name", "id"], name="crm_product_name_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["price", "id"], name="crm_product_price_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["stock", "id"], name="crm_product_stock_id_idx"),
+        ),
+    ]
@@ -0,0 +1,71 @@
+from django.db import migrations
+
+# The FTS5 tables and triggers as crm.search created them when this migration
+# was written, frozen so later edits of crm.search cannot change its history.
+INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS crm_customer_fts USING fts5("
+    "name, email, content='crm_customer', content_rowid='id', prefix='2 3')",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_insert",
+    "CREATE TRIGGER crm_customer_fts_insert AFTER INSERT ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(rowid, name, email) "
+    "VALUES (new.id, new.name, new.email); END",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_delete",
+    "CREATE TRIGGER crm_customer_fts_delete AFTER DELETE ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(crm_customer_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); END",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_update",
+    "CREATE TRIGGER crm_customer_fts_update AFTER UPDATE OF name, email "
+    "ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(crm_customer_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); "
+    "INSERT INTO crm_customer_fts(rowid, name, email) "
+    "VALUES (new.id, new.name, new.email); END",
+    "INSERT INTO crm_customer_fts(crm_customer_fts) VALUES ('rebuild')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS crm_product_fts USING fts5("
+    "name, content='crm_product', content_rowid='id', prefix='2 3')",
+    "DROP TRIGGER IF EXISTS crm_product_fts_insert",
+    "CREATE TRIGGER crm_product_fts_insert AFTER INSERT ON crm_product BEGIN "
+    "INSERT INTO crm_product_fts(rowid, name) VALUES (new.id, new.name); END",
+    "DROP TRIGGER IF EXISTS crm_product_fts_delete",
+    "CREATE TRIGGER crm_product_fts_delete AFTER DELETE ON crm_product BEGIN "
+    "INSERT INTO crm_product_fts(crm_product_fts, rowid, name) "
+    "VALUES ('delete', old.id, old.name); END",
+    "DROP TRIGGER IF EXISTS crm_product_fts_update",
+    "CREATE TRIGGER crm_product_fts_update AFTER UPDATE OF name ON crm_product "
+    "BEGIN INSERT INTO crm_product_fts(crm_product_fts, rowid, name) "
+    "VALUES ('delete', old.id, old.name); "
+    "INSERT INTO crm_product_fts(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO crm_product_fts(crm_product_fts) VALUES ('rebuild')",
+]
+UNINSTALL = [
+    "DROP TRIGGER IF EXISTS crm_customer_fts_insert",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_delete",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_update",
+    "DROP TABLE IF EXISTS crm_customer_fts",
+    "DROP TRIGGER IF EXISTS crm_product_fts_insert",
+    "DROP TRIGGER IF EXISTS crm_product_fts_delete",
+    "DROP TRIGGER IF EXISTS crm_product_fts_update",
+    "DROP TABLE IF EXISTS crm_product_fts",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is SQLite only; other databases search with icontains.
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement, params=None)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0002_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(run(INSTALL), run(UNINSTALL)),
+    ]
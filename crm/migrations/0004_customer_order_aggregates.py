@@ -0,0 +1,112 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:59
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+# The customer search triggers of 0003_search_indexes, frozen as they were.
+CUSTOMER_SEARCH_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS crm_customer_fts_insert",
+    "CREATE TRIGGER crm_customer_fts_insert AFTER INSERT ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(rowid, name, email) "
+    "VALUES (new.id, new.name, new.email); END",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_delete",
+    "CREATE TRIGGER crm_customer_fts_delete AFTER DELETE ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(crm_customer_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); END",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_update",
+    "CREATE TRIGGER crm_customer_fts_update AFTER UPDATE OF name, email "
+    "ON crm_customer BEGIN "
+    "INSERT INTO crm_customer_fts(crm_customer_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); "
+    "INSERT INTO crm_customer_fts(rowid, name, email) "
+    "VALUES (new.id, new.name, new.email); END",
+    "INSERT INTO crm_customer_fts(crm_customer_fts) VALUES ('rebuild')",
+]
+
+
+def backfill(apps, schema_editor):
+    Customer = apps.get_model("crm", "Customer")
+    Order = apps.get_model("crm", "Order")
+    orders = (
+        Order.objects.filter(customer_id=OuterRef("pk"))
+        .order_by()
+        .values("customer_id")
+    )
+    Customer.objects.update(
+        order_count=Coalesce(
+            Subquery(orders.annotate(value=Count("pk")).values("value")), 0
+        ),
+        lifetime_value=Coalesce(
+            Subquery(orders.annotate(value=Sum("total_amount")).values("value")),
+            Value(0, output_field=models.DecimalField()),
+        ),
+        first_order_date=Subquery(
+            orders.annotate(value=Min("order_date")).values("value")
+        ),
+        last_order_date=Subquery(
+            orders.annotate(value=Max("order_date")).values("value")
+        ),
+    )
+
+
+def reinstall_search(apps, schema_editor):
+    # Adding or removing the columns remakes crm_customer on SQLite, which
+    # drops the search triggers.
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in CUSTOMER_SEARCH_TRIGGERS:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0003_search_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search),
+        migrations.AddField(
+            model_name="customer",
+            name="first_order_date",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="last_order_date",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="lifetime_value",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="order_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["lifetime_value", "id"], name="crm_customer_value_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["order_count", "id"], name="crm_customer_count_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["last_order_date", "id"], name="crm_customer_last_id_idx"
+            ),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.RunPython(reinstall_search, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:02
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_unit_prices(apps, schema_editor):
+    OrderLine = apps.get_model("crm", "OrderLine")
+    Product = apps.get_model("crm", "Product")
+    OrderLine.objects.update(
+        unit_price=Subquery(
+            Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0004_customer_order_aggregates"),
+    ]
+
+    operations = [
+        # OrderLine takes over the table of the implicit order/product link:
+        # same table, columns, FK indexes and unique constraint.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="OrderLine",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "order",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="lines",
+                                to="crm.order",
+                            ),
+                        ),
+                        (
+                            "product",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="order_lines",
+                                to="crm.product",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "crm_order_products",
+                        "unique_together": {("order", "product")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="order",
+                    name="products",
+                    field=models.ManyToManyField(
+                        related_name="order_products",
+                        through="crm.OrderLine",
+                        to="crm.product",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="orderline",
+            name="quantity",
+            field=models.PositiveIntegerField(
+                default=1,
+                validators=[django.core.validators.MinValueValidator(1)],
+            ),
+        ),
+        # Existing lines get the current product price as their snapshot.
+        migrations.AddField(
+            model_name="orderline",
+            name="unit_price",
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(snapshot_unit_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="orderline",
+            name="unit_price",
+            field=models.DecimalField(
+                decimal_places=2,
+                max_digits=10,
+                validators=[django.core.validators.MinValueValidator(0.0)],
+            ),
+        ),
+    ]
@@ -0,0 +1,170 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The history views as crm.archive created them when this migration was
+# written: each one reads the hot table and its archive.
+CREATE_VIEWS = [
+    "DROP VIEW IF EXISTS crm_order_history",
+    "CREATE VIEW crm_order_history AS "
+    "SELECT id, customer_id, total_amount, order_date FROM crm_order "
+    "UNION ALL "
+    "SELECT id, customer_id, total_amount, order_date FROM crm_order_archive",
+    "DROP VIEW IF EXISTS crm_order_products_history",
+    "CREATE VIEW crm_order_products_history AS "
+    "SELECT id, order_id, product_id, quantity, unit_price FROM crm_order_products "
+    "UNION ALL "
+    "SELECT id, order_id, product_id, quantity, unit_price "
+    "FROM crm_order_products_archive",
+]
+DROP_VIEWS = [
+    "DROP VIEW IF EXISTS crm_order_history",
+    "DROP VIEW IF EXISTS crm_order_products_history",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0005_order_lines"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderHistory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("total_amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("order_date", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "crm_order_history",
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="OrderLineHistory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.PositiveIntegerField()),
+                ("unit_price", models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                "db_table": "crm_order_products_history",
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="OrderArchiveSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(unique=True)),
+                ("order_count", models.PositiveIntegerField(default=0)),
+                (
+                    "total_revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ArchivedOrder",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("total_amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("order_date", models.DateTimeField()),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_orders",
+                        to="crm.customer",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "crm_order_archive",
+            },
+        ),
+        migrations.CreateModel(
+            name="ArchivedOrderLine",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("quantity", models.PositiveIntegerField(default=1)),
+                ("unit_price", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lines",
+                        to="crm.archivedorder",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_order_lines",
+                        to="crm.product",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "crm_order_products_archive",
+                "unique_together": {("order", "product")},
+            },
+        ),
+        migrations.AddField(
+            model_name="archivedorder",
+            name="products",
+            field=models.ManyToManyField(
+                related_name="archived_orders",
+                through="crm.ArchivedOrderLine",
+                to="crm.product",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedorder",
+            index=models.Index(
+                fields=["customer", "order_date"], name="crm_archive_customer_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedorder",
+            index=models.Index(
+                fields=["order_date", "id"], name="crm_archive_date_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedorder",
+            index=models.Index(
+                fields=["total_amount", "id"], name="crm_archive_total_id_idx"
+            ),
+        ),
+        migrations.RunSQL(CREATE_VIEWS, DROP_VIEWS),
+    ]
@@ -0,0 +1,149 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:18
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill(apps, schema_editor):
+    # The rollups of every order, archived ones included, as crm.rollups
+    # computed them when this migration was written.
+    utc = datetime.timezone.utc
+    products = defaultdict(lambda: [0, 0, Decimal(0)])
+    customers = defaultdict(lambda: [0, 0, Decimal(0)])
+    for order_name, line_name in (
+        ("Order", "OrderLine"),
+        ("ArchivedOrder", "ArchivedOrderLine"),
+    ):
+        orders = apps.get_model("crm", order_name).objects.order_by()
+        lines = apps.get_model("crm", line_name).objects.order_by()
+        line_day = TruncDate("order__order_date", tzinfo=utc)
+
+        for row in (
+            lines.annotate(day=line_day)
+            .values("day", "product_id")
+            .annotate(
+                order_count=Count("order_id"),
+                units=Sum("quantity"),
+                revenue=Sum(F("quantity") * F("unit_price")),
+            )
+        ):
+            totals = products[row["day"], row["product_id"]]
+            totals[0] += row["order_count"]
+            totals[1] += row["units"]
+            totals[2] += row["revenue"]
+
+        for row in (
+            orders.annotate(day=TruncDate("order_date", tzinfo=utc))
+            .values("day", "customer_id")
+            .annotate(order_count=Count("pk"), revenue=Sum("total_amount"))
+        ):
+            totals = customers[row["day"], row["customer_id"]]
+            totals[0] += row["order_count"]
+            totals[2] += row["revenue"]
+
+        for row in (
+            lines.annotate(day=line_day, customer_id=F("order__customer_id"))
+            .values("day", "customer_id")
+            .annotate(units=Sum("quantity"))
+        ):
+            customers[row["day"], row["customer_id"]][1] += row["units"]
+
+    for model_name, key, totals in (
+        ("DailyProductSales", "product_id", products),
+        ("DailyCustomerSales", "customer_id", customers),
+    ):
+        model = apps.get_model("crm", model_name)
+        model.objects.bulk_create(
+            (
+                model(
+                    day=day,
+                    order_count=order_count,
+                    units=units,
+                    revenue=revenue,
+                    **{key: pk},
+                )
+                for (day, pk), (order_count, units, revenue) in totals.items()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0006_order_archive"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyCustomerSales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("order_count", models.PositiveIntegerField(default=0)),
+                ("units", models.PositiveIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_sales",
+                        to="crm.customer",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("day", "customer")},
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyProductSales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("order_count", models.PositiveIntegerField(default=0)),
+                ("units", models.PositiveIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_sales",
+                        to="crm.product",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("day", "product")},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -6,12 +6,28 @@ from django.db import models
 from django.core.validators import MinValueValidator
 
 
+class VersionedQuerySet(models.QuerySet):
+    """
+    QuerySet of a model behind the response cache and the cached counts.
+    ``update()`` sends no signals, so it moves the model to a new version
+    itself (see crm.response_cache).
+    """
+
+    def update(self, **kwargs):
+        from crm.response_cache import invalidate
+
+        rows = super().update(**kwargs)
+        if rows:
+            invalidate(self.model)
+        return rows
+
+
 class Customer(models.Model):
     """
     Model to represent a customer in the CRM system.
     """
 
-    objects = models.BaseManager()
+    objects = VersionedQuerySet.as_manager()
 
     name = models.CharField(max_length=255, blank=False, null=False)
     email = models.EmailField(unique=True, blank=False, null=False)
@@ -19,6 +35,37 @@ class Customer(models.Model):
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Order aggregates maintained by crm.aggregates, never written directly.
+    order_count = models.PositiveIntegerField(default=0, editable=False)
+    lifetime_value = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False
+    )
+    first_order_date = models.DateTimeField(null=True, blank=True, editable=False)
+    last_order_date = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        """
+        The (field, id) indexes serve the range filters and the orderings of
+        CustomerFilter, and keyset pages ordered by field then pk.
+        """
+
+        indexes = [
+            models.Index(fields=["name", "id"], name="crm_customer_name_id_idx"),
+            models.Index(
+                fields=["created_at", "id"], name="crm_customer_created_id_idx"
+            ),
+            models.Index(fields=["phone"], name="crm_customer_phone_idx"),
+            models.Index(
+                fields=["lifetime_value", "id"], name="crm_customer_value_id_idx"
+            ),
+            models.Index(
+                fields=["order_count", "id"], name="crm_customer_count_id_idx"
+            ),
+            models.Index(
+                fields=["last_order_date", "id"], name="crm_customer_last_id_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"Customer {self.name}, Email: {self.email}, Phone: {self.phone}"
 
@@ -28,7 +75,7 @@ class Product(models.Model):
     Model to represent a product in the CRM system.
     """
 
-    objects = models.BaseManager()
+    objects = VersionedQuerySet.as_manager()
 
     name = models.CharField(max_length=255, blank=False, null=False)
     price = models.DecimalField(
@@ -39,6 +86,18 @@ class Product(models.Model):
     )
     stock = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        """
+        The (field, id) indexes serve the range filters and the orderings of
+        ProductFilter; (stock, id) also serves the low-stock restock.
+        """
+
+        indexes = [
+            models.Index(fields=["name", "id"], name="crm_product_name_id_idx"),
+            models.Index(fields=["price", "id"], name="crm_product_price_id_idx"),
+            models.Index(fields=["stock", "id"], name="crm_product_stock_id_idx"),
+        ]
+
     def __str__(self):
         return f"Product {self.name}, Price: {self.price}, Stock: {self.stock}"
 
@@ -48,12 +107,18 @@ class Order(models.Model):
     Model to represent an order in the CRM system.
     """
 
+    objects = VersionedQuerySet.as_manager()
+
+    # Indexed by (customer, order_date) below, which also serves customer lookups.
     customer = models.ForeignKey(
-        Customer, related_name="order_customer", on_delete=models.CASCADE
+        Customer,
+        related_name="order_customer",
+        on_delete=models.CASCADE,
+        db_index=False,
     )
 
     products = models.ManyToManyField(
-        "Product", related_name="order_products", blank=False
+        "Product", related_name="order_products", blank=False, through="OrderLine"
     )
 
     total_amount = models.DecimalField(
@@ -65,6 +130,254 @@ class Order(models.Model):
 
     order_date = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        """
+        (customer, order_date) serves a customer's orders by date; the
+        (field, id) indexes serve the range filters and orderings of
+        OrderFilter.
+        """
+
+        indexes = [
+            models.Index(
+                fields=["customer", "order_date"], name="crm_order_customer_date_idx"
+            ),
+            models.Index(fields=["order_date", "id"], name="crm_order_date_id_idx"),
+            models.Index(fields=["total_amount", "id"], name="crm_order_total_id_idx"),
+        ]
+
     def __str__(self):
         products = ", ".join([product.name for product in self.products.all()])
         return f"Order {self.id} for {self.customer.name} - {products}"
+
+
+class OrderLine(models.Model):
+    """
+    Model to represent one product of an order in the CRM system.
+    It keeps the quantity bought and the unit price at purchase time, so
+    revenue can be computed in SQL after prices change.
+    """
+
+    order = models.ForeignKey(Order, related_name="lines", on_delete=models.CASCADE)
+    product = models.ForeignKey(
+        Product, related_name="order_lines", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+    unit_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=False,
+        validators=[MinValueValidator(0.00)],
+    )
+
+    class Meta:
+        """
+        Meta class for the OrderLine.
+        It keeps the table of the former implicit order/product link.
+        """
+
+        db_table = "crm_order_products"
+        unique_together = [("order", "product")]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} at {self.unit_price}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    Model to represent an order moved out of the hot orders table.
+    crm.archive moves old orders here with their original id, lines and date;
+    OrderHistory reads both tables as one.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    # Indexed by (customer, order_date) below, which also serves customer lookups.
+    customer = models.ForeignKey(
+        Customer,
+        related_name="archived_orders",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    products = models.ManyToManyField(
+        "Product", related_name="archived_orders", through="ArchivedOrderLine"
+    )
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    order_date = models.DateTimeField()
+
+    class Meta:
+        """Meta class for the ArchivedOrder, indexed like Order."""
+
+        db_table = "crm_order_archive"
+        indexes = [
+            models.Index(
+                fields=["customer", "order_date"],
+                name="crm_archive_customer_date_idx",
+            ),
+            models.Index(fields=["order_date", "id"], name="crm_archive_date_id_idx"),
+            models.Index(
+                fields=["total_amount", "id"], name="crm_archive_total_id_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.id} of {self.order_date:%Y-%m-%d}"
+
+
+class ArchivedOrderLine(models.Model):
+    """
+    Model to represent one product of an archived order.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        ArchivedOrder, related_name="lines", on_delete=models.CASCADE
+    )
+    product = models.ForeignKey(
+        Product, related_name="archived_order_lines", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        """Meta class for the ArchivedOrderLine."""
+
+        db_table = "crm_order_products_archive"
+        unique_together = [("order", "product")]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} at {self.unit_price}"
+
+
+class OrderArchiveSummary(models.Model):
+    """
+    Model to represent the archived orders of one UTC day, summed up.
+    Statistics add these rows instead of scanning the archive.
+    """
+
+    day = models.DateField(unique=True)
+    order_count = models.PositiveIntegerField(default=0)
+    total_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.order_count} orders, {self.total_revenue}"
+
+
+class OrderHistory(models.Model):
+    """
+    Model to represent every order, hot or archived.
+    It reads the crm_order_history view (crm_order UNION ALL
+    crm_order_archive), so it accepts the filters, orderings and relations of
+    Order and its rows have the ids of the orders they come from. The views
+    are created by crm.archive.install_views.
+    """
+
+    customer = models.ForeignKey(
+        Customer, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    products = models.ManyToManyField(
+        "Product", related_name="+", through="OrderLineHistory"
+    )
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    order_date = models.DateTimeField()
+
+    class Meta:
+        """Meta class for the OrderHistory, a read-only view."""
+
+        managed = False
+        db_table = "crm_order_history"
+
+
+class OrderLineHistory(models.Model):
+    """
+    Model to represent every order line, hot or archived, read from the
+    crm_order_products_history view.
+    """
+
+    order = models.ForeignKey(
+        OrderHistory,
+        related_name="lines",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    product = models.ForeignKey(
+        Product, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        """Meta class for the OrderLineHistory, a read-only view."""
+
+        managed = False
+        db_table = "crm_order_products_history"
+
+
+class DailyProductSales(models.Model):
+    """
+    Model to represent the sales of one product on one UTC day.
+    Maintained by crm.rollups; revenue is the sum of the line totals.
+    """
+
+    day = models.DateField()
+    product = models.ForeignKey(
+        Product, related_name="daily_sales", on_delete=models.CASCADE
+    )
+    order_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        """
+        The unique (day, product) index serves the day ranges of
+        salesTimeseries and the upserts of crm.rollups.
+        """
+
+        unique_together = [("day", "product")]
+
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.units} units, {self.revenue}"
+
+
+class DailyCustomerSales(models.Model):
+    """
+    Model to represent the orders of one customer on one UTC day.
+    Maintained by crm.rollups; revenue is the sum of the order totals.
+    """
+
+    day = models.DateField()
+    customer = models.ForeignKey(
+        Customer, related_name="daily_sales", on_delete=models.CASCADE
+    )
+    order_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        """
+        The unique (day, customer) index serves the day ranges of
+        salesTimeseries and the upserts of crm.rollups.
+        """
+
+        unique_together = [("day", "customer")]
+
+    def __str__(self):
+        return f"{self.day} {self.customer_id}: {self.order_count} orders"
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Model to represent the progress of one manage.py crm_import run.
+    It is saved in the transaction of each batch, so a resumed import skips
+    exactly the rows already committed.
+    """
+
+    key = models.CharField(max_length=255, unique=True)
+    rows = models.PositiveBigIntegerField(default=0)
+    # Orders only: what the aggregates and rollups are recomputed over.
+    first_order_id = models.BigIntegerField(null=True, blank=True)
+    first_day = models.DateField(null=True, blank=True)
+    last_day = models.DateField(null=True, blank=True)
+    finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.rows} rows"
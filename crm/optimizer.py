@@ -0,0 +1,139 @@
+"""crm/optimizer.py
+This file contains the queryset optimizer for the CRM connections.
+
+It walks the GraphQL selection set of a connection field and applies
+``select_related``, ``prefetch_related`` and ``only`` so that a page loads
+exactly the rows and columns the client asked for.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+CONNECTION_ARGUMENTS = {"first", "last", "before", "after", "offset"}
+
+
+def collect_fields(selection_set, info):
+    """Return the field nodes of a selection set, expanding fragments."""
+    fields = []
+    if selection_set is None:
+        return fields
+
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            fields.append(selection)
+        elif isinstance(selection, InlineFragmentNode):
+            fields.extend(collect_fields(selection.selection_set, info))
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = info.fragments.get(selection.name.value)
+            if fragment is not None:
+                fields.extend(collect_fields(fragment.selection_set, info))
+    return fields
+
+
+def node_fields(connection_nodes, info):
+    """Return the fields selected on ``edges { node { ... } }`` of connections."""
+    fields = []
+    for connection_node in connection_nodes:
+        for edges in collect_fields(connection_node.selection_set, info):
+            if edges.name.value != "edges":
+                continue
+            for node in collect_fields(edges.selection_set, info):
+                if node.name.value == "node":
+                    fields.extend(collect_fields(node.selection_set, info))
+    return fields
+
+
+def relation_fields(field_node, info):
+    """Return the fields selected on a to-many relation, connection or list."""
+    fields = collect_fields(field_node.selection_set, info)
+    if any(field.name.value == "edges" for field in fields):
+        return node_fields([field_node], info)
+    return fields
+
+
+def has_filter_arguments(field_node):
+    """Tell whether a nested connection is filtered or ordered by the client."""
+    return any(
+        argument.name.value not in CONNECTION_ARGUMENTS
+        for argument in field_node.arguments
+    )
+
+
+def plan(model, fields, info, prefix, only, select, prefetch):
+    """
+    Fill ``only``, ``select`` and ``prefetch`` for the selected fields.
+    Returns False when a selected field is not a model field, in which case
+    the columns it needs are unknown and ``only`` must not be applied.
+    """
+    can_defer = True
+
+    only.append(prefix + model._meta.pk.name)
+    for field in model._meta.concrete_fields:
+        if field.is_relation:
+            # Foreign keys are needed by the DataLoaders and by prefetches.
+            only.append(prefix + field.name)
+
+    for field_node in fields:
+        name = field_node.name.value
+        if name.startswith("__"):
+            continue
+
+        try:
+            field = model._meta.get_field(to_snake_case(name))
+        except FieldDoesNotExist:
+            can_defer = False
+            continue
+
+        if field.many_to_many or field.one_to_many:
+            if has_filter_arguments(field_node):
+                continue
+            queryset = optimize_fields(
+                field.related_model._default_manager.all(),
+                relation_fields(field_node, info),
+                info,
+            )
+            prefetch.append(Prefetch(prefix + field.name, queryset=queryset))
+        elif field.is_relation:
+            select.append(prefix + field.name)
+            can_defer &= plan(
+                field.related_model,
+                collect_fields(field_node.selection_set, info),
+                info,
+                prefix + field.name + "__",
+                only,
+                select,
+                prefetch,
+            )
+        else:
+            only.append(prefix + field.name)
+
+    return can_defer
+
+
+def optimize_fields(queryset, fields, info):
+    """Apply the plan for ``fields`` to ``queryset``."""
+    only, select, prefetch = [], [], []
+    if plan(queryset.model, fields, info, "", only, select, prefetch):
+        queryset = queryset.only(*only)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def optimize_queryset(queryset, info):
+    """
+    Optimize the queryset of a connection field for the current selection.
+    """
+    return optimize_fields(queryset, node_fields(info.field_nodes, info), info)
+
+
+def get_prefetched(instance, name):
+    """Return the prefetched objects of relation ``name``, or None."""
+    cache = getattr(instance, "_prefetched_objects_cache", {})
+    if name in cache:
+        return list(cache[name])
+    return None
@@ -0,0 +1,149 @@
+"""crm/orders.py
+This file contains the order placement logic used by the CreateOrder mutation.
+
+Placing an order runs in one transaction with a fixed number of statements,
+whatever the number of products: one read of the unit prices, one
+conditional stock decrement, one order INSERT, one bulk INSERT of the order
+lines, one UPDATE of the customer's order aggregates and two upserts (an
+INSERT ignoring conflicts, then an UPDATE) per daily sales rollup.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Q,
+    Sum,
+    When,
+)
+
+from crm.aggregates import record_order
+from crm.models import Customer, Order, OrderLine, Product
+from crm.response_cache import invalidate
+from crm.rollups import record_sales
+
+
+class OrderError(ValueError):
+    """Raised when an order cannot be placed; nothing is written."""
+
+
+class OutOfStock(Exception):
+    """Rolls the placement back when the stock decrement misses a product."""
+
+
+def per_product(quantities, value):
+    """Return a CASE expression giving ``value(quantity)`` for each product."""
+    return Case(
+        *[When(pk=pk, then=value(quantity)) for pk, quantity in quantities.items()]
+    )
+
+
+def place_order(customer_id, quantities):
+    """
+    Create an order for ``customer_id`` with ``{product_id: quantity}``.
+    Stock is decremented with a conditional UPDATE so concurrent orders can
+    never oversell a product.
+    """
+    try:
+        quantities = {int(pk): quantity for pk, quantity in quantities.items()}
+    except (TypeError, ValueError):
+        raise OrderError("Product IDs must be integers.")
+    if not quantities:
+        raise OrderError("An order needs at least one product.")
+    if any(quantity < 1 for quantity in quantities.values()):
+        raise OrderError("Quantities must be at least 1.")
+
+    try:
+        customer = Customer.objects.get(id=customer_id)
+    except (Customer.DoesNotExist, ValueError):
+        raise OrderError(f"Customer with ID {customer_id} does not exist.")
+
+    products = Product.objects.filter(pk__in=quantities)
+
+    try:
+        order = create_order(customer, products, quantities)
+    except OutOfStock:
+        # Read the stock after the rollback to name the short products.
+        short = sorted(
+            pk
+            for pk, stock in products.values_list("pk", "stock")
+            if stock < quantities[pk]
+        )
+        raise OrderError(f"Insufficient stock for products with IDs {short}.")
+
+    # The UPDATEs and the line bulk_create send no signals.
+    invalidate(Customer, Order, Product)
+    return order
+
+
+def create_order(customer, products, quantities):
+    """Write the order, its lines and the stock decrement in one transaction."""
+    with transaction.atomic():
+        # Existence check and unit price snapshot in one read.
+        prices = dict(products.values_list("pk", "price"))
+        if len(prices) != len(quantities):
+            missing = sorted(set(quantities) - set(prices))
+            raise OrderError(f"Products with IDs {missing} do not exist.")
+
+        # Decrement every product at once, only where enough stock is left.
+        in_stock = Q()
+        for pk, quantity in quantities.items():
+            in_stock |= Q(pk=pk, stock__gte=quantity)
+        updated = products.filter(in_stock).update(
+            stock=per_product(quantities, lambda quantity: F("stock") - quantity)
+        )
+        if updated != len(quantities):
+            raise OutOfStock()
+
+        total_amount = sum(
+            (prices[pk] * quantity for pk, quantity in quantities.items()),
+            Decimal(0),
+        ).quantize(Decimal("0.01"))
+        order = Order.objects.create(customer=customer, total_amount=total_amount)
+
+        OrderLine.objects.bulk_create(
+            [
+                OrderLine(
+                    order_id=order.pk,
+                    product_id=pk,
+                    quantity=quantity,
+                    unit_price=prices[pk],
+                )
+                for pk, quantity in quantities.items()
+            ]
+        )
+        record_order(order)
+        record_sales(order, quantities, prices)
+
+    return order
+
+
+def line_total():
+    """Return the ``quantity * unit_price`` expression of an order line."""
+    return ExpressionWrapper(
+        F("quantity") * F("unit_price"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def product_revenue(lines=None):
+    """
+    Return the units sold, orders and revenue of each product in ``lines``
+    (every order line by default), best sellers first, with one grouped query.
+    """
+    if lines is None:
+        lines = OrderLine.objects.all()
+    return (
+        lines.values("product_id")
+        .annotate(
+            units_sold=Sum("quantity"),
+            order_count=Count("order_id"),
+            revenue=Sum(line_total()),
+        )
+        .order_by("-revenue", "product_id")
+    )
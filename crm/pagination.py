@@ -0,0 +1,208 @@
+"""crm/pagination.py
+This file contains the keyset (seek) pagination used by the CRM connections.
+
+Keyset cursors encode the ``orderBy`` sort key plus the id of a row, and the
+next page is fetched with ``WHERE (key, id) > (cursor key, cursor id)``
+instead of ``OFFSET``, so every page costs the same as the first one.
+NULL sort values (``lastOrderDate`` of a customer without orders) come after
+every other value, so they sort last ascending and first descending.
+
+Forward offset pages (first, after, offset) skip the COUNT(*) as well; the
+count behind totalCount is left to crm.counting.
+"""
+
+import base64
+import json
+
+from django.db.models import F, Q
+from graphene.relay.connection import connection_adapter, page_info_adapter
+from graphql_relay import get_offset_with_default, offset_to_cursor
+from graphene.utils.str_converters import to_snake_case
+
+KEYSET_PREFIX = "keyset:"
+
+
+def encode_cursor(field_name, value, pk):
+    """Return an opaque cursor for a row."""
+    # str() keeps the full microsecond precision of datetimes, which
+    # DjangoJSONEncoder would truncate.
+    payload = KEYSET_PREFIX + json.dumps([field_name, value, pk], default=str)
+    return base64.b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, field_name, model):
+    """Return the (sort value, pk) stored in a cursor."""
+    try:
+        payload = base64.b64decode(cursor).decode("utf-8")
+        if not payload.startswith(KEYSET_PREFIX):
+            raise ValueError(payload)
+        name, value, pk = json.loads(payload[len(KEYSET_PREFIX) :])
+    except ValueError:
+        raise ValueError(f"Invalid keyset cursor: {cursor}")
+
+    if name != field_name:
+        raise ValueError("The cursor was created for a different orderBy.")
+
+    return model._meta.get_field(field_name).to_python(value), pk
+
+
+def get_sort_field(connection, args):
+    """
+    Return the model field and direction requested through ``orderBy``.
+    Only the orderings declared on the node's filterset are accepted.
+    """
+    model = connection._meta.node._meta.model
+    order_by = args.get("order_by")
+    if not order_by:
+        return model._meta.pk.name, False
+
+    value = to_snake_case(order_by).strip()
+    if "," in value:
+        raise ValueError("Keyset pagination supports a single orderBy field.")
+
+    descending = value.startswith("-")
+    param = value.lstrip("-")
+
+    filterset_class = connection._meta.node._meta.filterset_class
+    param_map = filterset_class.base_filters["order_by"].param_map
+    if param not in param_map:
+        raise ValueError(f"Cannot use keyset pagination with orderBy {order_by}.")
+
+    return param_map[param], descending
+
+
+def seek(field_name, value, pk, pk_name, greater, nullable=False):
+    """
+    Return the condition selecting rows after (or before) a cursor, NULL
+    sort values being greater than any other.
+    """
+    lookup = "gt" if greater else "lt"
+    if field_name == pk_name:
+        return Q(**{f"pk__{lookup}": pk})
+    if value is None:
+        # SQL compares nothing to NULL: the NULL rows are matched explicitly.
+        nulls = Q(**{f"{field_name}__isnull": True, f"pk__{lookup}": pk})
+        if greater:
+            return nulls
+        return Q(**{f"{field_name}__isnull": False}) | nulls
+    condition = Q(**{f"{field_name}__{lookup}": value}) | Q(
+        **{field_name: value, f"pk__{lookup}": pk}
+    )
+    if nullable and greater:
+        condition |= Q(**{f"{field_name}__isnull": True})
+    return condition
+
+
+def keyset_connection(connection, queryset, args, max_limit=None):
+    """
+    Build a relay connection page without OFFSET and without COUNT(*).
+    """
+    if args.get("offset"):
+        raise ValueError("offset cannot be combined with keyset pagination.")
+
+    model = queryset.model
+    pk_name = model._meta.pk.name
+    field_name, descending = get_sort_field(connection, args)
+
+    first = args.get("first")
+    last = args.get("last")
+    after = args.get("after")
+    before = args.get("before")
+    if first is None and last is None:
+        first = max_limit
+
+    nullable = model._meta.get_field(field_name).null
+    prefix = "-" if descending else ""
+    ordering = [f"{prefix}{field_name}"]
+    if nullable:
+        # The same NULL placement for every backend; reverse() swaps it.
+        if descending:
+            ordering = [F(field_name).desc(nulls_first=True)]
+        else:
+            ordering = [F(field_name).asc(nulls_last=True)]
+    if field_name != pk_name:
+        ordering.append(f"{prefix}pk")
+
+    # The sort value is annotated so that .only() from the optimizer cannot
+    # defer it and turn cursor creation into one query per row.
+    queryset = queryset.annotate(keyset_value=F(field_name)).order_by(*ordering)
+    if after:
+        value, pk = decode_cursor(after, field_name, model)
+        queryset = queryset.filter(
+            seek(field_name, value, pk, pk_name, not descending, nullable)
+        )
+    if before:
+        value, pk = decode_cursor(before, field_name, model)
+        queryset = queryset.filter(
+            seek(field_name, value, pk, pk_name, descending, nullable)
+        )
+
+    backwards = first is None
+    limit = last if backwards else first
+    if backwards:
+        queryset = queryset.reverse()
+
+    rows = list(queryset[: limit + 1]) if limit is not None else list(queryset)
+    has_more = limit is not None and len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    elif last is not None:
+        rows = rows[-last:] if last else []
+
+    edges = [
+        connection.Edge(
+            node=row, cursor=encode_cursor(field_name, row.keyset_value, row.pk)
+        )
+        for row in rows
+    ]
+    page_info = page_info_adapter(
+        startCursor=edges[0].cursor if edges else None,
+        endCursor=edges[-1].cursor if edges else None,
+        hasPreviousPage=has_more if backwards else bool(after),
+        hasNextPage=bool(before) if backwards else has_more,
+    )
+
+    result = connection_adapter(connection, edges, page_info)
+    result.iterable = queryset
+    result.length = None
+    return result
+
+
+def offset_connection(connection, queryset, args, max_limit=None):
+    """
+    Build a forward relay connection page (first, after, offset) without
+    COUNT(*): one more row than requested tells whether there is a next page.
+    Cursors are the usual offset cursors.
+    """
+    start = get_offset_with_default(args.get("after"), -1) + 1
+    start += args.get("offset") or 0
+
+    first = args.get("first")
+    if first is None:
+        first = max_limit
+    if first is not None and first < 0:
+        raise ValueError("Argument 'first' must be a non-negative integer.")
+
+    if first is None:
+        rows = list(queryset[start:])
+    else:
+        rows = list(queryset[start : start + first + 1])
+    has_more = first is not None and len(rows) > first
+    rows = rows[:first]
+
+    edges = [
+        connection.Edge(node=row, cursor=offset_to_cursor(start + index))
+        for index, row in enumerate(rows)
+    ]
+    page_info = page_info_adapter(
+        startCursor=edges[0].cursor if edges else None,
+        endCursor=edges[-1].cursor if edges else None,
+        hasPreviousPage=False,
+        hasNextPage=has_more,
+    )
+
+    result = connection_adapter(connection, edges, page_info)
+    result.iterable = queryset
+    result.length = None
+    return result
@@ -0,0 +1,185 @@
+"""crm/response_cache.py
+This file contains the opt-in response cache for GraphQL query operations.
+
+Entries are keyed by the normalized document, the variables, the viewer and
+the current version of every model the operation reads. Saving, deleting or
+updating a Customer, Product or Order (through a mutation or the ORM, where
+``QuerySet.update()`` bumps the version itself, see
+crm.models.VersionedQuerySet) moves that model to a new version, so entries
+built from older data can never be served again.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLInterfaceType,
+    GraphQLObjectType,
+    GraphQLUnionType,
+    InlineFragmentNode,
+    get_named_type,
+    print_ast,
+)
+from graphene_django import DjangoObjectType
+
+from crm.models import Customer, Order, Product
+
+CACHED_MODELS = (Customer, Product, Order)
+VERSION_KEY = "crm:response-cache:version:{}"
+ENTRY_KEY = "crm:response-cache:entry:{}"
+
+
+def is_enabled():
+    """Tell whether the response cache is switched on."""
+    return getattr(settings, "CRM_RESPONSE_CACHE_ENABLED", False)
+
+
+def get_backend():
+    """Return the Django cache backend storing the entries."""
+    return caches[getattr(settings, "CRM_RESPONSE_CACHE_ALIAS", "default")]
+
+
+def get_versions(models):
+    """Return the current version of each model, creating missing ones."""
+    backend = get_backend()
+    keys = {VERSION_KEY.format(model._meta.label_lower): model for model in models}
+    versions = backend.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            backend.add(key, time.time_ns(), timeout=None)
+            versions[key] = backend.get(key)
+    return sorted(versions.items())
+
+
+def invalidate(*models):
+    """
+    Move ``models`` to a new version, now and again when the current
+    transaction commits, so readers cannot cache pre-commit data under the
+    new version.
+    """
+
+    def bump():
+        backend = get_backend()
+        backend.set_many(
+            {
+                VERSION_KEY.format(model._meta.label_lower): time.time_ns()
+                for model in models
+            },
+            timeout=None,
+        )
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_operation_models(schema, document, operation_ast):
+    """
+    Return the models read by an operation by walking its selection set.
+    Object types may declare ``cache_models`` when they read models without
+    being a DjangoObjectType; abstract types depend on every cached model.
+    """
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if getattr(definition, "selection_set", None) is not None
+        and definition is not operation_ast
+        and getattr(definition, "name", None) is not None
+    }
+    models = set()
+
+    def walk(parent_type, selection_set):
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field = parent_type.fields.get(selection.name.value)
+                if field is None:
+                    continue
+                field_type = get_named_type(field.type)
+                if isinstance(field_type, (GraphQLInterfaceType, GraphQLUnionType)):
+                    models.update(CACHED_MODELS)
+                elif isinstance(field_type, GraphQLObjectType):
+                    visit_type(field_type)
+                    walk(field_type, selection.selection_set)
+            elif isinstance(selection, InlineFragmentNode):
+                walk(parent_type, selection.selection_set)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = fragments.get(selection.name.value)
+                if fragment is not None:
+                    walk(parent_type, fragment.selection_set)
+
+    def visit_type(object_type):
+        graphene_type = getattr(object_type, "graphene_type", None)
+        if graphene_type is None:
+            return
+        if issubclass(graphene_type, DjangoObjectType):
+            models.add(graphene_type._meta.model)
+        models.update(getattr(graphene_type, "cache_models", ()))
+
+    walk(schema.query_type, operation_ast.selection_set)
+    return models
+
+
+def make_key(schema, document, operation_ast, variables, viewer):
+    """Return the cache key of a query operation."""
+    models = get_operation_models(schema, document, operation_ast)
+    operation_name = operation_ast.name.value if operation_ast.name else None
+    payload = json.dumps(
+        [
+            print_ast(document),
+            operation_name,
+            variables or {},
+            viewer,
+            get_versions(models),
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return ENTRY_KEY.format(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+
+def lookup(key):
+    """Return the cached response data or None."""
+    return get_backend().get(key)
+
+
+def store(key, data):
+    """Store response data."""
+    get_backend().set(
+        key, data, timeout=getattr(settings, "CRM_RESPONSE_CACHE_TIMEOUT", 60)
+    )
+
+
+def invalidate_instance(sender, **kwargs):
+    """Signal receiver invalidating the model of a saved or deleted row."""
+    invalidate(sender)
+
+
+def invalidate_order_products(sender, action, **kwargs):
+    """Signal receiver invalidating orders and products when links change."""
+    if action.startswith("post_"):
+        invalidate(Order, Product)
+
+
+def connect_signals():
+    """Connect the invalidation receivers, called from CrmConfig.ready()."""
+    for model in CACHED_MODELS:
+        label = model._meta.label_lower
+        post_save.connect(
+            invalidate_instance, sender=model, dispatch_uid=f"crm-cache-save-{label}"
+        )
+        post_delete.connect(
+            invalidate_instance, sender=model, dispatch_uid=f"crm-cache-delete-{label}"
+        )
+    m2m_changed.connect(
+        invalidate_order_products,
+        sender=Order.products.through,
+        dispatch_uid="crm-cache-order-products",
+    )
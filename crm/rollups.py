@@ -0,0 +1,235 @@
+"""crm/rollups.py
+This file contains the maintenance of the daily sales rollups read by the
+salesTimeseries query.
+
+DailyProductSales and DailyCustomerSales hold, per UTC day, the orders, units
+and revenue of each product and customer. Placing an order adds to them with
+a fixed number of statements, whatever the number of products; ``rebuild``
+recomputes a range of days from every order, archived ones included
+(crm.tasks.rebuild_sales_rollups). Deleted orders stay counted until the next
+rebuild.
+"""
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, Sum, When
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+
+from crm.models import (
+    ArchivedOrder,
+    ArchivedOrderLine,
+    DailyCustomerSales,
+    DailyProductSales,
+    Order,
+    OrderLine,
+)
+from crm.response_cache import invalidate
+
+ONE_DAY = datetime.timedelta(days=1)
+ORDER_TABLES = ((Order, OrderLine), (ArchivedOrder, ArchivedOrderLine))
+BATCH_SIZE = 1000
+TRUNCATE = {"week": TruncWeek, "month": TruncMonth}
+
+
+def utc_day(value):
+    """Return the UTC date of datetime ``value``."""
+    return value.astimezone(datetime.timezone.utc).date()
+
+
+def utc_midnight(day):
+    """Return the UTC datetime starting ``day``."""
+    return datetime.datetime.combine(day, datetime.time.min, datetime.timezone.utc)
+
+
+def per_product(values, output_field=None):
+    """Return a CASE expression giving ``values[product_id]`` on each row."""
+    return Case(
+        *[When(product_id=pk, then=value) for pk, value in values.items()],
+        output_field=output_field,
+    )
+
+
+def record_sales(order, quantities, prices):
+    """
+    Add a new order to the rollups of its day: the rows are created if
+    missing, then incremented, with one statement each per table.
+    """
+    day = utc_day(order.order_date)
+
+    DailyProductSales.objects.bulk_create(
+        [DailyProductSales(day=day, product_id=pk) for pk in quantities],
+        ignore_conflicts=True,
+    )
+    DailyProductSales.objects.filter(day=day, product_id__in=quantities).update(
+        order_count=F("order_count") + 1,
+        units=F("units") + per_product(quantities),
+        revenue=F("revenue")
+        + per_product(
+            {pk: prices[pk] * quantity for pk, quantity in quantities.items()},
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+    )
+
+    DailyCustomerSales.objects.bulk_create(
+        [DailyCustomerSales(day=day, customer_id=order.customer_id)],
+        ignore_conflicts=True,
+    )
+    DailyCustomerSales.objects.filter(day=day, customer_id=order.customer_id).update(
+        order_count=F("order_count") + 1,
+        units=F("units") + sum(quantities.values()),
+        revenue=F("revenue") + order.total_amount,
+    )
+
+
+def day_totals(start, end):
+    """
+    Return the product and customer rows of the days from ``start`` to
+    ``end``, summed from the hot and the archived orders, keyed by
+    (day, product id) and (day, customer id).
+    """
+    products = defaultdict(lambda: [0, 0, Decimal(0)])
+    customers = defaultdict(lambda: [0, 0, Decimal(0)])
+    by_day = TruncDate("order_date", tzinfo=datetime.timezone.utc)
+    line_day = TruncDate("order__order_date", tzinfo=datetime.timezone.utc)
+
+    for order_model, line_model in ORDER_TABLES:
+        orders = order_model.objects.filter(
+            order_date__gte=utc_midnight(start), order_date__lt=utc_midnight(end)
+        ).order_by()
+        lines = line_model.objects.filter(
+            order__order_date__gte=utc_midnight(start),
+            order__order_date__lt=utc_midnight(end),
+        ).order_by()
+
+        for row in (
+            lines.annotate(day=line_day)
+            .values("day", "product_id")
+            .annotate(
+                order_count=Count("order_id"),
+                units=Sum("quantity"),
+                revenue=Sum(F("quantity") * F("unit_price")),
+            )
+        ):
+            totals = products[row["day"], row["product_id"]]
+            totals[0] += row["order_count"]
+            totals[1] += row["units"]
+            totals[2] += row["revenue"]
+
+        for row in (
+            orders.annotate(day=by_day)
+            .values("day", "customer_id")
+            .annotate(order_count=Count("pk"), revenue=Sum("total_amount"))
+        ):
+            totals = customers[row["day"], row["customer_id"]]
+            totals[0] += row["order_count"]
+            totals[2] += row["revenue"]
+
+        for row in (
+            lines.annotate(day=line_day, customer_id=F("order__customer_id"))
+            .values("day", "customer_id")
+            .annotate(units=Sum("quantity"))
+        ):
+            customers[row["day"], row["customer_id"]][1] += row["units"]
+
+    return products, customers
+
+
+def rollup_rows(model, key, totals):
+    """Return the ``model`` rows of ``{(day, id): [orders, units, revenue]}``."""
+    return [
+        model(
+            day=day, order_count=order_count, units=units, revenue=revenue, **{key: pk}
+        )
+        for (day, pk), (order_count, units, revenue) in totals.items()
+    ]
+
+
+def rebuild_days(start, end):
+    """Replace the rollups of the days from ``start`` up to ``end`` excluded."""
+    with transaction.atomic():
+        products, customers = day_totals(start, end)
+        DailyProductSales.objects.filter(day__gte=start, day__lt=end).delete()
+        DailyCustomerSales.objects.filter(day__gte=start, day__lt=end).delete()
+        DailyProductSales.objects.bulk_create(
+            rollup_rows(DailyProductSales, "product_id", products),
+            batch_size=BATCH_SIZE,
+        )
+        DailyCustomerSales.objects.bulk_create(
+            rollup_rows(DailyCustomerSales, "customer_id", customers),
+            batch_size=BATCH_SIZE,
+        )
+    return len(products) + len(customers)
+
+
+def day_bounds():
+    """Return the first and last day with orders or rollups, or Nones."""
+    days = []
+    for order_model, _ in ORDER_TABLES:
+        bounds = order_model.objects.aggregate(
+            first=Min("order_date"), last=Max("order_date")
+        )
+        if bounds["first"] is not None:
+            days += [utc_day(bounds["first"]), utc_day(bounds["last"])]
+    for rollup_model in (DailyProductSales, DailyCustomerSales):
+        bounds = rollup_model.objects.aggregate(first=Min("day"), last=Max("day"))
+        if bounds["first"] is not None:
+            days += [bounds["first"], bounds["last"]]
+    if not days:
+        return None, None
+    return min(days), max(days)
+
+
+def rebuild(start=None, end=None, window=31):
+    """
+    Recompute the rollups of the days from ``start`` to ``end`` (dates, both
+    optional and inclusive; every day with orders or rollups by default),
+    ``window`` days per transaction, and return the number of rows written.
+    """
+    if start is None or end is None:
+        first, last = day_bounds()
+        if first is None:
+            return 0
+        start = start or first
+        end = end or last
+
+    written = 0
+    day = start
+    while day <= end:
+        stop = min(day + window * ONE_DAY, end + ONE_DAY)
+        written += rebuild_days(day, stop)
+        day = stop
+
+    invalidate(Order)
+    return written
+
+
+def timeseries(start, end, granularity="day", group_by="total"):
+    """
+    Return the rollups of the days from ``start`` to ``end`` summed per
+    ``granularity`` period ("day", "week" or "month"), in total or per
+    "product" or "customer", oldest period first.
+    Totals and customers read DailyCustomerSales, so an order counts once
+    whatever its number of products.
+    """
+    if group_by == "product":
+        rollups, keys = DailyProductSales.objects.all(), ["product_id"]
+    elif group_by == "customer":
+        rollups, keys = DailyCustomerSales.objects.all(), ["customer_id"]
+    else:
+        rollups, keys = DailyCustomerSales.objects.all(), []
+
+    period = TRUNCATE[granularity]("day") if granularity in TRUNCATE else F("day")
+    return (
+        rollups.filter(day__gte=start, day__lte=end)
+        .annotate(period=period)
+        .values("period", *keys)
+        .annotate(
+            order_count=Sum("order_count"),
+            units=Sum("units"),
+            revenue=Sum("revenue"),
+        )
+        .order_by("period", *keys)
+    )
@@ -0,0 +1,79 @@
+"""crm/routers.py
+This file contains the database router sending GraphQL query operations to a
+read replica.
+
+Writes always go to the primary ("default"). Reads go to the primary too,
+unless the GraphQL view routes the current operation to the replica with
+``read_from``: it does so for query operations when CRM_DATABASE_REPLICA is
+set, except for clients that mutated within the last
+CRM_REPLICA_STICKY_SECONDS, so they read their own writes.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from graphql import OperationType
+
+STICKY_KEY = "crm:db-sticky:{}"
+
+read_database = ContextVar("crm_read_database", default=None)
+
+
+def get_replica():
+    """Return the database alias of the read replica, or None."""
+    return getattr(settings, "CRM_DATABASE_REPLICA", None)
+
+
+@contextmanager
+def read_from(alias):
+    """Route the reads of the current thread or task to ``alias``."""
+    token = read_database.set(alias)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def stick(client_id):
+    """Keep the reads of ``client_id`` on the primary for a short window."""
+    seconds = getattr(settings, "CRM_REPLICA_STICKY_SECONDS", 5)
+    if seconds:
+        caches["default"].set(STICKY_KEY.format(client_id), True, timeout=seconds)
+
+
+def is_sticky(client_id):
+    """Tell whether ``client_id`` mutated within the sticky window."""
+    return bool(caches["default"].get(STICKY_KEY.format(client_id)))
+
+
+def database_for_operation(operation, client_id):
+    """Return the alias the reads of a GraphQL operation must use."""
+    replica = get_replica()
+    if replica is None or operation != OperationType.QUERY:
+        return DEFAULT_DB_ALIAS
+    if is_sticky(client_id):
+        return DEFAULT_DB_ALIAS
+    return replica
+
+
+class PrimaryReplicaRouter:
+    """
+    Database router for the primary/replica setup.
+    Reads follow ``read_from`` (the primary by default) and writes always go
+    to the primary, so a mutation reads what it writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, get_replica()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
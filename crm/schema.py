@@ -6,16 +6,49 @@ crm/schema.py
 This file contains the schema configuration for the GraphQL CRM application.
 """
 
-import datetime
 from decimal import Decimal
 
-import re
 import graphene
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
 from graphene import relay
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
-from crm.models import Customer, Product, Order
+from graphene_django.settings import graphene_settings
+from graphql_relay import from_global_id
+from crm.models import (
+    Customer,
+    Product,
+    Order,
+    OrderHistory,
+    OrderLine,
+    OrderLineHistory,
+)
+from crm.archive import archive_statistics, orders_for, reaches_archive
+from crm.rollups import timeseries
+from crm.fields import CRMConnection, CRMConnectionField
 from crm.filters import CustomerFilter, ProductFilter, OrderFilter
+from crm.loaders import get_loaders
+from crm.optimizer import get_prefetched, optimize_queryset
+from crm.orders import OrderError, place_order, product_revenue
+from crm.response_cache import invalidate
+from crm.validators import PHONE_ERROR, is_valid_phone
+
+BULK_CREATE_BATCH_SIZE = 500
+
+
+def to_pk(value, type_name):
+    """
+    Return the database id given as a raw id or as the relay global id of a
+    ``type_name`` node.
+    """
+    value = str(value)
+    if value.isdigit():
+        return int(value)
+    node_type, pk = from_global_id(value)
+    if node_type != type_name or not pk.isdigit():
+        raise ValueError(f"Invalid {type_name} ID {value}.")
+    return int(pk)
 
 
 class CustomerType(DjangoObjectType):
@@ -24,12 +57,22 @@ class CustomerType(DjangoObjectType):
     This class defines the fields available in the Customer type.
     """
 
+    order_customer = CRMConnectionField(lambda: OrderType, required=True)
+
     class Meta:
         """Meta class for the CustomerType."""
 
         model = Customer
         filterset_class = CustomerFilter
         interfaces = (relay.Node,)
+        connection_class = CRMConnection
+
+    def resolve_order_customer(self, info, **kwargs):
+        """Resolve the customer's orders through the request DataLoader."""
+        prefetched = get_prefetched(self, "order_customer")
+        if prefetched is not None:
+            return prefetched
+        return get_loaders(info).customer_orders.load(self.pk)
 
 
 class CustomerInput(graphene.InputObjectType):
@@ -73,11 +116,8 @@ class CreateCustomer(graphene.Mutation):
                 customer=None, message=f"Customer with email {email} already exists."
             )
 
-        if phone and not re.match(r"^(\+?\d{10}|\d{3}-\d{3}-\d{4})$", phone):
-            return CreateCustomer(
-                customer=None,
-                message="Phone number is not valid. It should be in the format +1234567890 or 123-456-7890.",
-            )
+        if not is_valid_phone(phone):
+            return CreateCustomer(customer=None, message=PHONE_ERROR)
 
         try:
             customer = Customer.objects.create(name=name, email=email, phone=phone)
@@ -117,12 +157,22 @@ class DeleteCustomer(graphene.Mutation):
             return DeleteCustomer(success=False, message=str(e))
 
 
+class BulkRowErrorType(graphene.ObjectType):
+    """Error for one row of a bulk mutation, with its index in the input."""
+
+    index = graphene.Int()
+    message = graphene.String()
+
+
 class BulkCreateCustomers(graphene.Mutation):
     """
     Mutation class for bulk creating customers.
+    The whole batch is validated in memory and against a single uniqueness
+    query, then the valid rows are inserted with chunked bulk_create.
     """
 
     errors = graphene.List(graphene.String)
+    row_errors = graphene.List(BulkRowErrorType)
     customers = graphene.List(CustomerType)
 
     class Arguments:
@@ -134,25 +184,73 @@ class BulkCreateCustomers(graphene.Mutation):
         """Bulk create customers in the CRM system."""
         if not input:
             return BulkCreateCustomers(
-                customers=[], errors=["No customer data provided for bulk creation."]
+                customers=[],
+                row_errors=[],
+                errors=["No customer data provided for bulk creation."],
             )
 
-        customers = []
-        error_messages = []
+        row_errors = []
+
+        # One query finds every name and email of the batch already taken.
+        names = {data.name for data in input if data.name}
+        emails = {data.email for data in input if data.email}
+        existing = Customer.objects.filter(
+            Q(name__in=names) | Q(email__in=emails)
+        ).values_list("name", "email")
+        taken_names = {name for name, _ in existing}
+        taken_emails = {email for _, email in existing}
+
+        seen_names = set()
+        seen_emails = set()
+        valid = []
+        for index, data in enumerate(input):
+            name, email, phone = data.name, data.email, data.phone
+
+            if not name or not email:
+                message = "Name and email are required."
+            elif name in taken_names:
+                message = f"Customer with name {name} already exists."
+            elif email in taken_emails:
+                message = f"Customer with email {email} already exists."
+            elif name in seen_names:
+                message = f"Duplicate name {name} in the batch."
+            elif email in seen_emails:
+                message = f"Duplicate email {email} in the batch."
+            elif not is_valid_phone(phone):
+                message = PHONE_ERROR
+            else:
+                seen_names.add(name)
+                seen_emails.add(email)
+                valid.append(Customer(name=name, email=email, phone=phone))
+                continue
+
+            row_errors.append(BulkRowErrorType(index=index, message=message))
 
-        for data in input:
+        customers = []
+        if valid:
             try:
-                result = CreateCustomer().mutate(info, data)
-
-                if result.customer:
-                    customers.append(result.customer)
-                else:
-                    error_messages.append(result.message)
-
-            except Exception as e:
-                error_messages.append(str(e))
-
-        return BulkCreateCustomers(customers=customers, errors=error_messages)
+                with transaction.atomic():
+                    customers = Customer.objects.bulk_create(
+                        valid, batch_size=BULK_CREATE_BATCH_SIZE
+                    )
+            except IntegrityError as e:
+                # A concurrent insert took a name or email after the probe.
+                row_errors.append(BulkRowErrorType(index=None, message=str(e)))
+            else:
+                invalidate(Customer)
+
+        return BulkCreateCustomers(
+            customers=customers,
+            row_errors=row_errors,
+            errors=[
+                (
+                    f"Row {error.index}: {error.message}"
+                    if error.index is not None
+                    else error.message
+                )
+                for error in row_errors
+            ],
+        )
 
 
 class ProductType(DjangoObjectType):
@@ -160,6 +258,8 @@ class ProductType(DjangoObjectType):
     GraphQL type for the Product model.
     """
 
+    order_products = CRMConnectionField(lambda: OrderType, required=True)
+
     class Meta:
         """Meta class for the ProductType."""
 
@@ -167,6 +267,38 @@ class ProductType(DjangoObjectType):
         fields = "__all__"
         filterset_class = ProductFilter
         interfaces = (relay.Node,)
+        connection_class = CRMConnection
+
+    def resolve_order_products(self, info, **kwargs):
+        """Resolve the orders containing the product through the request DataLoader."""
+        prefetched = get_prefetched(self, "order_products")
+        if prefetched is not None:
+            return prefetched
+        return get_loaders(info).product_orders.load(self.pk)
+
+
+class OrderLineType(DjangoObjectType):
+    """
+    GraphQL type for the OrderLine model.
+    A product of an order with the quantity and unit price it was bought at.
+    """
+
+    line_total = graphene.Decimal()
+
+    class Meta:
+        """Meta class for the OrderLineType."""
+
+        model = OrderLine
+        fields = ("id", "product", "quantity", "unit_price")
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        """Lines of archived orders are read through OrderLineHistory."""
+        return isinstance(root, OrderLineHistory) or super().is_type_of(root, info)
+
+    def resolve_line_total(self, info):
+        """Resolve the line total from the purchase-time unit price."""
+        return self.quantity * self.unit_price
 
 
 class ProductInput(graphene.InputObjectType):
@@ -221,24 +353,53 @@ class UpdateLowStockProducts(graphene.Mutation):
     """
     Mutation class for updating low stock products.
     This mutation can be used to update the stock levels of products that are low in inventory.
+    The restock is a single UPDATE ... SET stock = stock + increment.
     """
 
     success = graphene.Boolean()
     message = graphene.String()
     products = graphene.List(ProductType)
 
-    def mutate(self, info):
+    class Arguments:
+        """Arguments for the update low stock mutation."""
+
+        threshold = graphene.Int(default_value=10)
+        increment = graphene.Int(default_value=10)
+        product_ids = graphene.List(
+            graphene.ID, description="Raw ids or ProductType global ids."
+        )
+        name = graphene.String()
+
+    def mutate(self, info, threshold=10, increment=10, product_ids=None, name=None):
         """Update low stock products in the CRM system."""
         try:
-            low_stock_products = Product.objects.filter(stock__lt=10)
-            for product in low_stock_products:
-                product.stock += 10  # Example logic to increase stock
-                product.save()
+            if increment <= 0:
+                raise ValueError("Increment must be positive.")
+            if threshold < 0:
+                raise ValueError("Threshold cannot be negative.")
+
+            low_stock_products = Product.objects.filter(stock__lt=threshold)
+            if product_ids is not None:
+                low_stock_products = low_stock_products.filter(
+                    pk__in=[to_pk(pk, "ProductType") for pk in product_ids]
+                )
+            if name:
+                low_stock_products = low_stock_products.filter(name__icontains=name)
+
+            with transaction.atomic():
+                # Lock the matching rows, then restock exactly those rows.
+                products = list(low_stock_products.select_for_update().order_by("pk"))
+                Product.objects.filter(pk__in=[p.pk for p in products]).update(
+                    stock=F("stock") + increment
+                )
+
+            for product in products:
+                product.stock += increment
 
             return UpdateLowStockProducts(
                 success=True,
-                message="Low stock products updated successfully.",
-                products=low_stock_products,
+                message=f"{len(products)} low stock products updated successfully.",
+                products=products,
             )
         except ValueError as e:
             return UpdateLowStockProducts(
@@ -251,8 +412,12 @@ class UpdateLowStockProducts(graphene.Mutation):
 class OrderType(DjangoObjectType):
     """
     GraphQL type for the Order model.
+    Archived orders are served as OrderHistory rows, with the same ids.
     """
 
+    products = CRMConnectionField(ProductType, required=True)
+    lines = graphene.List(graphene.NonNull(OrderLineType), required=True)
+
     class Meta:
         """Meta class for the OrderType."""
 
@@ -260,13 +425,43 @@ class OrderType(DjangoObjectType):
         fields = "__all__"
         filterset_class = OrderFilter
         interfaces = (relay.Node,)
+        connection_class = CRMConnection
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        """Accept the OrderHistory rows of archived orders."""
+        return isinstance(root, OrderHistory) or super().is_type_of(root, info)
+
+    def resolve_customer(self, info):
+        """Resolve the order's customer through the request DataLoader."""
+        if Order.customer.is_cached(self):
+            return self.customer
+        return get_loaders(info).customer.load(self.customer_id)
+
+    def resolve_products(self, info, **kwargs):
+        """Resolve the order's products through the request DataLoader."""
+        prefetched = get_prefetched(self, "products")
+        if prefetched is not None:
+            return prefetched
+        return get_loaders(info).order_products.load(self.pk)
+
+    def resolve_lines(self, info):
+        """Resolve the order's lines through the request DataLoader."""
+        prefetched = get_prefetched(self, "lines")
+        if prefetched is not None:
+            return prefetched
+        return get_loaders(info).order_lines.load(self.pk)
 
 
 class OrderInput(graphene.InputObjectType):
-    """Input type for order data in mutations."""
+    """
+    Input type for order data in mutations.
+    quantities, when given, holds the quantity of each entry of productIds.
+    """
 
     customerId = graphene.ID(required=True)
     productIds = graphene.List(graphene.ID, required=True)
+    quantities = graphene.List(graphene.NonNull(graphene.Int))
 
 
 class CreateOrder(graphene.Mutation):
@@ -285,33 +480,91 @@ class CreateOrder(graphene.Mutation):
 
     def mutate(self, info, input):
         """Create a new order in the CRM system."""
-        try:
-            customer = Customer.objects.get(id=input.customerId)
-        except Customer.DoesNotExist:
-            raise ValueError(f"Customer with ID {input.customerId} does not exist.")
+        counts = input.quantities or [1] * len(input.productIds)
+        if len(counts) != len(input.productIds):
+            raise OrderError("quantities must have one entry per product ID.")
+        if any(quantity < 1 for quantity in counts):
+            raise OrderError("Quantities must be at least 1.")
 
-        try:
-            products = Product.objects.filter(id__in=input.productIds)
-        except Product.DoesNotExist:
-            raise ValueError("One or more products do not exist.")
+        # Repeated product ids add up their quantities.
+        quantities = {}
+        for product_id, quantity in zip(input.productIds, counts):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
 
         try:
-            total_amount = sum(product.price for product in products)
-            order_date = datetime.datetime.now()
+            order = place_order(input.customerId, quantities)
+        except OrderError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Error creating order: {str(e)}")
 
-            order = Order.objects.create(
-                customer=customer, order_date=order_date, total_amount=total_amount
-            )
-            order.products.set(products)
+        return CreateOrder(
+            order=order,
+            total_amount=order.total_amount,
+            order_date=order.order_date,
+        )
 
-            return CreateOrder(
-                order=order,
-                total_amount=total_amount,
-                order_date=order_date,
-            )
 
-        except Exception as e:
-            raise ValueError(f"Error creating order: {str(e)}")
+class CRMStatisticsType(graphene.ObjectType):
+    """
+    Aggregated CRM figures computed by the database.
+    customerCount counts every customer; the order figures are limited to
+    the requested order date range.
+    """
+
+    cache_models = (Customer, Order)
+
+    customer_count = graphene.Int()
+    order_count = graphene.Int()
+    total_revenue = graphene.Decimal()
+    average_order_value = graphene.Decimal()
+
+
+class ProductRevenueType(graphene.ObjectType):
+    """
+    Units sold, orders and revenue of one product, computed by the database
+    from the order lines and their purchase-time unit prices.
+    """
+
+    cache_models = (Order, Product)
+
+    product = graphene.Field(ProductType)
+    units_sold = graphene.Int()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
+
+
+class SalesGranularity(graphene.Enum):
+    """Length of the periods of salesTimeseries."""
+
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
+class SalesGroupBy(graphene.Enum):
+    """Series of salesTimeseries: one in total, or one per product or customer."""
+
+    TOTAL = "total"
+    PRODUCT = "product"
+    CUSTOMER = "customer"
+
+
+class SalesPointType(graphene.ObjectType):
+    """
+    Orders, units and revenue of one period, for one product or customer when
+    grouped, read from the daily sales rollups.
+    period is the first day of the period (a Monday for weeks).
+    """
+
+    cache_models = (Customer, Order, Product)
+
+    period = graphene.Date()
+    product = graphene.Field(ProductType)
+    customer = graphene.Field(CustomerType)
+    order_count = graphene.Int()
+    units = graphene.Int()
+    revenue = graphene.Decimal()
 
 
 class Query(graphene.ObjectType):
@@ -337,27 +590,170 @@ class Query(graphene.ObjectType):
     #     """Resolver for the orders query."""
     #     return Order.objects.all()
 
-    all_customers = DjangoFilterConnectionField(CustomerType)
-    all_products = DjangoFilterConnectionField(ProductType)
-    all_orders = DjangoFilterConnectionField(OrderType)
+    all_customers = CRMConnectionField(CustomerType)
+    all_products = CRMConnectionField(ProductType)
+    all_orders = CRMConnectionField(OrderType)
+
+    crm_statistics = graphene.Field(
+        CRMStatisticsType,
+        order_date__gte=graphene.DateTime(),
+        order_date__lte=graphene.DateTime(),
+    )
+    product_revenue = graphene.List(
+        graphene.NonNull(ProductRevenueType),
+        order_date__gte=graphene.DateTime(),
+        order_date__lte=graphene.DateTime(),
+        limit=graphene.Int(default_value=10),
+    )
+    sales_timeseries = graphene.List(
+        graphene.NonNull(SalesPointType),
+        granularity=SalesGranularity(default_value=SalesGranularity.DAY),
+        from_=graphene.Date(required=True, name="from"),
+        to=graphene.Date(required=True),
+        group_by=SalesGroupBy(default_value=SalesGroupBy.TOTAL),
+    )
 
     def resolve_all_customers(self, info, orderby=None, **kwargs):
         """Resolver for the all_customers query."""
+        queryset = optimize_queryset(Customer.objects.all(), info)
         if orderby:
-            return Customer.objects.all().order_by(orderby)
-        return Customer.objects.all()
+            return queryset.order_by(orderby)
+        return queryset
 
     def resolve_all_products(self, info, orderby=None, **kwargs):
         """Resolver for the all_products query."""
+        queryset = optimize_queryset(Product.objects.all(), info)
         if orderby:
-            return Product.objects.all().order_by(orderby)
-        return Product.objects.all()
+            return queryset.order_by(orderby)
+        return queryset
 
     def resolve_all_orders(self, info, orderby=None, **kwargs):
-        """Resolver for the all_orders query."""
+        """
+        Resolver for the all_orders query.
+        It reads the hot orders table alone unless the orderDate range
+        reaches into archived orders.
+        """
+        queryset = optimize_queryset(
+            orders_for(kwargs.get("order_date__gte"), kwargs.get("order_date__lte")),
+            info,
+        )
         if orderby:
-            return Order.objects.all().order_by(orderby)
-        return Order.objects.all()
+            return queryset.order_by(orderby)
+        return queryset
+
+    def resolve_crm_statistics(self, info, order_date__gte=None, order_date__lte=None):
+        """
+        Resolver for the crm_statistics query, computed in one SQL statement
+        over the hot orders, plus the archive summaries when the range reaches
+        into archived orders.
+        """
+        in_range = Q()
+        if order_date__gte:
+            in_range &= Q(order_customer__order_date__gte=order_date__gte)
+        if order_date__lte:
+            in_range &= Q(order_customer__order_date__lte=order_date__lte)
+
+        # Orders are LEFT JOINed onto customers, so every order appears once
+        # and customers without orders still count.
+        stats = Customer.objects.aggregate(
+            customer_count=Count("id", distinct=True),
+            order_count=Count("order_customer", filter=in_range),
+            total_revenue=Sum("order_customer__total_amount", filter=in_range),
+        )
+        order_count = stats["order_count"]
+        total_revenue = Decimal(stats["total_revenue"] or 0)
+
+        if reaches_archive(order_date__gte, order_date__lte):
+            archived_count, archived_revenue = archive_statistics(
+                order_date__gte, order_date__lte
+            )
+            order_count += archived_count
+            total_revenue += archived_revenue
+
+        cents = Decimal("0.01")
+        average = total_revenue / order_count if order_count else Decimal(0)
+        return CRMStatisticsType(
+            customer_count=stats["customer_count"],
+            order_count=order_count,
+            total_revenue=total_revenue.quantize(cents),
+            average_order_value=average.quantize(cents),
+        )
+
+    def resolve_product_revenue(
+        self, info, order_date__gte=None, order_date__lte=None, limit=10
+    ):
+        """
+        Resolver for the product_revenue query, one grouped SQL statement.
+        limit is capped at RELAY_CONNECTION_MAX_LIMIT, like connection pages.
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1.")
+        limit = min(limit, graphene_settings.RELAY_CONNECTION_MAX_LIMIT or limit)
+
+        if reaches_archive(order_date__gte, order_date__lte):
+            lines = OrderLineHistory.objects.all()
+        else:
+            lines = OrderLine.objects.all()
+        if order_date__gte:
+            lines = lines.filter(order__order_date__gte=order_date__gte)
+        if order_date__lte:
+            lines = lines.filter(order__order_date__lte=order_date__lte)
+
+        rows = list(product_revenue(lines)[:limit])
+        products = Product.objects.in_bulk([row["product_id"] for row in rows])
+        return [
+            ProductRevenueType(
+                product=products.get(row["product_id"]),
+                units_sold=row["units_sold"],
+                order_count=row["order_count"],
+                revenue=Decimal(row["revenue"]).quantize(Decimal("0.01")),
+            )
+            for row in rows
+        ]
+
+    def resolve_sales_timeseries(
+        self,
+        info,
+        from_,
+        to,
+        granularity=SalesGranularity.DAY,
+        group_by=SalesGroupBy.TOTAL,
+    ):
+        """
+        Resolver for the sales_timeseries query, one grouped SQL statement over
+        the daily rollups whatever the number of orders in the range.
+        """
+        if from_ > to:
+            raise ValueError("from must not be after to.")
+
+        max_points = getattr(settings, "CRM_SALES_TIMESERIES_MAX_POINTS", 10000)
+        rows = list(
+            timeseries(from_, to, granularity.value, group_by.value)[: max_points + 1]
+        )
+        if len(rows) > max_points:
+            raise ValueError(
+                f"salesTimeseries returns at most {max_points} points; "
+                "narrow the range or use a coarser granularity."
+            )
+
+        products = {}
+        if group_by == SalesGroupBy.PRODUCT:
+            products = Product.objects.in_bulk([row["product_id"] for row in rows])
+        customers = {}
+        if group_by == SalesGroupBy.CUSTOMER:
+            customers = Customer.objects.in_bulk([row["customer_id"] for row in rows])
+
+        return [
+            SalesPointType(
+                period=row["period"],
+                product=products.get(row.get("product_id")),
+                customer=customers.get(row.get("customer_id")),
+                order_count=row["order_count"],
+                units=row["units"],
+                revenue=Decimal(row["revenue"]).quantize(Decimal("0.01")),
+            )
+            for row in rows
+        ]
 
 
 class Mutation(graphene.ObjectType):
@@ -368,6 +764,7 @@ class Mutation(graphene.ObjectType):
     create_customer = CreateCustomer.Field()
     bulk_create_customers = BulkCreateCustomers.Field()
     create_product = CreateProduct.Field()
+    update_low_stock = UpdateLowStockProducts.Field()
     create_order = CreateOrder.Field()
     delete_customer = DeleteCustomer.Field()
 
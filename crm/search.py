@@ -0,0 +1,192 @@
+"""crm/search.py
+This file contains the full-text search behind the ``search`` argument of the
+CRM connections.
+
+On SQLite, customer names and emails and product names are indexed in FTS5
+external-content tables. Triggers keep them in sync, so saves, bulk_create
+and queryset updates are all indexed. Every search term is matched as a word
+prefix and results are ranked with bm25. Other databases fall back to
+icontains.
+"""
+
+import re
+
+from django.db import connection, connections
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+
+from crm.models import Customer, Order, OrderHistory, Product
+
+# Indexed tables and their text columns.
+SEARCH_INDEXES = {
+    "crm_customer": ("name", "email"),
+    "crm_product": ("name",),
+}
+# Fields compared with icontains when FTS5 is not available.
+FALLBACK_FIELDS = {
+    Customer: ("name", "email"),
+    Product: ("name",),
+}
+# Orders, and the OrderHistory view of hot and archived orders.
+ORDER_MODELS = (Order, OrderHistory)
+TERM = re.compile(r"\w+")
+
+
+def fts_table(table):
+    """Return the name of the FTS5 table indexing ``table``."""
+    return f"{table}_fts"
+
+
+def install_statements(table, columns):
+    """Return the SQL creating the FTS5 table and triggers of ``table``."""
+    fts = fts_table(table)
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = (
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    )
+    insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{names}, content='{table}', content_rowid='id', prefix='2 3')",
+        f"DROP TRIGGER IF EXISTS {fts}_insert",
+        f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"DROP TRIGGER IF EXISTS {fts}_delete",
+        f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"DROP TRIGGER IF EXISTS {fts}_update",
+        f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def is_available(using=connection):
+    """Tell whether the database supports the FTS5 indexes."""
+    return using.vendor == "sqlite"
+
+
+def install(using=connection):
+    """
+    Create the FTS5 tables and triggers and rebuild the indexes.
+    SQLite drops triggers when a migration remakes a table, so this is safe to
+    run again at any time (``manage.py crm_rebuild_search``).
+    """
+    if not is_available(using):
+        return
+    with using.cursor() as cursor:
+        for table, columns in SEARCH_INDEXES.items():
+            for statement in install_statements(table, columns):
+                cursor.execute(statement)
+
+
+def uninstall(using=connection):
+    """Drop the FTS5 tables and their triggers."""
+    if not is_available(using):
+        return
+    with using.cursor() as cursor:
+        for table in SEARCH_INDEXES:
+            fts = fts_table(table)
+            for trigger in ("insert", "delete", "update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+def match_terms(value):
+    """
+    Return the FTS5 query of each term of a search string. Terms are quoted
+    so user input cannot inject FTS5 syntax, and each one is a prefix match.
+    """
+    return [f'"{term}"*' for term in TERM.findall(value or "")]
+
+
+def matches(table, expression):
+    """Return a subquery selecting the ids of ``table`` rows matching."""
+    fts = fts_table(table)
+    return RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", (expression,))
+
+
+def rank(table, expression, column):
+    """Return the bm25 rank of the ``table`` row whose id is in ``column``."""
+    fts = fts_table(table)
+    return (
+        f"(SELECT rank FROM {fts} WHERE {fts} MATCH %s AND rowid = {column})",
+        [expression],
+    )
+
+
+def fallback(queryset, value):
+    """Filter ``queryset`` with icontains, every term in any field."""
+    model = queryset.model
+    for term in TERM.findall(value or ""):
+        if model in ORDER_MODELS:
+            condition = (
+                Q(customer__name__icontains=term)
+                | Q(customer__email__icontains=term)
+                | Q(
+                    Exists(
+                        model.products.through.objects.filter(
+                            order_id=OuterRef("pk"), product__name__icontains=term
+                        )
+                    )
+                )
+            )
+        else:
+            condition = Q()
+            for field in FALLBACK_FIELDS[model]:
+                condition |= Q(**{f"{field}__icontains": term})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def search(queryset, value):
+    """
+    Filter a Customer, Product or order queryset by a search string and order
+    it by relevance. Orders match on their customer's name or email and on
+    their product names, and rank higher when both match.
+    Every term is matched as a word prefix.
+    """
+    terms = match_terms(value)
+    if not terms:
+        return queryset.none()
+    if not is_available(connections[queryset.db]):
+        return fallback(queryset, value)
+
+    model = queryset.model
+    table = model._meta.db_table
+    if model in ORDER_MODELS:
+        # Every term must match the customer or one of the products.
+        through = model.products.through
+        for term in terms:
+            product_orders = through.objects.filter(
+                product_id__in=matches("crm_product", term)
+            ).values("order_id")
+            queryset = queryset.filter(
+                Q(customer_id__in=matches("crm_customer", term))
+                | Q(pk__in=product_orders)
+            )
+        expression = " OR ".join(terms)
+        customer_sql, customer_params = rank(
+            "crm_customer", expression, f'"{table}"."customer_id"'
+        )
+        product_fts = fts_table("crm_product")
+        link_table = through._meta.db_table
+        product_sql = (
+            f"(SELECT MIN({product_fts}.rank) FROM {link_table} "
+            f"JOIN {product_fts} ON {product_fts}.rowid = {link_table}.product_id "
+            f'WHERE {link_table}.order_id = "{table}"."id" '
+            f"AND {product_fts} MATCH %s)"
+        )
+        search_rank = RawSQL(
+            f"IFNULL({customer_sql}, 0) + IFNULL({product_sql}, 0)",
+            customer_params + [expression],
+        )
+    else:
+        # "ali exa" finds "Alice <alice@example.com>".
+        expression = " ".join(terms)
+        queryset = queryset.filter(pk__in=matches(table, expression))
+        rank_sql, rank_params = rank(table, expression, f'"{table}"."id"')
+        search_rank = RawSQL(rank_sql, rank_params)
+
+    # bm25 ranks are negative, the best match first.
+    return queryset.annotate(search_rank=search_rank).order_by("search_rank", "pk")
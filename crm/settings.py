@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from celery.schedules import crontab
 
@@ -78,12 +79,84 @@ WSGI_APPLICATION = "alx-backend-graphql_crm.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite connection profiles, selected with the CRM_SQLITE_PROFILE environment
+# variable. "default" keeps SQLite's defaults and one connection per request.
+# "performance" switches to WAL so readers and the writer stop blocking each
+# other, fsyncs at checkpoints only, enlarges the page cache and memory map,
+# waits up to 5s for locks and keeps connections open between requests.
+CRM_SQLITE_PROFILES = {
+    "default": {"OPTIONS": {}, "CONN_MAX_AGE": 0},
+    "performance": {
+        "OPTIONS": {
+            "init_command": (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA mmap_size=268435456;"
+                "PRAGMA cache_size=-65536;"
+                "PRAGMA busy_timeout=5000;"
+                "PRAGMA temp_store=MEMORY"
+            ),
+        },
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+    },
+}
+CRM_SQLITE_PROFILE = os.environ.get("CRM_SQLITE_PROFILE", "default")
+# Start transaction.atomic() blocks, which only wrap the mutations, with
+# BEGIN IMMEDIATE: concurrent writers then queue on busy_timeout instead of
+# failing with "database is locked" when upgrading a read lock.
+CRM_SQLITE_IMMEDIATE = os.environ.get("CRM_SQLITE_IMMEDIATE") == "1"
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        **CRM_SQLITE_PROFILES[CRM_SQLITE_PROFILE],
     }
 }
+if CRM_SQLITE_IMMEDIATE:
+    DATABASES["default"]["OPTIONS"] = {
+        **DATABASES["default"]["OPTIONS"],
+        "transaction_mode": "IMMEDIATE",
+    }
+
+# Read replica for GraphQL query operations, enabled by pointing
+# CRM_REPLICA_NAME at its database file. The replica is kept in sync outside
+# Django; mutations and every other read use "default", as do the queries of
+# a client for CRM_REPLICA_STICKY_SECONDS after it mutated.
+if os.environ.get("CRM_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ["CRM_REPLICA_NAME"],
+        "TEST": {"MIRROR": "default"},
+    }
+CRM_DATABASE_REPLICA = "replica" if "replica" in DATABASES else None
+CRM_REPLICA_STICKY_SECONDS = int(os.environ.get("CRM_REPLICA_STICKY_SECONDS", 5))
+DATABASE_ROUTERS = ["crm.routers.PrimaryReplicaRouter"]
+
+# Orders older than CRM_ARCHIVE_AFTER_DAYS are moved to the archive tables
+# (manage.py crm_archive_orders or the crm.tasks.archive_old_orders task),
+# CRM_ARCHIVE_BATCH_SIZE orders per transaction.
+CRM_ARCHIVE_AFTER_DAYS = 365
+CRM_ARCHIVE_BATCH_SIZE = 1000
+
+# Most points salesTimeseries returns; larger ranges need a coarser granularity.
+CRM_SALES_TIMESERIES_MAX_POINTS = 10000
+
+# Rows the exports (export/<kind>/, manage.py crm_export) read per round trip.
+CRM_EXPORT_CHUNK_SIZE = 2000
+
+# Rows manage.py crm_import writes per transaction.
+CRM_IMPORT_BATCH_SIZE = 2000
+
+# Default totalCount strategy of the connections ("exact", "cached" or
+# "estimated", see crm.counting); cached counts expire after
+# CRM_COUNT_CACHE_TIMEOUT seconds if no write invalidates them first.
+CRM_COUNT_STRATEGY = "exact"
+CRM_COUNT_CACHE_TIMEOUT = 300
+
+# Threads (and database connections) the async GraphQL view runs resolvers in.
+CRM_ASYNC_THREADS = int(os.environ.get("CRM_ASYNC_THREADS", 8))
 
 
 # Password validation
@@ -130,6 +203,34 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # schema location for Graphene
 GRAPHENE = {"SCHEMA": "crm.schema.schema"}
 
+# GraphQL document caches (entries, per process)
+CRM_DOCUMENT_CACHE_SIZE = 256
+CRM_PERSISTED_QUERIES_SIZE = 1024
+
+# Most operations accepted in one batched (JSON array) POST to graphql/.
+CRM_GRAPHQL_MAX_BATCH_SIZE = 20
+
+# Cache-Control max-age (seconds) of successful GET query responses, by root
+# field; a query gets the smallest of its fields, and 0 makes clients
+# revalidate with the ETag every time (a 304 has no body).
+CRM_GRAPHQL_MAX_AGE = {"allProducts": 60, "salesTimeseries": 300}
+CRM_GRAPHQL_DEFAULT_MAX_AGE = 0
+
+# Response cache for GraphQL query operations (opt-in). Point the alias at a
+# shared backend such as django.core.cache.backends.redis.RedisCache when
+# running more than one process.
+CRM_RESPONSE_CACHE_ENABLED = False
+CRM_RESPONSE_CACHE_ALIAS = "default"
+CRM_RESPONSE_CACHE_TIMEOUT = 60
+
+# Static query cost limits, checked before execution. The cost is the
+# estimated number of rows, from connection first/last arguments.
+CRM_QUERY_MAX_DEPTH = 8
+CRM_QUERY_MAX_COST = 50000
+# Rows a client may request per window (None disables throttling).
+CRM_QUERY_COST_BUDGET = None
+CRM_QUERY_COST_WINDOW = 60
+
 # include cron jobs settings
 CRONJOBS = [
     ("0 */12 * * *", "crm.cron.update_low_stock"),
@@ -145,4 +246,16 @@ CELERY_BEAT_SCHEDULE = {
         "task": "crm.tasks.generate_crm_report",
         "schedule": crontab(day_of_week="mon", hour=6, minute=0),
     },
+    "rebuild-sales-rollups": {
+        "task": "crm.tasks.rebuild_sales_rollups",
+        "schedule": crontab(day_of_week="sun", hour=4, minute=0),
+    },
+    "archive-old-orders": {
+        "task": "crm.tasks.archive_old_orders",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "analyze-tables": {
+        "task": "crm.tasks.analyze_tables",
+        "schedule": crontab(hour=3, minute=30),
+    },
 }
@@ -4,8 +4,7 @@ This module defines a Celery task to generate a weekly CRM report
 that summarizes total orders, customers, and revenue, and logs it.
 """
 
-from crm.cron import write_to_log, date
-from crm.graphql import BASE_URL
+from crm.cron import BASE_URL, write_to_log, date
 
 from gql import gql, Client
 from gql.transport.requests import RequestsHTTPTransport
@@ -30,21 +29,12 @@ def generate_crm_report():
     client = Client(transport=_transport, fetch_schema_from_transport=True)
 
     query = gql(
-        """        
+        """
         query CRMDashboardStatistics {
-            # Get total number of customers
-            allCustomers {
-                totalCount
-            }
-            
-            # Get total number of orders
-            allOrders {
-                totalCount
-                edges {
-                node {
-                    totalAmount
-                }
-                }
+            crmStatistics {
+                customerCount
+                orderCount
+                totalRevenue
             }
         }
         """
@@ -55,9 +45,45 @@ def generate_crm_report():
     if not result:
         write_to_log(log_file, "Failed to generate CRM report.")
     else:
-        total_orders = result.get("totalOrders", 0)
-        total_customers = result.get("totalCustomers", 0)
-        total_revenue = result.get("totalRevenue", 0)
+        statistics = result.get("crmStatistics") or {}
+        total_orders = statistics.get("orderCount", 0)
+        total_customers = statistics.get("customerCount", 0)
+        total_revenue = statistics.get("totalRevenue", 0)
 
         message = f"{date} - Report: {total_customers} customers, {total_orders} orders, {total_revenue} revenue"
         write_to_log(log_file, message)
+
+
+@shared_task()
+def archive_old_orders():
+    """
+    Move the orders older than CRM_ARCHIVE_AFTER_DAYS to the archive tables
+    """
+    from crm.archive import archive_orders, get_horizon
+
+    return archive_orders(get_horizon())
+
+
+@shared_task()
+def rebuild_sales_rollups(days=None):
+    """
+    Recompute the daily sales rollups of the last ``days`` days, or of every
+    day when ``days`` is None
+    """
+    from crm.rollups import ONE_DAY, rebuild, utc_day
+    from django.utils import timezone
+
+    if days is None:
+        return rebuild()
+    today = utc_day(timezone.now())
+    return rebuild(today - days * ONE_DAY, today)
+
+
+@shared_task()
+def analyze_tables():
+    """
+    Refresh the planner statistics behind the estimated totalCount
+    """
+    from crm.counting import analyze
+
+    analyze()
@@ -1,3 +1,2400 @@
-from django.test import TestCase
+"""crm/tests.py
+This file contains the tests of the CRM application: the GraphQL API, its
+query planning and caching layers, and the maintenance commands.
+"""
 
-# Create your tests here.
+import datetime
+import gzip
+import json
+import math
+import os
+import tempfile
+from collections import defaultdict
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+import django_filters
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.utils import ConnectionHandler
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphene_django.utils.testing import GraphQLTestCase
+from graphql_relay import from_global_id, to_global_id
+
+from crm.aggregates import recompute
+from crm.archive import archive_orders, get_horizon
+from crm.counting import analyze
+from crm.documents import document_cache, persisted_queries, query_hash
+from crm.filters import semi_join
+from crm.importing import IMPORTS
+from crm.loaders import Loaders
+from crm.management.commands import crm_explain_filters
+from crm.models import (
+    ArchivedOrder,
+    Customer,
+    DailyCustomerSales,
+    DailyProductSales,
+    ImportCheckpoint,
+    Order,
+    OrderLine,
+    Product,
+)
+from crm.orders import OrderError, OutOfStock, create_order, place_order
+from crm.pagination import encode_cursor
+from crm.rollups import rebuild
+from crm.schema import BULK_CREATE_BATCH_SIZE
+from crm.validators import PHONE_ERROR
+
+
+def create_catalog(customers=3, products=4):
+    """Create customers and products, with enough stock for any test order."""
+    return (
+        Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com")
+            for i in range(customers)
+        ),
+        Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=Decimal(10 * (i + 1)), stock=1000)
+            for i in range(products)
+        ),
+    )
+
+
+class CRMTestCase(GraphQLTestCase):
+    """TestCase posting GraphQL operations to graphql/."""
+
+    GRAPHQL_URL = "/graphql/"
+
+    def execute(self, query, variables=None):
+        """Run an operation and return the decoded response body."""
+        response = self.query(query, variables=variables)
+        return response.json()
+
+
+class DataLoaderTests(CRMTestCase):
+    """
+    Relations of a connection page load with one query each, whatever the
+    page size, and the loaders report their batching in ``extensions``.
+    """
+
+    NESTED = """
+    query ($first: Int) {
+      allCustomers(first: $first) { edges { node {
+        name
+        orderCustomer(first: 10) { edges { node {
+          totalAmount
+          products(first: 5) { edges { node { name } } }
+        } } }
+      } } }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        customers, products = create_catalog(customers=6, products=4)
+        for customer in customers:
+            for i in range(2):
+                place_order(customer.pk, {products[i].pk: 1, products[i + 1].pk: 2})
+
+    def test_nested_page_query_count_is_constant(self):
+        for first in (2, 6):
+            with self.subTest(first=first), self.assertNumQueries(3):
+                result = self.execute(self.NESTED, {"first": first})
+            self.assertNotIn("errors", result)
+            customers = result["data"]["allCustomers"]["edges"]
+            self.assertEqual(len(customers), first)
+            for customer in customers:
+                orders = customer["node"]["orderCustomer"]["edges"]
+                self.assertEqual(len(orders), 2)
+                for order in orders:
+                    self.assertEqual(len(order["node"]["products"]["edges"]), 2)
+
+    def test_loaders_batch_the_relations_of_a_page(self):
+        orders = list(Order.objects.order_by("pk"))
+        loaders = Loaders()
+        loaders.queue_page(orders)
+        with self.assertNumQueries(2):
+            customers = [loaders.customer.load(order.customer_id) for order in orders]
+            products = [loaders.order_products.load(order.pk) for order in orders]
+
+        self.assertEqual(
+            [customer.pk for customer in customers],
+            [order.customer_id for order in orders],
+        )
+        self.assertEqual(
+            [[product.pk for product in items] for items in products],
+            [
+                list(
+                    order.products.order_by("order_products__id").values_list(
+                        "pk", flat=True
+                    )
+                )
+                for order in orders
+            ],
+        )
+        self.assertEqual(
+            loaders.stats(), {"batches": 2, "keysLoaded": 18, "queriesSaved": 16}
+        )
+
+    def test_stats_in_extensions(self):
+        # A filtered nested connection is not prefetched: the loader batches
+        # the orders of the whole page.
+        result = self.execute("""
+            { allCustomers(first: 6) { edges { node {
+                orderCustomer(first: 10, totalAmount_Gte: 0) {
+                  edges { node { totalAmount } }
+                }
+            } } } }
+            """)
+        self.assertNotIn("errors", result)
+        self.assertEqual(
+            result["extensions"]["dataloader"],
+            {"batches": 1, "keysLoaded": 6, "queriesSaved": 5},
+        )
+
+
+class KeysetPaginationTests(CRMTestCase):
+    """
+    Keyset pages walked forward and backward return every product once, in
+    the orderBy order with the id breaking ties.
+    """
+
+    PAGE = """
+    query ($orderBy: String, $first: Int, $last: Int, $after: String,
+           $before: String, $offset: Int) {
+      allProducts(keyset: true, orderBy: $orderBy, first: $first, last: $last,
+                  after: $after, before: $before, offset: $offset) {
+        edges { node { id name price } }
+        pageInfo { startCursor endCursor hasNextPage hasPreviousPage }
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Ties on both the price and the name.
+        Product.objects.bulk_create(
+            Product(name=f"Product {i % 4}", price=Decimal(5 * (i % 3)), stock=i)
+            for i in range(11)
+        )
+
+    def page(self, order_by, **args):
+        result = self.execute(self.PAGE, {"orderBy": order_by, **args})
+        self.assertNotIn("errors", result)
+        return result["data"]["allProducts"]
+
+    def expected(self, order_by):
+        descending = order_by.startswith("-")
+        return [
+            str(pk)
+            for pk in Product.objects.order_by(
+                order_by, "-pk" if descending else "pk"
+            ).values_list("pk", flat=True)
+        ]
+
+    @staticmethod
+    def ids(page):
+        return [from_global_id(edge["node"]["id"])[1] for edge in page["edges"]]
+
+    def test_forward(self):
+        for order_by in ("price", "-price", "name"):
+            with self.subTest(order_by=order_by):
+                ids = []
+                page = self.page(order_by, first=3)
+                self.assertFalse(page["pageInfo"]["hasPreviousPage"])
+                ids += self.ids(page)
+                while page["pageInfo"]["hasNextPage"]:
+                    page = self.page(
+                        order_by, first=3, after=page["pageInfo"]["endCursor"]
+                    )
+                    self.assertTrue(page["pageInfo"]["hasPreviousPage"])
+                    ids += self.ids(page)
+                self.assertEqual(ids, self.expected(order_by))
+
+    def test_backward(self):
+        for order_by in ("price", "-price", "name"):
+            with self.subTest(order_by=order_by):
+                page = self.page(order_by, last=3)
+                self.assertFalse(page["pageInfo"]["hasNextPage"])
+                ids = self.ids(page)
+                while page["pageInfo"]["hasPreviousPage"]:
+                    page = self.page(
+                        order_by, last=3, before=page["pageInfo"]["startCursor"]
+                    )
+                    self.assertTrue(page["pageInfo"]["hasNextPage"])
+                    ids = self.ids(page) + ids
+                self.assertEqual(ids, self.expected(order_by))
+
+    def test_pages_run_without_offset_or_count(self):
+        cursor = self.page("price", first=3)["pageInfo"]["endCursor"]
+        with CaptureQueriesContext(connection) as queries:
+            self.page("price", first=3, after=cursor)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("OFFSET", queries[0]["sql"])
+        self.assertNotIn("COUNT", queries[0]["sql"])
+
+    def test_argument_conflicts(self):
+        offset_cursor = self.execute(
+            "{ allProducts(first: 1) { pageInfo { endCursor } } }"
+        )["data"]["allProducts"]["pageInfo"]["endCursor"]
+        price_cursor = self.page("price", first=1)["pageInfo"]["endCursor"]
+        for args, message in (
+            ({"first": 3, "offset": 2}, "offset cannot be combined"),
+            ({"first": 3, "after": offset_cursor}, "Invalid keyset cursor"),
+            (
+                {"orderBy": "name", "first": 3, "after": price_cursor},
+                "different orderBy",
+            ),
+            ({"orderBy": "name,price", "first": 3}, "single orderBy field"),
+        ):
+            with self.subTest(args=args):
+                result = self.execute(self.PAGE, {"orderBy": "price", **args})
+                self.assertIsNone(result["data"]["allProducts"])
+                self.assertIn(message, result["errors"][0]["message"])
+
+
+@override_settings(CRM_RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(CRMTestCase):
+    """
+    Query results are served from the response cache until a write moves
+    one of the models they read to a new version; mutations bypass it.
+    """
+
+    PRODUCTS = "{ allProducts(first: 10) { edges { node { name stock } } } }"
+    CUSTOMERS = "{ allCustomers(first: 10) { edges { node { name orderCount } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers, cls.products = create_catalog()
+        Product.objects.filter(pk=cls.products[0].pk).update(stock=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCached(self, query, hit):
+        result = self.execute(query)
+        self.assertNotIn("errors", result)
+        self.assertEqual(result["extensions"]["responseCache"], {"hit": hit})
+        return result["data"]
+
+    def test_hit(self):
+        data = self.assertCached(self.PRODUCTS, hit=False)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.assertCached(self.PRODUCTS, hit=True), data)
+
+    def create_order(self):
+        result = self.execute(
+            """
+            mutation ($customer: ID!, $product: ID!) {
+              createOrder(input: {customerId: $customer, productIds: [$product]}) {
+                totalAmount
+              }
+            }
+            """,
+            {"customer": self.customers[0].pk, "product": self.products[1].pk},
+        )
+        self.assertNotIn("errors", result)
+        return result
+
+    def test_create_order_invalidates(self):
+        self.assertCached(self.CUSTOMERS, hit=False)
+        self.assertCached(self.PRODUCTS, hit=False)
+        self.create_order()
+
+        customers = self.assertCached(self.CUSTOMERS, hit=False)
+        self.assertEqual(customers["allCustomers"]["edges"][0]["node"]["orderCount"], 1)
+        products = self.assertCached(self.PRODUCTS, hit=False)
+        self.assertEqual(products["allProducts"]["edges"][1]["node"]["stock"], 999)
+
+    def test_bulk_create_customers_invalidates(self):
+        self.assertCached(self.CUSTOMERS, hit=False)
+        result = self.execute("""
+            mutation {
+              bulkCreateCustomers(input: [{name: "New", email: "new@example.com"}]) {
+                customers { name }
+              }
+            }
+            """)
+        self.assertNotIn("errors", result)
+        data = self.assertCached(self.CUSTOMERS, hit=False)
+        self.assertEqual(len(data["allCustomers"]["edges"]), 4)
+
+    def test_update_low_stock_products_invalidates(self):
+        self.assertCached(self.PRODUCTS, hit=False)
+        result = self.execute("mutation { updateLowStock { products { name } } }")
+        self.assertNotIn("errors", result)
+        data = self.assertCached(self.PRODUCTS, hit=False)
+        self.assertEqual(data["allProducts"]["edges"][0]["node"]["stock"], 12)
+
+    def test_mutations_bypass_the_cache(self):
+        for _ in range(2):
+            self.assertNotIn("responseCache", self.create_order()["extensions"])
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class BulkCreateCustomersTests(CRMTestCase):
+    """
+    bulkCreateCustomers creates the valid rows and reports the others by
+    index, with one lookup query and one INSERT per chunk of rows.
+    """
+
+    BULK = """
+    mutation ($input: [CustomerInput]!) {
+      bulkCreateCustomers(input: $input) {
+        customers { name email phone }
+        rowErrors { index message }
+        errors
+      }
+    }
+    """
+
+    def bulk_create(self, rows):
+        result = self.execute(self.BULK, {"input": rows})
+        self.assertNotIn("errors", result)
+        return result["data"]["bulkCreateCustomers"]
+
+    def test_row_errors_alongside_created_rows(self):
+        Customer.objects.create(name="Taken", email="taken@example.com")
+        result = self.bulk_create(
+            [
+                {"name": "Alice", "email": "alice@example.com", "phone": "+1234567890"},
+                {"name": "Taken", "email": "other@example.com"},
+                {"name": "Bob", "email": "taken@example.com"},
+                {"name": "Alice", "email": "alice2@example.com"},
+                {"name": "Carol", "email": "alice@example.com"},
+                {"name": "Dave", "email": "dave@example.com", "phone": "12345"},
+                {"name": "Erin", "email": "erin@example.com", "phone": "123-456-7890"},
+            ]
+        )
+        self.assertEqual(
+            result["customers"],
+            [
+                {"name": "Alice", "email": "alice@example.com", "phone": "+1234567890"},
+                {"name": "Erin", "email": "erin@example.com", "phone": "123-456-7890"},
+            ],
+        )
+        self.assertEqual(
+            result["rowErrors"],
+            [
+                {"index": 1, "message": "Customer with name Taken already exists."},
+                {
+                    "index": 2,
+                    "message": "Customer with email taken@example.com already exists.",
+                },
+                {"index": 3, "message": "Duplicate name Alice in the batch."},
+                {
+                    "index": 4,
+                    "message": "Duplicate email alice@example.com in the batch.",
+                },
+                {"index": 5, "message": PHONE_ERROR},
+            ],
+        )
+        self.assertEqual(
+            result["errors"][0], "Row 1: Customer with name Taken already exists."
+        )
+        self.assertEqual(
+            sorted(Customer.objects.values_list("name", flat=True)),
+            ["Alice", "Erin", "Taken"],
+        )
+
+    def test_query_count(self):
+        # Rows per INSERT, as bounded by the database's query parameters.
+        fields = [f for f in Customer._meta.concrete_fields if not f.primary_key]
+        per_insert = min(
+            BULK_CREATE_BATCH_SIZE, connection.ops.bulk_batch_size(fields, [])
+        )
+        for size in (3, 400):
+            rows = [
+                {"name": f"Customer {size}-{i}", "email": f"c{size}-{i}@example.com"}
+                for i in range(size)
+            ]
+            with self.subTest(size=size), CaptureQueriesContext(connection) as queries:
+                result = self.bulk_create(rows)
+            self.assertEqual(len(result["customers"]), size)
+            self.assertEqual(result["rowErrors"], [])
+            statements = [query["sql"].split()[0] for query in queries]
+            self.assertEqual(
+                [statement for statement in statements if statement != "INSERT"],
+                ["SELECT", "SAVEPOINT", "RELEASE"],
+            )
+            self.assertEqual(statements.count("INSERT"), math.ceil(size / per_insert))
+
+
+class UpdateLowStockTests(CRMTestCase):
+    """
+    updateLowStock restocks the products under the threshold, optionally
+    narrowed to some ids (raw or global) or a name, and nothing else.
+    """
+
+    UPDATE = """
+    mutation ($threshold: Int, $increment: Int, $productIds: [ID], $name: String) {
+      updateLowStock(threshold: $threshold, increment: $increment,
+                     productIds: $productIds, name: $name) {
+        success message products { name stock }
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=name, price=Decimal(1), stock=stock)
+            for name, stock in (
+                ("Apple", 0),
+                ("Apricot", 5),
+                ("Banana", 9),
+                ("Cherry", 10),
+                ("Date", 50),
+            )
+        )
+
+    def update(self, **variables):
+        result = self.execute(self.UPDATE, variables)
+        self.assertNotIn("errors", result)
+        return result["data"]["updateLowStock"]
+
+    def stock(self):
+        return dict(Product.objects.values_list("name", "stock"))
+
+    def test_defaults(self):
+        result = self.update()
+        self.assertTrue(result["success"])
+        self.assertEqual(
+            result["products"],
+            [
+                {"name": "Apple", "stock": 10},
+                {"name": "Apricot", "stock": 15},
+                {"name": "Banana", "stock": 19},
+            ],
+        )
+        self.assertEqual(
+            self.stock(),
+            {"Apple": 10, "Apricot": 15, "Banana": 19, "Cherry": 10, "Date": 50},
+        )
+
+    def test_threshold_and_increment(self):
+        result = self.update(threshold=6, increment=3)
+        self.assertEqual(
+            result["message"], "2 low stock products updated successfully."
+        )
+        self.assertEqual(
+            self.stock(),
+            {"Apple": 3, "Apricot": 8, "Banana": 9, "Cherry": 10, "Date": 50},
+        )
+
+    def test_product_ids(self):
+        apple, apricot, banana, _, date = self.products
+        # Raw and global ids both work; rows above the threshold are left.
+        self.update(
+            productIds=[
+                str(apple.pk),
+                to_global_id("ProductType", banana.pk),
+                str(date.pk),
+            ]
+        )
+        self.assertEqual(
+            self.stock(),
+            {"Apple": 10, "Apricot": 5, "Banana": 19, "Cherry": 10, "Date": 50},
+        )
+
+    def test_name(self):
+        self.update(name="ap")
+        self.assertEqual(
+            self.stock(),
+            {"Apple": 10, "Apricot": 15, "Banana": 9, "Cherry": 10, "Date": 50},
+        )
+
+    def test_invalid_arguments(self):
+        for variables, message in (
+            ({"increment": 0}, "Increment must be positive."),
+            ({"threshold": -1}, "Threshold cannot be negative."),
+            (
+                {"productIds": [to_global_id("CustomerType", 1)]},
+                "Invalid ProductType ID",
+            ),
+        ):
+            with self.subTest(variables=variables):
+                result = self.update(**variables)
+                self.assertFalse(result["success"])
+                self.assertIn(message, result["message"])
+        self.assertEqual(
+            self.stock(),
+            {"Apple": 0, "Apricot": 5, "Banana": 9, "Cherry": 10, "Date": 50},
+        )
+
+
+class PlaceOrderTests(CRMTestCase):
+    """
+    Orders decrement the stock with one conditional UPDATE; an order that
+    would oversell or names a missing product writes nothing.
+    """
+
+    CREATE_ORDER = """
+    mutation ($customer: ID!, $products: [ID]!, $quantities: [Int!]) {
+      createOrder(input: {customerId: $customer, productIds: $products,
+                          quantities: $quantities}) {
+        order { id } totalAmount
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        (cls.customer,), cls.products = create_catalog(customers=1, products=2)
+        Product.objects.filter(pk=cls.products[0].pk).update(stock=5)
+
+    def assertNothingWritten(self):
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("stock", flat=True)),
+            [5, 1000],
+        )
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderLine.objects.exists())
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.order_count, 0)
+        self.assertEqual(self.customer.lifetime_value, 0)
+
+    def test_order(self):
+        scarce, plenty = self.products
+        # The customer, the savepoint pair and the statements of crm.orders.
+        with self.assertNumQueries(12):
+            order = place_order(self.customer.pk, {scarce.pk: 5, plenty.pk: 2})
+        self.assertEqual(order.total_amount, Decimal("90.00"))
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("stock", flat=True)),
+            [0, 998],
+        )
+        self.assertEqual(
+            list(order.lines.order_by("product_id").values_list("quantity", flat=True)),
+            [5, 2],
+        )
+
+    def test_oversell(self):
+        scarce, plenty = self.products
+        with self.assertRaises(OutOfStock):
+            create_order(
+                self.customer,
+                Product.objects.filter(pk__in=[scarce.pk, plenty.pk]),
+                {scarce.pk: 6, plenty.pk: 1},
+            )
+        self.assertNothingWritten()
+
+        with self.assertRaisesMessage(
+            OrderError, f"Insufficient stock for products with IDs [{scarce.pk}]."
+        ):
+            place_order(self.customer.pk, {scarce.pk: 6, plenty.pk: 1})
+        self.assertNothingWritten()
+
+    def test_missing_product(self):
+        missing = self.products[1].pk + 1
+        with self.assertRaisesMessage(
+            OrderError, f"Products with IDs [{missing}] do not exist."
+        ):
+            place_order(self.customer.pk, {self.products[0].pk: 1, missing: 1})
+        self.assertNothingWritten()
+
+    def test_quantities(self):
+        scarce, plenty = self.products
+        result = self.execute(
+            self.CREATE_ORDER,
+            {
+                "customer": self.customer.pk,
+                "products": [plenty.pk, scarce.pk, plenty.pk],
+                "quantities": [2, 1, 3],
+            },
+        )
+        self.assertEqual(result["data"]["createOrder"]["totalAmount"], "110.00")
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("stock", flat=True)),
+            [4, 995],
+        )
+
+    def test_invalid_quantities(self):
+        scarce, plenty = self.products
+        for products, quantities, message in (
+            ([scarce.pk], [0], "Quantities must be at least 1."),
+            # A repeated product cannot hide a bad quantity in its sum.
+            ([plenty.pk, plenty.pk], [2, -1], "Quantities must be at least 1."),
+            ([scarce.pk, plenty.pk], [1], "one entry per product ID."),
+        ):
+            with self.subTest(quantities=quantities):
+                result = self.execute(
+                    self.CREATE_ORDER,
+                    {
+                        "customer": self.customer.pk,
+                        "products": products,
+                        "quantities": quantities,
+                    },
+                )
+                self.assertIn(message, result["errors"][0]["message"])
+
+        result = self.execute(
+            "mutation ($customer: ID!, $product: ID!) { createOrder(input: {"
+            "customerId: $customer, productIds: [$product], quantities: [null]})"
+            " { totalAmount } }",
+            {"customer": self.customer.pk, "product": scarce.pk},
+        )
+        self.assertIn(
+            "Expected value of type 'Int!', found null.",
+            result["errors"][0]["message"],
+        )
+        self.assertNothingWritten()
+
+    def test_errors_through_the_mutation(self):
+        scarce, plenty = self.products
+        for products, quantities, message in (
+            ([scarce.pk], [6], "Insufficient stock"),
+            ([plenty.pk, plenty.pk + 1], None, "do not exist"),
+        ):
+            with self.subTest(message=message):
+                result = self.execute(
+                    self.CREATE_ORDER,
+                    {
+                        "customer": self.customer.pk,
+                        "products": products,
+                        "quantities": quantities,
+                    },
+                )
+                self.assertIsNone(result["data"]["createOrder"])
+                self.assertIn(message, result["errors"][0]["message"])
+        self.assertNothingWritten()
+
+
+class QueryCostTests(CRMTestCase):
+    """
+    Connections cost their page size and plain lists their limit or known
+    maximum, multiplied through the nesting.
+    """
+
+    def cost(self, query):
+        result = self.execute(query)
+        self.assertNotIn("errors", result)
+        return result["extensions"]["cost"]["rows"]
+
+    def test_connections(self):
+        self.assertEqual(
+            self.cost("{ allProducts(first: 5) { edges { node { name } } } }"), 5
+        )
+        self.assertEqual(
+            self.cost(
+                "{ allCustomers(first: 5) { edges { node {"
+                " orderCustomer(first: 3) { edges { node { id } } } } } } }"
+            ),
+            5 + 5 * 3,
+        )
+
+    def test_lists(self):
+        self.assertEqual(
+            self.cost("{ productRevenue { revenue product { name } } }"), 10 + 10
+        )
+        self.assertEqual(self.cost("{ productRevenue(limit: 40) { revenue } }"), 40)
+        # The limit is clamped like a page size.
+        self.assertEqual(self.cost("{ productRevenue(limit: 1000) { revenue } }"), 100)
+        with self.settings(CRM_SALES_TIMESERIES_MAX_POINTS=500):
+            self.assertEqual(
+                self.cost(
+                    '{ salesTimeseries(from: "2024-01-01", to: "2024-01-31")'
+                    " { revenue } }"
+                ),
+                500,
+            )
+        self.assertEqual(
+            self.cost(
+                "{ allOrders(first: 2) { edges { node { lines { quantity } } } } }"
+            ),
+            2 + 2 * 100,
+        )
+
+    @override_settings(CRM_QUERY_MAX_COST=50000)
+    def test_negative_page_cannot_lower_the_cost(self):
+        nested = (
+            "allCustomers(first: 100) { edges { node {"
+            " orderCustomer(first: 100) { edges { node {"
+            " products(first: 100) { edges { node { name } } } } } } } } }"
+        )
+        for query in (
+            f"{{ {nested} }}",
+            f"{{ a: allProducts(first: -1000000) {{ edges {{ node {{ name }} }} }}"
+            f" {nested} }}",
+            f"{{ a: allProducts(last: -1000000) {{ edges {{ node {{ name }} }} }}"
+            f" {nested} }}",
+        ):
+            with self.subTest(query=query):
+                result = self.execute(query)
+                self.assertNotIn("data", result)
+                self.assertEqual(
+                    result["errors"][0]["message"],
+                    "Query cost 1010100 exceeds the maximum cost of 50000.",
+                )
+
+
+class UnindexedCustomerFilter(django_filters.FilterSet):
+    """A filterset on a column without an index, for the EXPLAIN check."""
+
+    updated_at__gte = django_filters.DateTimeFilter(
+        field_name="updated_at", lookup_expr="gte"
+    )
+
+    class Meta:
+        model = Customer
+        fields = []
+
+
+class ExplainFiltersTests(TestCase):
+    """crm_explain_filters passes on the CRM filtersets and fails on a scan."""
+
+    def test_every_filter_uses_an_index(self):
+        out = StringIO()
+        call_command("crm_explain_filters", stdout=out)
+        self.assertIn("Every filter argument uses an index.", out.getvalue())
+
+    def test_full_table_scan_fails(self):
+        out = StringIO()
+        with mock.patch.object(
+            crm_explain_filters, "FILTERSETS", (UnindexedCustomerFilter,)
+        ), self.assertRaisesMessage(
+            CommandError, "Arguments without an index: Customer.updated_at__gte"
+        ):
+            call_command("crm_explain_filters", stdout=out)
+        self.assertIn("full scan of crm_customer", out.getvalue())
+
+
+class SearchTests(CRMTestCase):
+    """
+    The search argument matches word prefixes, ranks the best matches first,
+    and sees every write through the FTS5 triggers.
+    """
+
+    SEARCH = """
+    query ($search: String) {
+      allCustomers(search: $search, first: 10) { edges { node { name } } }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Customer.objects.bulk_create(
+            [
+                Customer(name="Bob Alison", email="bob@example.com"),
+                Customer(name="Alice Smith", email="alice@example.com"),
+                Customer(name="Carol Jones", email="carol@example.org"),
+            ]
+        )
+
+    def names(self, search):
+        result = self.execute(self.SEARCH, {"search": search})
+        self.assertNotIn("errors", result)
+        return [
+            edge["node"]["name"] for edge in result["data"]["allCustomers"]["edges"]
+        ]
+
+    def test_prefix(self):
+        self.assertEqual(self.names("car"), ["Carol Jones"])
+        self.assertEqual(self.names("jon car"), ["Carol Jones"])
+        self.assertEqual(self.names("org"), ["Carol Jones"])
+        self.assertEqual(self.names("arol"), [])
+        self.assertEqual(self.names("***"), [])
+
+    def test_ranking(self):
+        # Alice matches in her name and her email, Bob in his name only.
+        self.assertEqual(self.names("ali"), ["Alice Smith", "Bob Alison"])
+
+    def test_triggers_keep_the_index_in_sync(self):
+        Customer.objects.create(name="Dave Alder", email="dave@example.com")
+        Customer.objects.bulk_create(
+            [Customer(name="Erin Alvarez", email="erin@example.com")]
+        )
+        self.assertEqual(
+            self.names("al"),
+            ["Alice Smith", "Bob Alison", "Dave Alder", "Erin Alvarez"],
+        )
+
+        Customer.objects.filter(name="Bob Alison").update(name="Bob Brown")
+        Customer.objects.filter(name="Dave Alder").delete()
+        self.assertEqual(self.names("al"), ["Alice Smith", "Erin Alvarez"])
+        self.assertEqual(self.names("brown"), ["Bob Brown"])
+
+        product = Product.objects.create(name="Blue Widget", price=1)
+        result = self.execute(
+            '{ allProducts(search: "wid") { edges { node { name } } } }'
+        )
+        self.assertEqual(
+            result["data"]["allProducts"]["edges"], [{"node": {"name": "Blue Widget"}}]
+        )
+        product.name = "Red Gadget"
+        product.save()
+        result = self.execute(
+            '{ allProducts(search: "wid") { edges { node { name } } } }'
+        )
+        self.assertEqual(result["data"]["allProducts"]["edges"], [])
+
+
+class CustomerAggregatesTests(CRMTestCase):
+    """
+    The order aggregates of customers follow orders being placed, deleted
+    and archived, and always equal what ``recompute`` derives from scratch.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers, cls.products = create_catalog(customers=2, products=2)
+
+    def aggregates(self):
+        return {
+            pk: values
+            for pk, *values in Customer.objects.values_list(
+                "pk",
+                "order_count",
+                "lifetime_value",
+                "first_order_date",
+                "last_order_date",
+            )
+        }
+
+    def assertRecomputed(self):
+        """Check the maintained aggregates against a full recompute."""
+        maintained = self.aggregates()
+        recompute()
+        self.assertEqual(maintained, self.aggregates())
+        return maintained
+
+    def test_place_delete_and_archive(self):
+        alice, bob = self.customers
+        first, second = self.products
+        orders = [
+            place_order(alice.pk, {first.pk: 1}),
+            place_order(alice.pk, {first.pk: 1, second.pk: 2}),
+            place_order(bob.pk, {second.pk: 1}),
+        ]
+        aggregates = self.assertRecomputed()
+        self.assertEqual(aggregates[alice.pk][:2], [2, Decimal("60.00")])
+        self.assertEqual(
+            aggregates[alice.pk][2:], [orders[0].order_date, orders[1].order_date]
+        )
+        self.assertEqual(aggregates[bob.pk][:2], [1, Decimal("20.00")])
+
+        orders[1].delete()
+        aggregates = self.assertRecomputed()
+        self.assertEqual(
+            aggregates[alice.pk],
+            [1, Decimal("10.00"), orders[0].order_date, orders[0].order_date],
+        )
+
+        # Archived orders still count for their customer.
+        Order.objects.filter(pk=orders[0].pk).update(
+            order_date=orders[0].order_date - datetime.timedelta(days=400)
+        )
+        recompute()
+        before = self.aggregates()
+        self.assertEqual(archive_orders(get_horizon()), 1)
+        self.assertFalse(Order.objects.filter(pk=orders[0].pk).exists())
+        self.assertEqual(self.assertRecomputed(), before)
+        self.assertEqual(before[alice.pk][:2], [1, Decimal("10.00")])
+
+        orders[2].delete()
+        self.assertEqual(
+            self.assertRecomputed()[bob.pk], [0, Decimal("0.00"), None, None]
+        )
+
+    def test_bulk_recompute(self):
+        alice, _ = self.customers
+        place_order(alice.pk, {self.products[0].pk: 3})
+        Customer.objects.update(order_count=0, lifetime_value=0)
+        self.assertEqual(recompute(Customer.objects.filter(pk=alice.pk)), 1)
+        self.assertEqual(self.aggregates()[alice.pk][:2], [1, Decimal("30.00")])
+
+
+class OrderProductFilterTests(CRMTestCase):
+    """
+    productName and productId return each matching order once, the orders
+    the former joins returned after removing their duplicates.
+    """
+
+    ORDERS = """
+    query ($productName: String, $productId: Decimal) {
+      allOrders(productName: $productName, productId: $productId, first: 50) {
+        totalCount
+        edges { node { id } }
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        customers, _ = create_catalog(customers=2, products=0)
+        products = Product.objects.bulk_create(
+            Product(name=name, price=Decimal(1), stock=100)
+            for name in ("Widget A", "Widget B", "Gadget")
+        )
+        widget_a, widget_b, gadget = products
+        cls.products = products
+        for customer in customers:
+            place_order(customer.pk, {widget_a.pk: 1, widget_b.pk: 1, gadget.pk: 1})
+            place_order(customer.pk, {widget_b.pk: 2})
+            place_order(customer.pk, {gadget.pk: 1})
+
+    def order_ids(self, **variables):
+        result = self.execute(self.ORDERS, variables)
+        self.assertNotIn("errors", result)
+        connection_ = result["data"]["allOrders"]
+        ids = [
+            int(from_global_id(edge["node"]["id"])[1]) for edge in connection_["edges"]
+        ]
+        self.assertEqual(connection_["totalCount"], len(ids))
+        return ids
+
+    def test_product_name(self):
+        joined = Order.objects.filter(products__name__icontains="widget")
+        self.assertGreater(joined.count(), joined.distinct().count())
+        for value in ("widget", "gadget", "b", "none"):
+            with self.subTest(value=value):
+                ids = self.order_ids(productName=value)
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(
+                    sorted(ids),
+                    sorted(
+                        Order.objects.filter(products__name__icontains=value)
+                        .distinct()
+                        .values_list("pk", flat=True)
+                    ),
+                )
+
+    def test_product_id(self):
+        for product in self.products:
+            with self.subTest(product=product.name):
+                ids = self.order_ids(productId=product.pk)
+                self.assertEqual(
+                    sorted(ids),
+                    sorted(
+                        Order.objects.filter(products=product)
+                        .distinct()
+                        .values_list("pk", flat=True)
+                    ),
+                )
+
+    def test_semi_join_relations(self):
+        widget_a = self.products[0]
+        for queryset, relation, lookups, joined in (
+            # Reverse many-to-many, through the link table.
+            (
+                Product.objects.all(),
+                "order_products",
+                {"total_amount__gte": 3},
+                Product.objects.filter(order_products__total_amount__gte=3),
+            ),
+            # Reverse foreign key, by key and by value.
+            (
+                Customer.objects.all(),
+                "order_customer",
+                {"pk__in": [1, 2]},
+                Customer.objects.filter(order_customer__pk__in=[1, 2]),
+            ),
+            (
+                Customer.objects.all(),
+                "order_customer",
+                {"total_amount__lt": 2},
+                Customer.objects.filter(order_customer__total_amount__lt=2),
+            ),
+            (
+                Order.objects.all(),
+                "products",
+                {"pk": widget_a.pk},
+                Order.objects.filter(products__pk=widget_a.pk),
+            ),
+        ):
+            with self.subTest(relation=relation, lookups=lookups):
+                rows = list(semi_join(queryset, relation, **lookups))
+                self.assertEqual(len(rows), len(set(rows)))
+                self.assertEqual(set(rows), set(joined))
+
+
+class SQLiteProfileTests(TestCase):
+    """The SQLite profiles configure every new connection."""
+
+    def connect(self, name, **profile):
+        handler = ConnectionHandler(
+            {
+                "default": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": name,
+                    **profile,
+                }
+            }
+        )
+        return handler["default"]
+
+    def pragmas(self, wrapper):
+        values = {}
+        with wrapper.cursor() as cursor:
+            for pragma in (
+                "journal_mode",
+                "synchronous",
+                "mmap_size",
+                "cache_size",
+                "busy_timeout",
+                "temp_store",
+            ):
+                cursor.execute(f"PRAGMA {pragma}")
+                values[pragma] = cursor.fetchone()[0]
+        return values
+
+    def test_performance_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.connect(
+                os.path.join(directory, "crm.sqlite3"),
+                **settings.CRM_SQLITE_PROFILES["performance"],
+            )
+            self.assertEqual(
+                self.pragmas(wrapper),
+                {
+                    "journal_mode": "wal",
+                    "synchronous": 1,
+                    "mmap_size": 268435456,
+                    "cache_size": -65536,
+                    "busy_timeout": 5000,
+                    "temp_store": 2,
+                },
+            )
+            self.assertEqual(wrapper.settings_dict["CONN_MAX_AGE"], 600)
+            wrapper.close()
+
+    def test_default_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.connect(
+                os.path.join(directory, "crm.sqlite3"),
+                **settings.CRM_SQLITE_PROFILES["default"],
+            )
+            self.assertEqual(self.pragmas(wrapper)["journal_mode"], "delete")
+            wrapper.close()
+
+
+@override_settings(CRM_DATABASE_REPLICA="replica", CRM_REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingTests(CRMTestCase):
+    """
+    Queries read the replica, a client that mutated reads the primary for the
+    sticky window, and the other clients keep reading the replica.
+    """
+
+    PRODUCTS = "{ allProducts(first: 10) { edges { node { name } } } }"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A second SQLite database stands for the replica. It is added after
+        # the test databases are set up, as the test runner only sets up
+        # those of the settings, and only ever holds this product: the
+        # router sends every write to the primary.
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings["replica"] = connections.configure_settings(
+            {
+                "default": {},
+                "replica": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": os.path.join(cls.directory.name, "replica.sqlite3"),
+                },
+            }
+        )["replica"]
+        cls.databases = cls.databases | {"replica"}
+        call_command("migrate", database="replica", verbosity=0)
+        Product.objects.using("replica").create(name="On the replica", price=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        cls.databases = cls.databases - {"replica"}
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(name="On the primary", price=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def read(self, client):
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": self.PRODUCTS}),
+            content_type="application/json",
+            REMOTE_ADDR=client,
+        )
+        result = response.json()
+        self.assertNotIn("errors", result)
+        names = [
+            edge["node"]["name"] for edge in result["data"]["allProducts"]["edges"]
+        ]
+        return result["extensions"]["database"], names
+
+    def test_queries_read_the_replica(self):
+        self.assertEqual(self.read("10.0.0.1"), ("replica", ["On the replica"]))
+
+    def test_client_sticks_to_the_primary_after_a_mutation(self):
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": CREATE_PRODUCT}),
+            content_type="application/json",
+            REMOTE_ADDR="10.0.0.1",
+        )
+        self.assertEqual(response.json()["extensions"]["database"], "default")
+        self.assertEqual(Product.objects.using("replica").count(), 1)
+
+        self.assertEqual(self.read("10.0.0.1"), ("default", ["On the primary", "New"]))
+        self.assertEqual(self.read("10.0.0.2"), ("replica", ["On the replica"]))
+
+        cache.clear()
+        self.assertEqual(self.read("10.0.0.1"), ("replica", ["On the replica"]))
+
+
+class ArchiveReadTests(CRMTestCase):
+    """
+    allOrders and the orders export read the hot table alone, without
+    probing the archive, unless their orderDate range reaches archived
+    orders from either bound.
+    """
+
+    ORDERS = """
+    query ($from: DateTime, $to: DateTime) {
+      allOrders(orderDate_Gte: $from, orderDate_Lte: $to, first: 10) {
+        edges { node { id } }
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        (customer,), (product,) = create_catalog(customers=1, products=1)
+        cls.archived = place_order(customer.pk, {product.pk: 1})
+        cls.hot = place_order(customer.pk, {product.pk: 1})
+        cls.archived_date = timezone.now() - datetime.timedelta(days=400)
+        Order.objects.filter(pk=cls.archived.pk).update(order_date=cls.archived_date)
+        archive_orders(get_horizon())
+
+    def order_ids(self, start=None, end=None):
+        variables = {"from": start and start.isoformat(), "to": end and end.isoformat()}
+        with CaptureQueriesContext(connection) as queries:
+            result = self.execute(self.ORDERS, variables)
+        self.assertNotIn("errors", result)
+        ids = [
+            int(from_global_id(edge["node"]["id"])[1])
+            for edge in result["data"]["allOrders"]["edges"]
+        ]
+        return sorted(ids), [query["sql"] for query in queries]
+
+    def test_unranged_reads_stay_on_the_hot_table(self):
+        ids, queries = self.order_ids()
+        self.assertEqual(ids, [self.hot.pk])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("archive", queries[0])
+        self.assertNotIn("history", queries[0])
+
+    def test_range_reaching_the_archive(self):
+        ids, queries = self.order_ids(self.archived_date - datetime.timedelta(days=1))
+        self.assertEqual(ids, [self.archived.pk, self.hot.pk])
+        self.assertIn("crm_order_history", queries[-1])
+
+    def test_range_after_the_archive(self):
+        ids, queries = self.order_ids(timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(ids, [self.hot.pk])
+        self.assertNotIn("crm_order_history", queries[-1])
+
+    def test_upper_bound_reaching_the_archive(self):
+        ids, queries = self.order_ids(
+            end=self.archived_date + datetime.timedelta(days=1)
+        )
+        self.assertEqual(ids, [self.archived.pk])
+        self.assertIn("crm_order_history", queries[-1])
+
+        ids, _ = self.order_ids(end=timezone.now())
+        self.assertEqual(ids, [self.archived.pk, self.hot.pk])
+
+    def test_upper_bound_before_the_archive(self):
+        ids, queries = self.order_ids(
+            end=self.archived_date - datetime.timedelta(days=1)
+        )
+        self.assertEqual(ids, [])
+        self.assertNotIn("crm_order_history", queries[-1])
+
+    def test_range_ending_before_the_horizon(self):
+        ids, queries = self.order_ids(
+            self.archived_date - datetime.timedelta(days=1),
+            self.archived_date + datetime.timedelta(days=1),
+        )
+        self.assertEqual(ids, [self.archived.pk])
+        self.assertIn("crm_order_history", queries[-1])
+
+    def test_statistics_and_export_agree(self):
+        end = (self.archived_date + datetime.timedelta(days=1)).isoformat()
+        result = self.execute(
+            "query ($to: DateTime) { crmStatistics(orderDate_Lte: $to) { orderCount } }",
+            {"to": end},
+        )
+        self.assertEqual(result["data"]["crmStatistics"]["orderCount"], 1)
+
+        response = self.client.get("/export/orders/", {"order_date__lte": end})
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual([row["id"] for row in rows], [self.archived.pk])
+
+
+class SalesRollupTests(CRMTestCase):
+    """
+    The daily rollups, whether kept up by placed orders or rebuilt, and the
+    salesTimeseries and productRevenue read from them, match the raw orders.
+    """
+
+    TIMESERIES = """
+    query ($from: Date!, $to: Date!, $granularity: SalesGranularity,
+           $groupBy: SalesGroupBy) {
+      salesTimeseries(from: $from, to: $to, granularity: $granularity,
+                      groupBy: $groupBy) {
+        period product { name } customer { name } orderCount units revenue
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers, cls.products = create_catalog(customers=3, products=3)
+
+    def place_orders(self):
+        orders = []
+        for i in range(9):
+            quantities = {self.products[i % 3].pk: 1 + i % 2}
+            if i % 4 == 0:
+                quantities[self.products[(i + 1) % 3].pk] = 2
+            orders.append(place_order(self.customers[i % 3].pk, quantities))
+        return orders
+
+    def rollups(self):
+        return (
+            sorted(
+                DailyProductSales.objects.values_list(
+                    "day", "product_id", "order_count", "units", "revenue"
+                )
+            ),
+            sorted(
+                DailyCustomerSales.objects.values_list(
+                    "day", "customer_id", "order_count", "units", "revenue"
+                )
+            ),
+        )
+
+    def expected(self, granularity="day", group_by="total"):
+        """Sum the raw orders per period and series, as salesTimeseries does."""
+        points = defaultdict(lambda: [set(), 0, Decimal(0)])
+        for line in OrderLine.objects.select_related("order__customer", "product"):
+            day = line.order.order_date.astimezone(datetime.timezone.utc).date()
+            if granularity == "week":
+                day -= datetime.timedelta(days=day.weekday())
+            elif granularity == "month":
+                day = day.replace(day=1)
+            product = line.product.name if group_by == "product" else None
+            customer = line.order.customer.name if group_by == "customer" else None
+            point = points[day.isoformat(), product, customer]
+            point[0].add(line.order_id)
+            point[1] += line.quantity
+            point[2] += line.quantity * line.unit_price
+        return [
+            {
+                "period": period,
+                "product": product and {"name": product},
+                "customer": customer and {"name": customer},
+                "orderCount": len(orders),
+                "units": units,
+                "revenue": str(revenue.quantize(Decimal("0.01"))),
+            }
+            for (period, product, customer), (orders, units, revenue) in sorted(
+                points.items(), key=lambda item: tuple(map(str, item[0]))
+            )
+        ]
+
+    def timeseries(self, granularity, group_by):
+        result = self.execute(
+            self.TIMESERIES,
+            {
+                "from": "2020-01-01",
+                "to": (timezone.now() + datetime.timedelta(days=1)).date().isoformat(),
+                "granularity": granularity.upper(),
+                "groupBy": group_by.upper(),
+            },
+        )
+        self.assertNotIn("errors", result)
+        return sorted(
+            result["data"]["salesTimeseries"],
+            key=lambda point: (
+                point["period"],
+                str(point["product"] and point["product"]["name"]),
+                str(point["customer"] and point["customer"]["name"]),
+            ),
+        )
+
+    def test_placed_orders_match_a_rebuild(self):
+        self.place_orders()
+        placed = self.rollups()
+        self.assertTrue(placed[0] and placed[1])
+        DailyProductSales.objects.all().delete()
+        DailyCustomerSales.objects.all().delete()
+        rebuild()
+        self.assertEqual(self.rollups(), placed)
+
+    def test_timeseries_matches_the_orders(self):
+        # Spread the orders over days, weeks and months, then rebuild.
+        for i, order in enumerate(self.place_orders()):
+            Order.objects.filter(pk=order.pk).update(
+                order_date=order.order_date - datetime.timedelta(days=5 * i, hours=i)
+            )
+        DailyProductSales.objects.all().delete()
+        DailyCustomerSales.objects.all().delete()
+        rebuild()
+        for granularity in ("day", "week", "month"):
+            for group_by in ("total", "product", "customer"):
+                with self.subTest(granularity=granularity, group_by=group_by):
+                    self.assertEqual(
+                        self.timeseries(granularity, group_by),
+                        self.expected(granularity, group_by),
+                    )
+
+    def test_product_revenue_matches_the_orders(self):
+        self.place_orders()
+        revenue = defaultdict(Decimal)
+        for line in OrderLine.objects.select_related("product"):
+            revenue[line.product.name] += line.quantity * line.unit_price
+        result = self.execute("{ productRevenue { product { name } revenue } }")
+        self.assertEqual(
+            {
+                row["product"]["name"]: row["revenue"]
+                for row in result["data"]["productRevenue"]
+            },
+            {name: str(value) for name, value in revenue.items()},
+        )
+
+    def test_product_revenue_limit(self):
+        # One order with a line for each of 101 products.
+        products = Product.objects.bulk_create(
+            Product(name=f"Extra {i}", price=Decimal(1), stock=1) for i in range(98)
+        )
+        order = Order.objects.create(customer=self.customers[0], total_amount=101)
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=product, quantity=1, unit_price=1)
+            for product in [*self.products, *products]
+        )
+        for limit, rows in ((None, 10), (1, 1), (100, 100), (1000, 100)):
+            with self.subTest(limit=limit):
+                result = self.execute(
+                    "query ($limit: Int) { productRevenue(limit: $limit) { revenue } }",
+                    {"limit": limit} if limit else {},
+                )
+                self.assertEqual(len(result["data"]["productRevenue"]), rows)
+
+
+class CountStrategyTests(CRMTestCase):
+    """
+    totalCount counts exactly, from the cache until an update() to a model
+    the connection reads, or from the planner statistics once ANALYZE ran;
+    countStrategy reports the strategy that produced the count.
+    """
+
+    QUERY = """
+    query ($strategy: CountStrategy, $stock: Decimal) {
+      allProducts(first: 1, countStrategy: $strategy, stock_Lte: $stock) {
+        totalCount countStrategy
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers, cls.products = create_catalog()
+
+    def setUp(self):
+        cache.clear()
+
+    def total_count(self, strategy, stock=None):
+        result = self.execute(self.QUERY, {"strategy": strategy, "stock": stock})
+        self.assertNotIn("errors", result)
+        connection_ = result["data"]["allProducts"]
+        return connection_["totalCount"], connection_["countStrategy"]
+
+    def test_exact(self):
+        for stock, expected in ((None, 4), (1000, 4), (10, 0)):
+            with self.subTest(stock=stock):
+                self.assertEqual(self.total_count("EXACT", stock), (expected, "EXACT"))
+
+    def test_cached(self):
+        for stock, expected in ((None, 4), (10, 0)):
+            with self.subTest(stock=stock):
+                self.assertEqual(self.total_count("CACHED", stock), (expected, "EXACT"))
+                self.assertEqual(
+                    self.total_count("CACHED", stock), (expected, "CACHED")
+                )
+
+    def test_update_invalidates_cached(self):
+        self.assertEqual(self.total_count("CACHED", 10), (0, "EXACT"))
+        self.assertEqual(self.total_count("CACHED", 10), (0, "CACHED"))
+        Product.objects.filter(pk=self.products[0].pk).update(stock=5)
+        self.assertEqual(self.total_count("CACHED", 10), (1, "EXACT"))
+        self.assertEqual(self.total_count("CACHED", 10), (1, "CACHED"))
+
+    def test_related_update_invalidates_cached(self):
+        # The order filters read the customers too.
+        query = """
+        query ($strategy: CountStrategy) {
+          allOrders(first: 1, countStrategy: $strategy, customerName: "Customer 0") {
+            totalCount countStrategy
+          }
+        }
+        """
+        place_order(self.customers[0].pk, {self.products[0].pk: 1})
+
+        def total_count():
+            result = self.execute(query, {"strategy": "CACHED"})
+            self.assertNotIn("errors", result)
+            connection_ = result["data"]["allOrders"]
+            return connection_["totalCount"], connection_["countStrategy"]
+
+        self.assertEqual(total_count(), (1, "EXACT"))
+        self.assertEqual(total_count(), (1, "CACHED"))
+        Customer.objects.filter(pk=self.customers[0].pk).update(name="Renamed")
+        self.assertEqual(total_count(), (0, "EXACT"))
+
+    def test_estimated(self):
+        # No statistics before the first ANALYZE: an exact count.
+        self.assertEqual(self.total_count("ESTIMATED"), (4, "EXACT"))
+        analyze()
+        self.assertEqual(self.total_count("ESTIMATED"), (4, "ESTIMATED"))
+        # SQLite has no estimate of a filtered queryset.
+        self.assertEqual(self.total_count("ESTIMATED", 10), (0, "EXACT"))
+
+    def test_import_analyzes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "products.csv")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("name,price,stock\nImported 1,5,1\nImported 2,5,1\n")
+            call_command("crm_import", "products", path, stderr=StringIO())
+        self.assertEqual(self.total_count("ESTIMATED"), (6, "ESTIMATED"))
+
+
+class AsyncGraphQLViewTests(TransactionTestCase):
+    """
+    The async view answers like the synchronous one: the same body and
+    status for a query split into concurrent root fields, a mutation and
+    invalid variables (reported once), with the CSRF cookie and GraphiQL.
+    The pool threads use their own connections, so the rows are committed.
+    """
+
+    MULTI_ROOT = """
+    query ($first: Int!) {
+      allCustomers(first: $first) { totalCount edges { node { name } } }
+      allProducts(first: $first) { edges { node { name price } } }
+      crmStatistics { customerCount orderCount }
+    }
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.customers, self.products = create_catalog()
+        place_order(self.customers[0].pk, {self.products[0].pk: 2})
+
+    def request(self, method, path, *args, **kwargs):
+        if path == "/graphql/async/":
+            return async_to_sync(getattr(AsyncClient(), method))(path, *args, **kwargs)
+        return getattr(self.client, method)(path, *args, **kwargs)
+
+    def post(self, path, query, variables=None):
+        body = json.dumps({"query": query, "variables": variables or {}})
+        return self.request("post", path, body, content_type="application/json")
+
+    def assertSameResponse(self, sync_response, async_response):
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        sync_body, async_body = sync_response.json(), async_response.json()
+        for body in (sync_body, async_body):
+            # The per-request details differ: timings, document cache hits.
+            body.pop("extensions", None)
+        self.assertEqual(async_body, sync_body)
+        return async_body
+
+    def test_multi_root_query(self):
+        body = self.assertSameResponse(
+            self.post("/graphql/", self.MULTI_ROOT, {"first": 2}),
+            self.post("/graphql/async/", self.MULTI_ROOT, {"first": 2}),
+        )
+        self.assertNotIn("errors", body)
+        self.assertEqual(
+            list(body["data"]), ["allCustomers", "allProducts", "crmStatistics"]
+        )
+        self.assertEqual(body["data"]["allCustomers"]["totalCount"], 3)
+
+    def test_invalid_variables_are_reported_once(self):
+        for variables in ({}, {"first": "two"}):
+            with self.subTest(variables=variables):
+                body = self.assertSameResponse(
+                    self.post("/graphql/", self.MULTI_ROOT, variables),
+                    self.post("/graphql/async/", self.MULTI_ROOT, variables),
+                )
+                self.assertEqual(len(body["errors"]), 1)
+                self.assertIsNone(body.get("data"))
+
+    def test_mutation(self):
+        mutation = """
+        mutation ($customer: ID!, $product: ID!) {
+          createOrder(input: {customerId: $customer, productIds: [$product]}) {
+            totalAmount order { customer { name } products { edges { node { name } } } }
+          }
+        }
+        """
+        variables = {"customer": self.customers[1].pk, "product": self.products[1].pk}
+        body = self.assertSameResponse(
+            self.post("/graphql/", mutation, variables),
+            self.post("/graphql/async/", mutation, variables),
+        )
+        self.assertNotIn("errors", body)
+        self.assertEqual(body["data"]["createOrder"]["totalAmount"], "20.00")
+        self.assertEqual(Customer.objects.get(pk=self.customers[1].pk).order_count, 2)
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).stock, 998)
+
+    def test_csrf_cookie_and_graphiql(self):
+        for path in ("/graphql/", "/graphql/async/"):
+            with self.subTest(path=path):
+                response = self.request("get", path, headers={"accept": "text/html"})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response["Content-Type"].startswith("text/html"))
+                self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+                response = self.post(
+                    path, "{ allProducts(first: 1) { edges { node { name } } } }"
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+
+class BatchTests(CRMTestCase):
+    """
+    A JSON array posted to graphql/ runs its operations in order and answers
+    each in its slot, errors included; identical queries run once unless a
+    mutation ran between them.
+    """
+
+    PRODUCT = """
+    query ($name: String) {
+      allProducts(first: 1, name: $name) { edges { node { name stock } } }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers, cls.products = create_catalog()
+
+    def setUp(self):
+        cache.clear()
+
+    def post_batch(self, entries):
+        return self.client.post(
+            self.GRAPHQL_URL, json.dumps(entries), content_type="application/json"
+        )
+
+    def test_invalid_entries_fail_alone(self):
+        entries = [
+            {"id": "valid", "query": "{ crmStatistics { customerCount } }"},
+            {"id": "no-query"},
+            {"id": "unknown-field", "query": "{ nope }"},
+            {
+                "id": "bad-variables",
+                "query": "{ crmStatistics { orderCount } }",
+                "variables": "{",
+            },
+            {"id": "also-valid", "query": "{ crmStatistics { orderCount } }"},
+        ]
+        response = self.post_batch(entries)
+        self.assertEqual(response.status_code, 400)
+        results = response.json()
+        self.assertEqual([r["id"] for r in results], [e["id"] for e in entries])
+        self.assertEqual([r["status"] for r in results], [200, 400, 400, 400, 200])
+        self.assertEqual(results[0]["data"], {"crmStatistics": {"customerCount": 3}})
+        self.assertEqual(results[4]["data"], {"crmStatistics": {"orderCount": 0}})
+        messages = [r["errors"][0]["message"] for r in results[1:4]]
+        self.assertEqual(messages[0], "Must provide query string.")
+        self.assertIn("nope", messages[1])
+        self.assertEqual(messages[2], "Variables are invalid JSON.")
+
+    def test_identical_queries_are_reused(self):
+        query = {"query": self.PRODUCT, "variables": {"name": "Product 0"}}
+        mutation = {
+            "query": """
+            mutation ($customer: ID!, $product: ID!) {
+              createOrder(input: {customerId: $customer, productIds: [$product]}) {
+                totalAmount
+              }
+            }
+            """,
+            "variables": {
+                "customer": self.customers[0].pk,
+                "product": self.products[0].pk,
+            },
+        }
+        other = {"query": self.PRODUCT, "variables": {"name": "Product 1"}}
+        response = self.post_batch([query, query, other, mutation, query])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(
+            [r["extensions"].get("batch") for r in results],
+            [
+                {"reused": False},
+                {"reused": True},
+                {"reused": False},
+                None,
+                {"reused": False},
+            ],
+        )
+        stocks = [
+            r["data"]["allProducts"]["edges"][0]["node"]["stock"]
+            for r in results
+            if "allProducts" in r["data"]
+        ]
+        # The query after the mutation reads its write.
+        self.assertEqual(stocks, [1000, 1000, 1000, 999])
+
+
+class ExportTests(CRMTestCase):
+    """
+    export/<kind>/ streams the rows matching its filter arguments as NDJSON
+    or CSV, and rejects unknown query parameters with a 400 naming them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers, cls.products = create_catalog()
+        cls.orders = [
+            place_order(cls.customers[0].pk, {cls.products[0].pk: 1}),
+            place_order(
+                cls.customers[1].pk, {cls.products[1].pk: 1, cls.products[3].pk: 2}
+            ),
+        ]
+
+    def export(self, kind, **params):
+        response = self.client.get(f"/export/{kind}/", params)
+        body = b"".join(response.streaming_content).decode("utf-8")
+        return response, body
+
+    def test_ndjson(self):
+        response, body = self.export("products", price__gte="20")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="products.ndjson"'
+        )
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(
+            [(row["name"], row["price"], row["stock"]) for row in rows],
+            [
+                ("Product 1", "20.00", 999),
+                ("Product 2", "30.00", 1000),
+                ("Product 3", "40.00", 998),
+            ],
+        )
+
+    def test_csv(self):
+        response, body = self.export(
+            "orders", format="csv", chunk_size="1", customer_name="Customer 1"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = body.splitlines()
+        self.assertEqual(lines[0], "id,customer_id,total_amount,order_date,product_ids")
+        self.assertEqual(len(lines), 2)
+        order = self.orders[1]
+        self.assertTrue(
+            lines[1].startswith(f"{order.pk},{self.customers[1].pk},100.00,")
+        )
+        self.assertTrue(
+            lines[1].endswith(f",{self.products[1].pk} {self.products[3].pk}")
+        )
+
+    def test_unknown_parameters(self):
+        response = self.client.get(
+            "/export/customers/", {"name": "Customer", "nmae": "x", "bogus": "1"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {"errors": [{"message": "Unknown filters: bogus, nmae."}]}
+        )
+
+    def test_invalid_arguments(self):
+        for kind, params in (
+            ("invoices", {}),
+            ("products", {"format": "xml"}),
+            ("products", {"chunk_size": "0"}),
+            ("orders", {"order_date__gte": "yesterday"}),
+        ):
+            with self.subTest(kind=kind, params=params):
+                response = self.client.get(f"/export/{kind}/", params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("errors", response.json())
+
+
+class ImportTests(TestCase):
+    """
+    crm_import imports the valid rows, reports the rejected ones with their
+    row number, and resumes an interrupted import after its last committed
+    batch.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        return path
+
+    def run_import(self, kind, path, *args):
+        stderr = StringIO()
+        call_command("crm_import", kind, path, *args, stderr=stderr)
+        return stderr.getvalue()
+
+    def test_rejected_customers(self):
+        Customer.objects.create(name="Taken", email="taken@example.com")
+        path = self.write(
+            "customers.csv",
+            [
+                "name,email,phone",
+                "Alice,alice@example.com,+1234567890",
+                "Bob,,",
+                "Taken,other@example.com,",
+                "Carol,taken@example.com,",
+                "Alice,alice2@example.com,",
+                "Dan,dan@example.com,12345",
+                "Erin,erin@example.com,123-456-7890",
+            ],
+        )
+        output = self.run_import("customers", path, "--batch-size", "3")
+        for number, message in (
+            (2, "Name and email are required."),
+            (3, "Customer with name Taken already exists."),
+            (4, "Customer with email taken@example.com already exists."),
+            (5, "Customer with name Alice already exists."),
+            (6, PHONE_ERROR),
+        ):
+            self.assertIn(f"Row {number}: {message}", output)
+        self.assertIn("Imported 2 customers, skipped 5 invalid rows", output)
+        self.assertEqual(
+            sorted(Customer.objects.values_list("name", flat=True)),
+            ["Alice", "Erin", "Taken"],
+        )
+
+    def test_rejected_products_and_orders(self):
+        Customer.objects.create(name="Alice", email="alice@example.com")
+        products = self.write(
+            "products.ndjson",
+            [
+                '{"name": "Pen", "price": "1.50", "stock": 10}',
+                "not json",
+                '{"name": "Ink", "price": "-1"}',
+                '{"name": "Pad", "price": "2", "stock": "many"}',
+            ],
+        )
+        output = self.run_import("products", products)
+        self.assertIn("Row 2: Not a JSON object.", output)
+        self.assertIn("Row 3: Price cannot be negative.", output)
+        self.assertIn("Row 4: Price must be a number and stock an integer.", output)
+        self.assertEqual(list(Product.objects.values_list("name", flat=True)), ["Pen"])
+
+        orders = self.write(
+            "orders.csv",
+            [
+                "customer_email,products,order_date",
+                "alice@example.com,Pen:2,2025-01-02",
+                "nobody@example.com,Pen:1,",
+                "alice@example.com,Ink:1,",
+                "alice@example.com,Pen:0,",
+                "alice@example.com,Pen:1,someday",
+            ],
+        )
+        output = self.run_import("orders", orders)
+        self.assertIn("Row 2: No customer with email nobody@example.com.", output)
+        self.assertIn("Row 3: Unknown products: Ink.", output)
+        self.assertIn("Row 4: Invalid quantity for product Pen.", output)
+        self.assertIn("Row 5: Invalid order date 'someday'.", output)
+        order = Order.objects.get()
+        self.assertEqual(order.total_amount, Decimal("3.00"))
+        self.assertEqual(order.order_date.date(), datetime.date(2025, 1, 2))
+        # The stock is left as it is: the orders are history.
+        self.assertEqual(Product.objects.get().stock, 10)
+
+    def test_resume_after_interruption(self):
+        customers, products = create_catalog(customers=2, products=2)
+        path = self.write(
+            "orders.ndjson",
+            [
+                json.dumps(
+                    {
+                        "customer_email": customers[i % 2].email,
+                        "products": [{"name": products[i % 2].name, "quantity": 1}],
+                        "order_date": f"2025-01-0{i + 1}",
+                    }
+                )
+                for i in range(5)
+            ],
+        )
+        import_orders = IMPORTS["orders"]
+        calls = []
+
+        def interrupted(batch):
+            calls.append(batch)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return import_orders(batch)
+
+        with mock.patch.dict(IMPORTS, orders=interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_import("orders", path, "--batch-size", "2")
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.rows, checkpoint.finished), (2, False))
+        self.assertEqual(Order.objects.count(), 2)
+
+        output = self.run_import("orders", path, "--batch-size", "2")
+        self.assertIn("Resuming after row 2.", output)
+        self.assertIn("Imported 3 orders", output)
+        self.assertEqual(
+            sorted(d.day for d in Order.objects.values_list("order_date", flat=True)),
+            [1, 2, 3, 4, 5],
+        )
+        # The aggregates and rollups cover the orders of both runs.
+        self.assertEqual(
+            sorted(Customer.objects.values_list("order_count", flat=True)), [2, 3]
+        )
+        self.assertEqual(DailyProductSales.objects.count(), 5)
+
+        output = self.run_import("orders", path)
+        self.assertIn("was already imported (5 rows)", output)
+        self.assertEqual(Order.objects.count(), 5)
+
+
+class QueryOptimizerTests(CRMTestCase):
+    """
+    Connection querysets load only the selected columns, join the selected
+    foreign keys and prefetch the selected unfiltered to-many relations, on
+    top of the filters, ordering and slicing of the connection.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers, cls.products = create_catalog(customers=6, products=4)
+        for customer in cls.customers:
+            for i in range(2):
+                place_order(
+                    customer.pk, {cls.products[i].pk: 1, cls.products[i + 1].pk: 2}
+                )
+
+    def capture(self, query, variables=None):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.execute(query, variables)
+        self.assertNotIn("errors", result)
+        return result["data"], [q["sql"] for q in queries.captured_queries]
+
+    def test_foreign_key_is_joined_with_the_selected_columns(self):
+        data, queries = self.capture(
+            "{ allOrders(first: 4) { edges { node { totalAmount customer { name } } } } }"
+        )
+        self.assertEqual(len(queries), 1)
+        self.assertIn('JOIN "crm_customer"', queries[0])
+        self.assertIn('"crm_customer"."name"', queries[0])
+        for column in (
+            '"crm_order"."order_date"',
+            '"crm_customer"."email"',
+            '"crm_customer"."lifetime_value"',
+        ):
+            self.assertNotIn(column, queries[0])
+        self.assertEqual(len(data["allOrders"]["edges"]), 4)
+
+    def test_nested_connection_is_prefetched_with_filters_and_slicing(self):
+        query = """
+        query ($first: Int) {
+          allCustomers(first: $first, name: "Customer", orderBy: "-name") {
+            edges { node { name orderCustomer(first: 10) {
+              edges { node { totalAmount } }
+            } } }
+          }
+        }
+        """
+        for first in (2, 5):
+            with self.subTest(first=first):
+                data, queries = self.capture(query, {"first": first})
+                self.assertEqual(len(queries), 2)
+                customers, orders = queries
+                self.assertIn("LIKE", customers)
+                self.assertIn('ORDER BY "crm_customer"."name" DESC', customers)
+                self.assertIn(f"LIMIT {first + 1}", customers)
+                self.assertNotIn('"crm_customer"."email"', customers)
+                self.assertIn('"crm_order"."customer_id" IN', orders)
+                self.assertIn('"crm_order"."total_amount"', orders)
+                self.assertNotIn('"crm_order"."order_date"', orders)
+
+                edges = data["allCustomers"]["edges"]
+                self.assertEqual(
+                    [edge["node"]["name"] for edge in edges],
+                    [f"Customer {i}" for i in range(5, 5 - first, -1)],
+                )
+                for edge in edges:
+                    self.assertEqual(len(edge["node"]["orderCustomer"]["edges"]), 2)
+
+    def test_resolver_fields_load_without_n_plus_one(self):
+        # lineTotal is not a model field: the lines are loaded whole, once.
+        query = """
+        query ($first: Int) {
+          allOrders(first: $first) { edges { node {
+            lines { quantity lineTotal product { name } }
+          } } }
+        }
+        """
+        for first in (2, 8):
+            with self.subTest(first=first):
+                data, queries = self.capture(query, {"first": first})
+                self.assertEqual(len(queries), 2)
+                self.assertNotIn('"crm_order"."total_amount"', queries[0])
+                self.assertIn('JOIN "crm_product"', queries[1])
+                for edge in data["allOrders"]["edges"]:
+                    self.assertEqual(
+                        [line["quantity"] for line in edge["node"]["lines"]], [1, 2]
+                    )
+
+
+class CRMStatisticsTests(CRMTestCase):
+    """
+    crmStatistics matches the raw hot and archived orders for any orderDate
+    range, counting the customers without orders, whether the range stays
+    on one side of the archive horizon or spans it.
+    """
+
+    QUERY = """
+    query ($gte: DateTime, $lte: DateTime) {
+      crmStatistics(orderDate_Gte: $gte, orderDate_Lte: $lte) {
+        customerCount orderCount totalRevenue averageOrderValue
+      }
+    }
+    """
+    DATES = [
+        datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2024, 1, 2, 12, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2024, 1, 2, 18, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2024, 3, 15, 9, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2025, 6, 1, 8, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2025, 6, 2, 20, tzinfo=datetime.timezone.utc),
+    ]
+    HORIZON = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+    @classmethod
+    def setUpTestData(cls):
+        # The third customer has no orders.
+        cls.customers, cls.products = create_catalog(customers=3, products=3)
+        for i, date in enumerate(cls.DATES):
+            order = place_order(
+                cls.customers[i % 2].pk, {cls.products[i % 3].pk: 1 + i % 2}
+            )
+            Order.objects.filter(pk=order.pk).update(order_date=date)
+        archive_orders(cls.HORIZON)
+
+    def setUp(self):
+        cache.clear()
+
+    def expected(self, gte=None, lte=None):
+        amounts = [
+            amount
+            for model in (Order, ArchivedOrder)
+            for date, amount in model.objects.values_list("order_date", "total_amount")
+            if (gte is None or date >= gte) and (lte is None or date <= lte)
+        ]
+        revenue = sum(amounts, Decimal(0))
+        average = revenue / len(amounts) if amounts else Decimal(0)
+        return {
+            "customerCount": Customer.objects.count(),
+            "orderCount": len(amounts),
+            "totalRevenue": str(revenue.quantize(Decimal("0.01"))),
+            "averageOrderValue": str(average.quantize(Decimal("0.01"))),
+        }
+
+    def test_matches_the_raw_orders(self):
+        self.assertEqual(ArchivedOrder.objects.count(), 4)
+        self.assertEqual(Order.objects.count(), 2)
+
+        def at(*args):
+            return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+        for name, gte, lte in (
+            ("unranged", None, None),
+            ("gte in the archive", at(2024, 1, 2, 15), None),
+            ("gte in the hot table", at(2025, 6, 1, 12), None),
+            ("lte in the archive", None, at(2024, 1, 2, 15)),
+            ("lte in the hot table", None, at(2025, 6, 1, 12)),
+            ("within a day", at(2024, 1, 2), at(2024, 1, 2, 12)),
+            ("whole archived days", at(2024, 1, 1), at(2024, 3, 16)),
+            ("across the horizon", at(2024, 1, 2, 15), at(2025, 6, 1, 12)),
+            ("hot only", at(2025, 1, 1), at(2025, 12, 31)),
+            ("no orders", at(2023, 1, 1), at(2023, 12, 31)),
+        ):
+            with self.subTest(name):
+                variables = {
+                    "gte": gte and gte.isoformat(),
+                    "lte": lte and lte.isoformat(),
+                }
+                result = self.execute(self.QUERY, variables)
+                self.assertNotIn("errors", result)
+                self.assertEqual(
+                    result["data"]["crmStatistics"], self.expected(gte, lte)
+                )
+
+
+class DocumentCacheTests(CRMTestCase):
+    """
+    Parsed and validated documents are reused by query hash, least recently
+    used first out, and report their hits in ``extensions``; syntax errors
+    are not kept. Automatic persisted queries run from their hash once
+    registered with a query matching it.
+    """
+
+    QUERY = "{ allProducts(first: 1) { edges { node { name } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog()
+
+    def setUp(self):
+        cache.clear()
+        document_cache.clear()
+        persisted_queries.clear()
+
+    def post(self, body):
+        response = self.client.post(
+            self.GRAPHQL_URL, json.dumps(body), content_type="application/json"
+        )
+        return response.json()
+
+    def document_stats(self, query):
+        result = self.execute(query)
+        stats = result["extensions"]["documentCache"]
+        return stats["hit"], stats["hits"], stats["misses"], stats["size"]
+
+    def test_hits_and_misses_in_extensions(self):
+        other = "{ crmStatistics { orderCount } }"
+        self.assertEqual(self.document_stats(self.QUERY), (False, 0, 1, 1))
+        self.assertEqual(self.document_stats(self.QUERY), (True, 1, 1, 1))
+        self.assertEqual(self.document_stats(other), (False, 1, 2, 2))
+        self.assertEqual(self.document_stats(self.QUERY), (True, 2, 2, 2))
+
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = (
+            f"{{ allProducts(first: {n}) {{ edges {{ node {{ name }} }} }} }}"
+            for n in (1, 2, 3)
+        )
+        with mock.patch.object(document_cache, "max_size", 2):
+            for query in (first, second, first, third):
+                self.execute(query)
+            # second was the least recently used when third came in.
+            self.assertEqual(document_cache.evictions, 1)
+            self.assertTrue(self.document_stats(first)[0])
+            self.assertTrue(self.document_stats(third)[0])
+            self.assertFalse(self.document_stats(second)[0])
+            self.assertEqual(len(document_cache), 2)
+            self.assertEqual(document_cache.evictions, 2)
+
+    def test_syntax_errors_are_not_cached(self):
+        for _ in range(2):
+            result = self.execute("{ allProducts(")
+            self.assertIn("Syntax Error", result["errors"][0]["message"])
+        self.assertEqual(len(document_cache), 0)
+        self.assertEqual((document_cache.hits, document_cache.misses), (0, 2))
+
+    def test_persisted_query_flow(self):
+        extensions = {
+            "persistedQuery": {"version": 1, "sha256Hash": query_hash(self.QUERY)}
+        }
+        result = self.post({"extensions": extensions})
+        self.assertEqual(
+            result["errors"][0]["extensions"], {"code": "PERSISTED_QUERY_NOT_FOUND"}
+        )
+        self.assertEqual(result["errors"][0]["message"], "PersistedQueryNotFound")
+
+        registered = self.post({"query": self.QUERY, "extensions": extensions})
+        self.assertNotIn("errors", registered)
+
+        result = self.post({"extensions": extensions})
+        self.assertNotIn("errors", result)
+        self.assertEqual(result["data"], registered["data"])
+        self.assertTrue(result["extensions"]["documentCache"]["hit"])
+
+        # A GET carries the extensions as JSON in the query string.
+        response = self.client.get(
+            self.GRAPHQL_URL, {"extensions": json.dumps(extensions)}
+        )
+        self.assertEqual(response.json()["data"], registered["data"])
+
+    def test_mismatched_hash_is_rejected(self):
+        extensions = {
+            "persistedQuery": {"version": 1, "sha256Hash": query_hash("{ other }")}
+        }
+        result = self.post({"query": self.QUERY, "extensions": extensions})
+        self.assertEqual(
+            result["errors"][0]["message"], "provided sha does not match query"
+        )
+        self.assertNotIn("data", result)
+        self.assertEqual(len(persisted_queries), 0)
+
+
+class KeysetNullOrderingTests(CRMTestCase):
+    """
+    Keyset pages ordered by the nullable lastOrderDate list the customers
+    without orders last ascending and first descending, across page
+    boundaries in both directions.
+    """
+
+    PAGE = """
+    query ($orderBy: String, $first: Int, $last: Int, $after: String,
+           $before: String) {
+      allCustomers(keyset: true, orderBy: $orderBy, first: $first, last: $last,
+                   after: $after, before: $before) {
+        edges { node { id } }
+        pageInfo { startCursor endCursor hasNextPage hasPreviousPage }
+      }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        customers, _ = create_catalog(customers=8, products=0)
+        day = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        # Ties on the date; customers 3, 5 and 6 have no orders.
+        for index, days in ((0, 2), (1, 0), (2, 2), (4, 1), (7, 0)):
+            Customer.objects.filter(pk=customers[index].pk).update(
+                last_order_date=day + datetime.timedelta(days=days)
+            )
+        cls.customers = list(Customer.objects.order_by("pk"))
+
+    def expected(self, descending):
+        dated = sorted(
+            (c for c in self.customers if c.last_order_date is not None),
+            key=lambda c: (c.last_order_date, c.pk),
+        )
+        undated = [c for c in self.customers if c.last_order_date is None]
+        ids = [str(c.pk) for c in dated + undated]
+        return ids[::-1] if descending else ids
+
+    def page(self, **args):
+        result = self.execute(self.PAGE, args)
+        self.assertNotIn("errors", result)
+        page = result["data"]["allCustomers"]
+        return page, [from_global_id(e["node"]["id"])[1] for e in page["edges"]]
+
+    def test_forward_and_backward(self):
+        for order_by in ("lastOrderDate", "-lastOrderDate"):
+            expected = self.expected(order_by.startswith("-"))
+            with self.subTest(order_by=order_by, direction="forward"):
+                page, ids = self.page(orderBy=order_by, first=2)
+                while page["pageInfo"]["hasNextPage"]:
+                    page, more = self.page(
+                        orderBy=order_by, first=2, after=page["pageInfo"]["endCursor"]
+                    )
+                    ids += more
+                self.assertEqual(ids, expected)
+            with self.subTest(order_by=order_by, direction="backward"):
+                page, ids = self.page(orderBy=order_by, last=2)
+                while page["pageInfo"]["hasPreviousPage"]:
+                    page, more = self.page(
+                        orderBy=order_by, last=2, before=page["pageInfo"]["startCursor"]
+                    )
+                    ids = more + ids
+                self.assertEqual(ids, expected)
+
+    def test_cursor_of_a_customer_without_orders(self):
+        undated = [c for c in self.customers if c.last_order_date is None]
+        for order_by in ("lastOrderDate", "-lastOrderDate"):
+            expected = self.expected(order_by.startswith("-"))
+            for customer in undated:
+                position = expected.index(str(customer.pk))
+                cursor = encode_cursor("last_order_date", None, customer.pk)
+                with self.subTest(order_by=order_by, customer=customer.pk):
+                    _, after = self.page(orderBy=order_by, first=10, after=cursor)
+                    self.assertEqual(after, expected[position + 1 :])
+                    _, before = self.page(orderBy=order_by, last=10, before=cursor)
+                    self.assertEqual(before, expected[:position])
+
+
+CATALOG = "{ allProducts(first: 100) { edges { node { id name price stock } } } }"
+CUSTOMERS = (
+    "{ allCustomers(first: 50) { edges { node { id name email phone orderCount } } } }"
+)
+STATISTICS = "{ crmStatistics { customerCount orderCount totalRevenue } }"
+CREATE_PRODUCT = (
+    'mutation { createProduct(input: {name: "New", price: 1}) { product { id } } }'
+)
+
+
+@override_settings(
+    CRM_RESPONSE_CACHE_ENABLED=False,
+    CRM_GRAPHQL_MAX_AGE={"allProducts": 60},
+    CRM_GRAPHQL_DEFAULT_MAX_AGE=0,
+)
+class GraphQLHTTPCachingTests(TestCase):
+    """
+    GET queries to graphql/ carry a weak content-hash ETag and a Cache-Control
+    derived from their root fields, a matching If-None-Match gets an empty
+    304, and responses are gzipped for clients accepting it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        products = Product.objects.bulk_create(
+            Product(
+                name=f"Product {i}", price=Decimal(i) + Decimal("0.99"), stock=i % 50
+            )
+            for i in range(100)
+        )
+        customers = Customer.objects.bulk_create(
+            Customer(
+                name=f"Customer {i}",
+                email=f"customer{i}@example.com",
+                phone="+1234567890",
+            )
+            for i in range(50)
+        )
+        for i, customer in enumerate(customers):
+            order = Order.objects.create(
+                customer=customer, total_amount=products[i].price
+            )
+            OrderLine.objects.create(
+                order=order,
+                product=products[i],
+                quantity=1,
+                unit_price=products[i].price,
+            )
+
+    def get(self, query, **headers):
+        return self.client.get("/graphql/", {"query": query}, headers=headers)
+
+    def post(self, query, **headers):
+        return self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            headers=headers,
+        )
+
+    def test_get_query_has_etag_and_cache_control(self):
+        response = self.get(CATALOG)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("errors", response.json())
+        self.assertTrue(response["ETag"].startswith('W/"'))
+        self.assertIn("private", response["Cache-Control"])
+        self.assertIn("max-age=60", response["Cache-Control"])
+
+    def test_matching_if_none_match_gets_empty_304(self):
+        etag = self.get(CATALOG)["ETag"]
+        response = self.get(CATALOG, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+    def test_etag_ignores_the_extensions(self):
+        # The document cache misses, then hits: the bodies differ.
+        document_cache.clear()
+        first = self.get(CATALOG)
+        second = self.get(CATALOG)
+        self.assertNotEqual(first.json()["extensions"], second.json()["extensions"])
+        self.assertEqual(first.json()["data"], second.json()["data"])
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertTrue(first["ETag"].startswith("W/"))
+
+    def test_changed_data_changes_etag(self):
+        etag = self.get(CATALOG)["ETag"]
+        Product.objects.filter(name="Product 0").update(stock=999)
+        response = self.get(CATALOG, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_weak_etag_of_gzipped_response_matches(self):
+        etag = self.get(CATALOG, accept_encoding="gzip")["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        response = self.get(CATALOG, accept_encoding="gzip", if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_max_age_is_the_smallest_of_the_root_fields(self):
+        response = self.get("{ allProducts(first: 1) { edges { node { name } } } }")
+        self.assertIn("max-age=60", response["Cache-Control"])
+
+        response = self.get(
+            "{ allProducts(first: 1) { edges { node { name } } } "
+            "crmStatistics { orderCount } }"
+        )
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertNotIn("max-age=60", response["Cache-Control"])
+
+    def test_mutations_and_errors_are_not_stored(self):
+        response = self.post(CREATE_PRODUCT)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-store", response["Cache-Control"])
+
+        response = self.get("{ allProducts { unknownField } }")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("no-store", response["Cache-Control"])
+        self.assertFalse(response.has_header("ETag"))
+
+        response = self.get(CREATE_PRODUCT)
+        self.assertEqual(response.status_code, 405)
+        self.assertIn("no-store", response["Cache-Control"])
+
+    def test_post_query_has_no_etag(self):
+        response = self.post(CATALOG)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_gzip_when_accepted(self):
+        plain = self.get(CATALOG)
+        compressed = self.get(CATALOG, accept_encoding="gzip")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        self.assertEqual(
+            json.loads(gzip.decompress(compressed.content))["data"],
+            plain.json()["data"],
+        )
+        self.assertFalse(plain.has_header("Content-Encoding"))
+
+    def test_bytes_on_the_wire(self):
+        """
+        Body bytes of representative queries: a POST as clients sent them
+        before, a gzipped GET, and a GET revalidating an unchanged result.
+        """
+        for name, query, ratio in (
+            ("catalog", CATALOG, 4),
+            ("customers", CUSTOMERS, 4),
+            ("statistics", STATISTICS, 1),
+        ):
+            with self.subTest(name):
+                before = len(self.post(query).content)
+                first = self.get(query, accept_encoding="gzip")
+                after = len(first.content)
+                revalidated = self.get(
+                    query, accept_encoding="gzip", if_none_match=first["ETag"]
+                )
+                if ratio > 1:
+                    self.assertEqual(first["Content-Encoding"], "gzip")
+                    self.assertLess(
+                        after * ratio,
+                        before,
+                        f"{name}: {before} bytes uncompressed, {after} gzipped",
+                    )
+                else:
+                    # Too small to be worth compressing.
+                    self.assertLessEqual(after, before)
+                self.assertEqual(revalidated.status_code, 304)
+                self.assertEqual(len(revalidated.content), 0)
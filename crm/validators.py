@@ -0,0 +1,16 @@
+"""crm/validators.py
+This file contains the validation rules shared by the mutations and the bulk
+imports of the CRM.
+"""
+
+import re
+
+PHONE_PATTERN = re.compile(r"^(\+?\d{10}|\d{3}-\d{3}-\d{4})$")
+PHONE_ERROR = (
+    "Phone number is not valid. It should be in the format +1234567890 or 123-456-7890."
+)
+
+
+def is_valid_phone(phone):
+    """Tell whether ``phone`` is blank or a valid phone number."""
+    return not phone or PHONE_PATTERN.match(phone) is not None
@@ -1,3 +1,736 @@
-from django.shortcuts import render
+"""crm/views.py
+This file contains the GraphQL views serving the CRM schema (the WSGI view,
+and the async view for ASGI deployments) and the streaming export view.
+"""
 
-# Create your views here.
+import asyncio
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.http import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_GET
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import (
+    DocumentNode,
+    ExecutionResult,
+    FieldNode,
+    FragmentDefinitionNode,
+    GraphQLError,
+    OperationDefinitionNode,
+    OperationType,
+    SelectionSetNode,
+    execute,
+    get_operation_ast,
+    get_variable_values,
+    validate_schema,
+)
+
+from crm import cost as query_cost
+from crm import response_cache, routers
+from crm.documents import document_cache, get_document, persisted_queries, query_hash
+from crm.export import FORMATS, export_lines
+from crm.loaders import loaders_for
+
+executor = None
+
+
+def get_executor():
+    """
+    Return the thread pool the async view runs the ORM in, bounded to
+    CRM_ASYNC_THREADS threads (and as many database connections).
+    """
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "CRM_ASYNC_THREADS", 8),
+            thread_name_prefix="crm-graphql",
+        )
+    return executor
+
+
+def release_connections():
+    """
+    End-of-call cleanup of a pool thread's database connections: broken
+    ones are closed, as are those past CONN_MAX_AGE. With CONN_MAX_AGE = 0
+    they are kept instead of reopened for every root field, the pool
+    bounding them already.
+    """
+    for conn in connections.all(initialized_only=True):
+        if conn.settings_dict["CONN_MAX_AGE"] == 0:
+            conn.close_at = None
+        conn.close_if_unusable_or_obsolete()
+
+
+def run_in_pool(func, *args):
+    """Run ``func`` in the bounded thread pool."""
+
+    def call():
+        try:
+            return func(*args)
+        finally:
+            release_connections()
+
+    return sync_to_async(call, thread_sensitive=False, executor=get_executor())()
+
+
+def split_root_fields(operation):
+    """
+    Return one document per root field of a query operation, so they can
+    run concurrently, or the whole document when it cannot be split: a single
+    root field, root fragments, or the same response key twice.
+    """
+    operation_ast = operation.operation_ast
+    if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+        return [operation.document]
+
+    selections = operation_ast.selection_set.selections
+    if len(selections) < 2 or not all(isinstance(s, FieldNode) for s in selections):
+        return [operation.document]
+    keys = [(s.alias or s.name).value for s in selections]
+    if len(set(keys)) < len(keys):
+        return [operation.document]
+
+    fragments = [
+        definition
+        for definition in operation.document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    ]
+    return [
+        DocumentNode(
+            definitions=(
+                OperationDefinitionNode(
+                    operation=operation_ast.operation,
+                    name=operation_ast.name,
+                    variable_definitions=operation_ast.variable_definitions,
+                    directives=operation_ast.directives,
+                    selection_set=SelectionSetNode(selections=(selection,)),
+                ),
+                *fragments,
+            )
+        )
+        for selection in selections
+    ]
+
+
+def merge_results(results):
+    """Merge the results of the root fields of one operation, in order."""
+    if len(results) == 1:
+        return results[0]
+
+    errors = [error for result in results for error in result.errors or ()]
+    if any(result.data is None for result in results):
+        # A null root field that is non-null nulls the whole response.
+        return ExecutionResult(data=None, errors=errors or None)
+
+    data = {}
+    for result in results:
+        data.update(result.data)
+    return ExecutionResult(data=data, errors=errors or None)
+
+
+class Operation:
+    """
+    A validated GraphQL operation, ready to execute.
+    """
+
+    def __init__(
+        self,
+        query,
+        document,
+        operation_ast,
+        variables,
+        operation_name,
+        cache_key,
+        database,
+    ):
+        self.query = query
+        self.document = document
+        self.operation_ast = operation_ast
+        self.variables = variables
+        self.operation_name = operation_name
+        self.cache_key = cache_key
+        self.database = database
+
+
+class CRMGraphQLView(GraphQLView):
+    """
+    GraphQL view for the CRM.
+    It reuses parsed and validated documents, accepts automatic persisted
+    queries and reports per-request execution details in the response
+    ``extensions``. Successful GET queries may be kept by the client for
+    the max-age of their root fields.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        return self.add_cache_headers(request, response)
+
+    @staticmethod
+    def get_max_age(operation_ast):
+        """
+        Return the Cache-Control max-age of a query: the smallest of its root
+        fields in CRM_GRAPHQL_MAX_AGE, CRM_GRAPHQL_DEFAULT_MAX_AGE for the
+        others.
+        """
+        max_ages = getattr(settings, "CRM_GRAPHQL_MAX_AGE", {})
+        default = getattr(settings, "CRM_GRAPHQL_DEFAULT_MAX_AGE", 0)
+        return min(
+            (
+                max_ages.get(selection.name.value, default)
+                if isinstance(selection, FieldNode)
+                else default
+            )
+            for selection in operation_ast.selection_set.selections
+        )
+
+    @staticmethod
+    def add_cache_headers(request, response):
+        """
+        Set the cache headers of a response. A successful GET query gets a
+        weak ETag of its data, as its per-request extensions may differ
+        between two equivalent bodies, and is private to the viewer, for its
+        max-age (revalidated with the ETag every time when it is 0); anything
+        else is no-store. GraphiQL pages are left alone.
+        """
+        if response.get("Content-Type", "").startswith("text/html"):
+            return response
+        max_age = getattr(request, "crm_max_age", None)
+        etag = getattr(request, "crm_etag", None)
+        if request.method != "GET" or response.status_code != 200 or etag is None:
+            patch_cache_control(response, no_store=True)
+            return response
+
+        response["ETag"] = "W/" + quote_etag(etag)
+        if max_age:
+            patch_cache_control(response, private=True, max_age=max_age)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_extensions(self, request):
+        """Collect the extensions reported for this request."""
+        extensions = {}
+
+        cost = getattr(request, "crm_query_cost", None)
+        if cost is not None:
+            extensions["cost"] = cost.as_dict()
+
+        loaders = getattr(request, "crm_loaders", None)
+        if loaders is not None:
+            extensions["dataloader"] = loaders.stats()
+
+        response_hit = getattr(request, "crm_response_cache_hit", None)
+        if response_hit is not None:
+            extensions["responseCache"] = {"hit": response_hit}
+
+        database = getattr(request, "crm_database", None)
+        if database is not None:
+            extensions["database"] = database
+
+        batch_reused = getattr(request, "crm_batch_reused", None)
+        if batch_reused is not None:
+            extensions["batch"] = {"reused": batch_reused}
+
+        document_hit = getattr(request, "crm_document_cache_hit", None)
+        if document_hit is not None:
+            extensions["documentCache"] = dict(document_cache.stats(), hit=document_hit)
+
+        return extensions
+
+    @staticmethod
+    def get_persisted_query_hash(request, data):
+        """Return the sha256Hash of a persistedQuery extension, if any."""
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if not extensions:
+            return None
+
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+
+        persisted = extensions.get("persistedQuery") or {}
+        return persisted.get("sha256Hash")
+
+    @staticmethod
+    def get_viewer(request):
+        """Return the identity response cache entries are scoped to."""
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return "anonymous"
+
+    def get_client_id(self, request):
+        """Return the identity query cost budgets are charged to."""
+        viewer = self.get_viewer(request)
+        if viewer == "anonymous":
+            return "ip:{}".format(request.META.get("REMOTE_ADDR", "unknown"))
+        return viewer
+
+    def stick(self, request, operation_ast):
+        """
+        Keep the client's reads on the primary after a mutation, and mark
+        the request's DataLoaders stale for the next operation of a batch.
+        """
+        if (
+            operation_ast is not None
+            and operation_ast.operation == OperationType.MUTATION
+        ):
+            routers.stick(self.get_client_id(request))
+            request.crm_mutated = True
+
+    def parse_body(self, request):
+        """
+        Parse the request body. A JSON array is a batch of operations, run in
+        order and answered with an array of results, at most
+        CRM_GRAPHQL_MAX_BATCH_SIZE of them; an entry that cannot run gets
+        its error in its own slot.
+        """
+        if (
+            self.get_content_type(request) == "application/json"
+            and request.body.lstrip()[:1] == b"["
+        ):
+            self.batch = True
+        data = super().parse_body(request)
+
+        if self.batch:
+            max_size = getattr(settings, "CRM_GRAPHQL_MAX_BATCH_SIZE", 20)
+            if len(data) > max_size:
+                raise HttpError(
+                    HttpResponseBadRequest(
+                        f"Batch of {len(data)} operations exceeds the maximum "
+                        f"of {max_size}."
+                    )
+                )
+            if not all(isinstance(entry, dict) for entry in data):
+                raise HttpError(
+                    HttpResponseBadRequest("Batch entries must be JSON objects.")
+                )
+        return data
+
+    @staticmethod
+    def start_operation(request):
+        """
+        Clear what the previous operation of a batch left on the request.
+        The DataLoaders and the results of the queries stay shared, so the
+        lookups of the operations and identical queries are deduplicated,
+        unless it was a mutation: later operations then read its writes.
+        """
+        for name in (
+            "crm_query_cost",
+            "crm_response_cache_hit",
+            "crm_database",
+            "crm_document_cache_hit",
+            "crm_batch_reused",
+            "crm_max_age",
+        ):
+            request.__dict__.pop(name, None)
+        setattr(request, MUTATION_ERRORS_FLAG, False)
+        if getattr(request, "crm_mutated", False) or not hasattr(
+            request, "crm_batch_results"
+        ):
+            request.crm_loaders = None
+            request.crm_batch_results = {}
+            request.crm_mutated = False
+
+    def get_response(self, request, data, show_graphiql=False):
+        if self.batch:
+            self.start_operation(request)
+            try:
+                return self.get_operation_response(request, data)
+            except HttpError as e:
+                # The entry fails alone: its error goes in its slot.
+                status_code = e.response.status_code
+                response = {
+                    "errors": [self.format_error(e)],
+                    "id": data.get("id"),
+                    "status": status_code,
+                }
+                return self.json_encode(request, response), status_code
+        return self.get_operation_response(request, data, show_graphiql)
+
+    def get_operation_response(self, request, data, show_graphiql=False):
+        """Execute one operation and return its JSON body and status code."""
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.build_response(request, execution_result, id, show_graphiql)
+
+    def build_response(self, request, execution_result, id, show_graphiql=False):
+        """Return the JSON body and status code of an execution result."""
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if not execution_result:
+            return None, status_code
+
+        response = {}
+
+        if execution_result.errors:
+            set_rollback()
+            # Not worth keeping, even a partial result.
+            request.__dict__.pop("crm_max_age", None)
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+
+        if execution_result.errors and any(
+            not getattr(e, "path", None) for e in execution_result.errors
+        ):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+            if request.method == "GET" and hasattr(request, "crm_max_age"):
+                # The extensions differ on every request: hash the data only,
+                # for a weak ETag.
+                request.crm_etag = hashlib.sha256(
+                    self.json_encode(request, execution_result.data).encode("utf-8")
+                ).hexdigest()
+
+        extensions = self.get_extensions(request)
+        if extensions:
+            response["extensions"] = extensions
+
+        if self.batch:
+            response["id"] = id
+            response["status"] = status_code
+
+        return self.json_encode(request, response, pretty=show_graphiql), status_code
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        operation, result = self.prepare_operation(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        if operation is None:
+            return result
+
+        key = self.get_batch_key(request, operation)
+        if key is not None and key in request.crm_batch_results:
+            request.crm_batch_reused = True
+            return request.crm_batch_results[key]
+
+        result = self.execute_operation(request, operation)
+        self.store_result(operation, result)
+        if key is not None:
+            request.crm_batch_results[key] = result
+            request.crm_batch_reused = False
+        return result
+
+    def get_batch_key(self, request, operation):
+        """
+        Return the key under which a query of a batch is kept for the
+        identical queries after it, or None outside batches.
+        """
+        if (
+            not self.batch
+            or operation.operation_ast is None
+            or operation.operation_ast.operation != OperationType.QUERY
+        ):
+            return None
+        variables = json.dumps(operation.variables, sort_keys=True, default=str)
+        return operation.query, variables, operation.operation_name
+
+    def prepare_operation(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        """
+        Resolve, validate, cost and route the requested operation.
+        Return ``(operation, None)`` when it must run, or ``(None, result)``
+        when the result is already known: an error, a cached response, or
+        nothing for GraphiQL.
+        """
+        persisted_hash = self.get_persisted_query_hash(request, data)
+        if persisted_hash:
+            if query:
+                if query_hash(query) != persisted_hash:
+                    return None, ExecutionResult(
+                        errors=[GraphQLError("provided sha does not match query")]
+                    )
+                persisted_queries.set(persisted_hash, query)
+            else:
+                query = persisted_queries.get(persisted_hash)
+                if query is None:
+                    return None, ExecutionResult(
+                        errors=[
+                            GraphQLError(
+                                "PersistedQueryNotFound",
+                                extensions={"code": "PERSISTED_QUERY_NOT_FOUND"},
+                            )
+                        ]
+                    )
+
+        if not query:
+            if show_graphiql:
+                return None, None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return None, ExecutionResult(data=None, errors=schema_validation_errors)
+
+        try:
+            document, validation_errors, hit = get_document(
+                schema,
+                query,
+                self.validation_rules,
+                graphene_settings.MAX_VALIDATION_ERRORS,
+            )
+        except Exception as e:
+            return None, ExecutionResult(errors=[e])
+        request.crm_document_cache_hit = hit
+
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None, None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        if validation_errors:
+            return None, ExecutionResult(data=None, errors=validation_errors)
+
+        if operation_ast is not None:
+            cost = query_cost.analyze(schema, document, operation_ast, variables)
+            request.crm_query_cost = cost
+            cost_error = query_cost.check(cost, self.get_client_id(request))
+            if cost_error:
+                return None, ExecutionResult(
+                    errors=[
+                        GraphQLError(
+                            cost_error, extensions={"code": "QUERY_COST_EXCEEDED"}
+                        )
+                    ]
+                )
+
+        if operation_ast is not None and operation_ast.operation == OperationType.QUERY:
+            request.crm_max_age = self.get_max_age(operation_ast)
+
+        cache_key = None
+        if (
+            response_cache.is_enabled()
+            and operation_ast is not None
+            and operation_ast.operation == OperationType.QUERY
+        ):
+            cache_key = response_cache.make_key(
+                schema, document, operation_ast, variables, self.get_viewer(request)
+            )
+            cached = response_cache.lookup(cache_key)
+            request.crm_response_cache_hit = cached is not None
+            if cached is not None:
+                return None, ExecutionResult(data=cached)
+
+        # Queries may read from the replica, everything else from the primary.
+        database = DEFAULT_DB_ALIAS
+        if operation_ast is not None:
+            database = routers.database_for_operation(
+                operation_ast.operation, self.get_client_id(request)
+            )
+        request.crm_database = database
+
+        operation = Operation(
+            query,
+            document,
+            operation_ast,
+            variables,
+            operation_name,
+            cache_key,
+            database,
+        )
+        return operation, None
+
+    def execute_operation(self, request, operation, document=None):
+        """
+        Execute ``operation``, or ``document`` (a part of it) when given, on
+        the database it was routed to.
+        """
+        schema = self.schema.graphql_schema
+        operation_ast = operation.operation_ast
+
+        with routers.read_from(operation.database):
+            try:
+                execute_options = {
+                    "root_value": self.get_root_value(request),
+                    "context_value": self.get_context(request),
+                    "variable_values": operation.variables,
+                    "operation_name": operation.operation_name,
+                    "middleware": self.get_middleware(request),
+                }
+                if self.execution_context_class:
+                    execute_options["execution_context_class"] = (
+                        self.execution_context_class
+                    )
+
+                if (
+                    operation_ast is not None
+                    and operation_ast.operation == OperationType.MUTATION
+                    and (
+                        graphene_settings.ATOMIC_MUTATIONS is True
+                        or connection.settings_dict.get("ATOMIC_MUTATIONS", False)
+                        is True
+                    )
+                ):
+                    with transaction.atomic():
+                        result = execute(
+                            schema, document or operation.document, **execute_options
+                        )
+                        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                            transaction.set_rollback(True)
+                    self.stick(request, operation_ast)
+                    return result
+
+                result = execute(
+                    schema, document or operation.document, **execute_options
+                )
+                self.stick(request, operation_ast)
+                return result
+            except Exception as e:
+                return ExecutionResult(errors=[e])
+
+    @staticmethod
+    def store_result(operation, result):
+        """Keep a successful query result in the response cache."""
+        if operation.cache_key is not None and not result.errors:
+            response_cache.store(operation.cache_key, result.data)
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """
+    Async GraphQL view for ASGI deployments.
+    The resolvers stay synchronous and run in a bounded thread pool
+    (CRM_ASYNC_THREADS), so the event loop never waits on the database.
+    The root fields of a query run concurrently, each in its own thread,
+    sharing the request DataLoaders; a mutation runs as a whole in one
+    thread, so its fields stay serial and in one transaction.
+    GraphiQL and batched requests run through the synchronous view, in one
+    pool thread, and every response sets the CSRF cookie, as it does.
+    """
+
+    view_is_async = True
+
+    @method_decorator(ensure_csrf_cookie)
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in ("get", "post"):
+            return await run_in_pool(super().dispatch, request, *args, **kwargs)
+
+        try:
+            data = self.parse_body(request)
+            show_graphiql = self.graphiql and self.can_display_graphiql(request, data)
+            if show_graphiql or self.batch:
+                return await run_in_pool(super().dispatch, request, *args, **kwargs)
+
+            result, status_code = await self.get_response_async(request, data)
+            response = HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+        return self.add_cache_headers(request, response)
+
+    async def get_response_async(self, request, data):
+        """Execute the request and return its JSON body and status code."""
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = await self.execute_graphql_request_async(
+            request, data, query, variables, operation_name
+        )
+        return self.build_response(request, execution_result, id)
+
+    async def execute_graphql_request_async(
+        self, request, data, query, variables, operation_name
+    ):
+        """Prepare the operation, then run its root fields concurrently."""
+        operation, result = await run_in_pool(
+            self.prepare_operation, request, data, query, variables, operation_name
+        )
+        if operation is None:
+            return result
+
+        documents = split_root_fields(operation)
+        if len(documents) > 1:
+            # Check the variables before splitting, so invalid ones are
+            # reported once rather than once per root field. Each root field
+            # still coerces them itself: execute() only takes raw values.
+            values = get_variable_values(
+                self.schema.graphql_schema,
+                operation.operation_ast.variable_definitions or (),
+                operation.variables or {},
+            )
+            if isinstance(values, list):
+                return ExecutionResult(data=None, errors=values)
+        # Bind the loaders before the root fields share them across threads.
+        loaders_for(self.get_context(request))
+        results = await asyncio.gather(
+            *(
+                run_in_pool(self.execute_operation, request, operation, document)
+                for document in documents
+            )
+        )
+
+        result = merge_results(results)
+        if operation.cache_key is not None:
+            await run_in_pool(self.store_result, operation, result)
+        return result
+
+
+@require_GET
+def export(request, kind):
+    """
+    Stream the orders, customers or products matching the filter arguments
+    of the query string as NDJSON (default) or CSV (``format=csv``);
+    ``chunk_size`` sets the rows read per database round trip.
+    """
+    params = request.GET.copy()
+    output_format = params.pop("format", ["ndjson"])[-1]
+    try:
+        chunk_size = params.pop("chunk_size", None)
+        lines = export_lines(
+            kind,
+            params,
+            output_format,
+            int(chunk_size[-1]) if chunk_size else None,
+        )
+    except ValueError as e:
+        return JsonResponse({"errors": [{"message": str(e)}]}, status=400)
+
+    response = StreamingHttpResponse(lines, content_type=FORMATS[output_format])
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{output_format}"'
+    return response